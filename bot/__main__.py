@@ -4,7 +4,8 @@
 
 Функционал:
     (СисАдмин) Фиксация даты замены очередного картриджа
-    TODO (СисАдмин) Фиксация моделей и количества привезенных картриджей
+    (СисАдмин) Статистика расхода картриджей и ежедневное напоминание о скорой замене
+    (СисАдмин) Фиксация моделей и количества привезенных картриджей, остатки на складе
     (СисАдмин) Создание индивидуальных таблиц с оценками для рассылки по классам
     TODO Создание и подтверждение заявки на урок или мероприятие в Актовом зале
     Создание заявки на техническое обслуживание
@@ -22,7 +23,8 @@ import logging
 
 from telegram import Update
 from telegram.constants import ParseMode
-from telegram.ext import (ApplicationBuilder,
+from telegram.ext import (Application,
+                          ApplicationBuilder,
                           CommandHandler,
                           MessageHandler,
                           CallbackQueryHandler,
@@ -30,15 +32,30 @@ from telegram.ext import (ApplicationBuilder,
                           filters)
 
 from bot.settings import Config
+from bot.database import sheets
 from bot.utils.users import get_users_from_table
+from bot.models.task import Task
+from bot.batch_writer import writer
+from bot.journal import journal
 import bot.handlers as handlers
+import bot.repository as repository
+import bot.storage as storage
+from bot.archiver import archive
+from bot.cartridge_stats import update_stats
+from bot.mirror import mirror
+from bot.sync import sync_tasks
+from bot.utils import background
 
 
 logger = logging.getLogger('bot')
 
 
 COMMAND_HANDLERS = {
-    ('start', 'help'): handlers.start
+    ('start', 'help'): handlers.start,
+    'metrics': handlers.show_metrics,
+    'reload_printers': handlers.reload_printers,
+    'printer': handlers.show_printer,
+    'cartridge_stats': handlers.show_cartridge_stats,
 }
 
 CALLBACK_QUERY_HANDLERS = {
@@ -61,7 +78,8 @@ def run_support_bot():
     """Запускает бота @help_admin_1060_bot
     """
     app = ApplicationBuilder().token(
-        Config.ECHO_TOKEN if Config.APP_ENV == 'dev' else Config.BOT_TOKEN).build()
+        Config.ECHO_TOKEN if Config.APP_ENV == 'dev' else Config.BOT_TOKEN
+    ).post_init(on_startup).post_shutdown(on_shutdown).build()
 
     for command_name, command_handler in COMMAND_HANDLERS.items():
         app.add_handler(CommandHandler(command_name, command_handler))
@@ -84,7 +102,14 @@ def run_support_bot():
 
     app.add_error_handler(handlers.error_handler)
 
+    sheets.warm_up(Config.TASKS_GSHEET_KEY, Config.PRINTERS_GSHEET_KEY)
     get_users_from_table(app)
+    try:
+        journal.replay()  # Изменения, которые не дошли до таблицы до прошлой остановки бота
+        writer.flush()
+    except Exception as e:
+        logger.error(f'Journal replay on startup failed: {e}', exc_info=True)
+    Task.load_index()
     # TODO сделать кастомный контекст с уже созданными словарями new_users и new_tasks
     app.bot_data['new_users'] = {}
     app.bot_data['new_tasks'] = {}
@@ -92,6 +117,28 @@ def run_support_bot():
     app.run_polling()
 
 
+async def on_startup(app: Application) -> None:
+    background.run_periodically(sync_tasks, Config.SYNC_INTERVAL, 'sync_tasks')
+    background.run_periodically(repository.replay_journal, Config.JOURNAL_REPLAY_INTERVAL, 'journal_replay')
+    background.run_periodically(lambda: handlers.report_journal_failures(app), Config.JOURNAL_REPLAY_INTERVAL,
+                                'journal_alerts')
+    background.run_periodically(repository.refresh_users, Config.USERS_REFRESH_INTERVAL, 'users_refresh')
+    background.run_periodically(repository.reload_printers, Config.PRINTERS_REGISTRY_TTL, 'printers_reload', first=0)
+    background.run_periodically(update_stats, Config.CARTRIDGE_STATS_INTERVAL, 'cartridge_stats', first=Config.SYNC_INTERVAL)
+    if Config.CARTRIDGE_REMIND_DAYS:
+        background.run_periodically(lambda: handlers.send_cartridge_forecast(app), 24 * 60 * 60, 'cartridge_reminder',
+                                    first=background.seconds_until(Config.CARTRIDGE_REMIND_HOUR))
+    if storage.store:
+        background.run_periodically(mirror, Config.MIRROR_INTERVAL, 'mirror', first=0)
+    if Config.ARCHIVE_AFTER_DAYS:
+        background.run_periodically(archive, Config.ARCHIVE_INTERVAL, 'archive', first=Config.SYNC_INTERVAL)
+
+
+async def on_shutdown(app: Application) -> None:
+    await background.stop_all()
+    repository.shutdown()
+
+
 async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     update_str = update.to_dict() if isinstance(update, Update) else str(update)
     message = (
@@ -0,0 +1,171 @@
+"""
+Перенос закрытых задач в архив
+
+Лист задач только растет, а каждое полное чтение (синхронизация, get_all_tasks) становится медленнее.
+Раз в ARCHIVE_INTERVAL секунд задачи со статусом "Выполнено" или "Отменено", закрытые больше ARCHIVE_AFTER_DAYS
+дней назад, переносятся на лист архива того триместра, в котором они закрыты (название - ARCHIVE_TITLE),
+в той же таблице "Задачи Admin 1060". За один запуск переносится не больше ARCHIVE_BATCH задач.
+
+Номера задач не меняются: в архив и в оставшиеся строки листа задач номер записывается числом
+(старые формулы =СТРОКА() сдвинулись бы при удалении строк). Задача с самым большим номером
+в архив не уходит - по ней счетчик номеров (bot.models.task_ids) продолжает нумерацию после перезапуска.
+
+Архивация идет, только когда очередь записи пуста и в журнале (bot.journal) нет неподтвержденных изменений -
+они ссылаются на номера строк. Порядок шагов:
+    1. строки перечитываются из таблицы и сверяются с индексом (иначе архивация откладывается до синхронизации)
+    2. строки дописываются на листы архива - задачи, которые уже есть в архиве, пропускаются,
+       поэтому после сбоя на следующих шагах повтор не создаст дублей
+    3. номера оставшихся задач ниже первой удаляемой строки записываются числом
+    4. под TaskIndex.rows_lock еще раз проверяется, что задачи не менялись и очередь пуста,
+       строки удаляются одним запросом, индекс и SQLite переходят на новые номера строк
+Шаги 1-3 идут без блокировки: бот в это время принимает и записывает задачи как обычно.
+
+Метрики:
+    tasks_archived          - сколько задач перенесено в архив
+    tasks_archived_at       - когда (unix time) архивация последний раз переносила задачи
+"""
+import bisect
+import logging
+from datetime import datetime, timedelta
+
+import bot.database as database
+import bot.repository as repository
+import bot.storage as storage
+from bot import quota
+from bot.batch_writer import writer
+from bot.journal import journal
+from bot.models.task import Task
+from bot.models.task_codec import get_codec
+from bot.models.task_index import task_index
+from bot.settings import Config
+from bot.utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+def trimester_title(day: datetime) -> str:
+    """
+    returns the title of the archive sheet for a day: учебный год начинается 1 сентября,
+    триместры - сентябрь-ноябрь, декабрь-февраль, март-август
+    """
+    year = day.year if day.month >= 9 else day.year - 1
+    trimester = 1 if day.month in (9, 10, 11) else 2 if day.month in (12, 1, 2) else 3
+    return Config.ARCHIVE_TITLE.format(trimester=trimester, start=year % 100, end=(year + 1) % 100)
+
+
+def find_closed(now: datetime | None = None) -> list[Task]:
+    """
+    returns the tasks which should be moved to the archive, the oldest rows first
+    """
+    deadline = (now or datetime.now()) - timedelta(days=Config.ARCHIVE_AFTER_DAYS)
+    last_id = max((task.task_id for task in task_index.find()), default=0)
+    closed = [task for task in task_index.find(status=[Config.STATUS_COMPLETED, Config.STATUS_CANCELED])
+              if isinstance(task.completed_at, datetime) and task.completed_at < deadline and task.task_id != last_id]
+    closed.sort(key=lambda task: task_index.row_of(task.task_id))
+    return closed[:Config.ARCHIVE_BATCH]
+
+
+def _archive_sheet(title: str, header: list[str]):
+    spreadsheet = database.task_table
+    for worksheet in spreadsheet.worksheets():
+        if worksheet.title == title:
+            return worksheet
+    logger.info(f'Creating the archive sheet {title}')
+    worksheet = spreadsheet.add_worksheet(title, rows=Config.ARCHIVE_BATCH + 1, cols=len(header))
+    worksheet.update_row(1, header)
+    return worksheet
+
+
+def _append_to_archive(title: str, header: list[str], rows: list[list]) -> None:
+    worksheet = _archive_sheet(title, header)
+    id_column = get_codec().columns['task_id']
+    archived = set(worksheet.get_col(id_column, include_tailing_empty=False)[1:])
+    rows = [values for values in rows if str(values[id_column - 1]) not in archived]
+    if rows:
+        worksheet.append_table(rows, start='A1', dimension='ROWS', overwrite=False)
+    logger.info(f'{len(rows)} tasks are added to {title}')
+
+
+def archive_closed(now: datetime | None = None) -> int:
+    """
+    Переносит закрытые задачи в архив. Выполняется в пуле потоков
+
+    :return: сколько задач перенесено
+    """
+    if not Config.ARCHIVE_AFTER_DAYS or not task_index.loaded:
+        return 0
+    if not find_closed(now):
+        return 0
+    writer.flush()
+    if not _writes_done():
+        logger.info('Task changes are not written to the table yet, archiving is postponed')
+        return 0
+    generation, since = task_index.generation, task_index.local_version
+    closed = {task_index.row_of(task.task_id): task for task in find_closed(now)}
+
+    # 1. Строки из таблицы - ровно те задачи, которые в индексе
+    sheet = database.task_sheet
+    codec = get_codec()
+    ranges = database.group_rows(list(closed))
+    blocks = database.batch_get(sheet, [((start, 1), (end, codec.last_column)) for start, end in ranges])
+    cells = {row: values for (start, _), block in zip(ranges, blocks)
+             for row, values in enumerate(block, start=start)}
+    for row, task in closed.items():
+        if codec.task_id(cells.get(row, [])) != task.task_id:
+            logger.warning(f'Row {row} does not hold {task}, archiving is postponed until the next sync')
+            return 0
+
+    # 2. Архив
+    header = sheet.get_row(1, include_tailing_empty=False) or list(Config.task_headers)
+    by_title: dict[str, list[list]] = {}
+    for row, task in sorted(closed.items()):
+        values = list(cells[row]) + [''] * (codec.last_column - len(cells[row]))
+        values[codec.columns['task_id'] - 1] = task.task_id
+        by_title.setdefault(trimester_title(task.completed_at), []).append(values)
+    for title, rows in by_title.items():
+        _append_to_archive(title, header, rows)
+
+    # 3. Номера задач ниже первой удаляемой строки - числом
+    first = min(closed)
+    kept = {row: task_id for row, task_id in task_index.ids_by_row().items() if row > first and row not in closed}
+    id_column = codec.columns['task_id']
+    database.batch_update(sheet.spreadsheet, [
+        {'range': database.a1_range(sheet, (start, id_column), (end, id_column)),
+         'majorDimension': 'ROWS',
+         'values': [[kept.get(row, '')] for row in range(start, end + 1)]}
+        for start, end in database.group_rows(list(kept))
+    ])
+
+    # 4. Удаление строк и новые номера строк - под rows_lock, пока бот не может поставить в очередь запись задачи
+    with task_index.rows_lock:
+        changed = [task for row, task in closed.items()
+                   if task_index.row_of(task.task_id) != row or task_index.is_dirty(task.task_id, since)]
+        if generation != task_index.generation or changed or not _writes_done():
+            logger.info('Tasks were changed while they were archived, archiving is postponed')
+            return 0
+        database.delete_rows(sheet, list(closed))
+        removed_rows = sorted(closed)
+        moves = {task_id: row - bisect.bisect_left(removed_rows, row)
+                 for row, task_id in task_index.ids_by_row().items() if row > first and row not in closed}
+        removed = [task.task_id for task in closed.values()]
+        task_index.move_rows(moves, removed)
+        if storage.store:
+            storage.store.move_rows(moves, removed)
+
+    metrics.inc('tasks_archived', len(removed))
+    metrics.set_value('tasks_archived_at', round(datetime.now().timestamp()))
+    logger.info(f'{len(removed)} closed tasks are moved to the archive: {", ".join(by_title)}')
+    return len(removed)
+
+
+def _writes_done() -> bool:
+    """
+    True, если все изменения задач уже в таблице: записи ссылаются на номера строк
+    """
+    return writer.barrier().done() and not journal.pending_count and not (storage.store and storage.store.dirty_tasks())
+
+
+async def archive() -> None:
+    with quota.lane(quota.BACKGROUND):
+        await repository.run_blocking(archive_closed)
@@ -0,0 +1,342 @@
+"""
+Отложенная пакетная запись в Google-Таблицы
+
+Вместо отдельного запроса на каждое изменение записи копятся в очереди и уходят в таблицу
+одним запросом values.batchUpdate - раз в BATCH_WRITE_INTERVAL секунд
+или сразу, как только в очереди набралось BATCH_WRITE_MAX_SIZE диапазонов.
+
+Повторная запись в тот же диапазон до отправки заменяет предыдущую.
+К записи можно приложить проверку (guard): она выполняется прямо перед отправкой,
+и если бросает исключение, запись отклоняется, а остальные уходят в таблицу.
+Каждый вызов submit возвращает concurrent.futures.Future, который завершается,
+когда запрос к таблице выполнен (или с исключением, если он не удался).
+Если Google недоступен (bot.resilience.SheetsUnavailable), записи остаются в очереди
+и отправляются снова, когда выключатель разрешит следующую попытку.
+В асинхронном коде его можно ждать через asyncio.wrap_future.
+
+Каждая запись помнит полосу планировщика квоты (bot.quota), из которой ее поставили в очередь:
+записи из фоновых задач отправляются отдельным запросом в полосе BACKGROUND и не задерживают действия
+пользователей. Если в один диапазон пишут обе полосы, запись идет как INTERACTIVE.
+"""
+import logging
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+
+import pygsheets
+
+import bot.database as database
+from bot import quota
+from bot.resilience import SheetsUnavailable, breaker
+from bot.settings import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+class PendingWrite:
+    def __init__(self,
+                 worksheet: pygsheets.Worksheet,
+                 label: str,
+                 values: list[list],
+                 guard: Callable[[], None] | None = None):
+        self.worksheet = worksheet
+        self.label = label
+        self.values = values
+        self.guard = guard
+        self.lane = quota.current_lane.get()  # Полоса того, кто поставил запись в очередь
+        self.futures: list[Future] = [Future()]
+
+    def merge(self, older: 'PendingWrite') -> None:
+        """
+        Забирает ожидающих и проверку более старой записи в тот же диапазон, которую эта запись заменяет
+        """
+        self.futures += older.futures
+        self.guard = self.guard or older.guard
+        self.lane = min(self.lane, older.lane)
+
+    def resolve(self, error: Exception | None = None) -> None:
+        """
+        Сообщает результат записи всем ожидающим. Future, которые уже отменены (бот останавливается), пропускаются
+        """
+        for future in self.futures:
+            if not future.set_running_or_notify_cancel():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(None)
+
+
+def gather(futures: list[Future]) -> Future:
+    """
+    returns a Future which is done when all <futures> are done: with None or the exception of the first failed one
+    """
+    if len(futures) == 1:
+        return futures[0]
+    done = Future()
+    remaining = len(futures)
+    lock = threading.Lock()
+
+    def one_done(_: Future) -> None:
+        nonlocal remaining
+        with lock:
+            remaining -= 1
+            if remaining:
+                return
+        errors = [future.exception() for future in futures if not future.cancelled() and future.exception()]
+        if errors:
+            done.set_exception(errors[0])
+        else:
+            done.set_result(None)
+
+    if not futures:
+        done.set_result(None)
+    for future in futures:
+        future.add_done_callback(one_done)
+    return done
+
+
+class BatchWriter:
+    def __init__(self, interval: float = Config.BATCH_WRITE_INTERVAL, max_size: int = Config.BATCH_WRITE_MAX_SIZE):
+        self.interval = interval
+        self.max_size = max_size
+        self._pending: dict[tuple[str, str], PendingWrite] = {}  # (id таблицы, диапазон) -> запись
+        self._first_at: float | None = None  # Когда в пустую очередь попала первая запись
+        self._paused_until = 0.0  # Не отправлять записи раньше этого времени - Google недоступен
+        self._unwritten: set[Future] = set()  # Future записей, которые еще не ушли в таблицу (и не отклонены)
+        self._unwritten_lock = threading.Lock()  # Только для _unwritten: его берут колбэки Future
+        self.queued_count = 0  # Сколько диапазонов всего поставлено в очередь - по нему видно, были ли новые записи
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+
+    def submit(self,
+               worksheet: pygsheets.Worksheet,
+               start: tuple[int, int],
+               values: list[list],
+               ) -> Future:
+        """
+        Ставит в очередь запись <values> в диапазон листа <worksheet>, начинающийся с ячейки <start>
+
+        :param worksheet: лист, в который идет запись
+        :param start: (строка, столбец) левой верхней ячейки диапазона
+        :param values: список строк, каждая строка - список значений
+        :return: Future, который завершится после записи в таблицу
+        """
+        return self.submit_many(worksheet, [(start, values)])
+
+    def submit_many(self,
+                    worksheet: pygsheets.Worksheet,
+                    writes: list[tuple[tuple[int, int], list[list]]],
+                    guard: Callable[[], None] | None = None,
+                    ) -> Future:
+        """
+        Ставит в очередь несколько диапазонов одного листа так, что они гарантированно уйдут одним запросом
+
+        :param writes: список пар (левая верхняя ячейка, значения) - как аргументы submit
+        :param guard: проверка перед отправкой; если она бросает исключение, диапазоны не записываются,
+            а Future завершается с этим исключением
+        :return: Future, который завершится после записи всех диапазонов
+        """
+        if not writes:
+            return gather([])
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError('BatchWriter is stopped')
+            futures = [self._queue(worksheet, start, values, guard) for start, values in writes]
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+            self._ensure_started()
+            self._cond.notify()
+        logger.debug(f'Queued {len(writes)} ranges, {len(self._pending)} ranges pending')
+        return gather(futures)
+
+    def submit_cells(self,
+                     worksheet: pygsheets.Worksheet,
+                     row: int,
+                     cells: dict[int, object],
+                     guard: Callable[[], None] | None = None,
+                     ) -> Future:
+        """
+        Ставит в очередь ячейки одной строки. Соседние столбцы объединяются в один диапазон: {7, 8, 9, 11} -> G:I, K
+
+        :param cells: словарь вида номер столбца: значение
+        :param guard: как в submit_many
+        :return: Future, который завершится после записи всех ячеек
+        """
+        ranges = []
+        for col in sorted(cells):
+            if ranges and ranges[-1][-1] == col - 1:
+                ranges[-1].append(col)
+            else:
+                ranges.append([col])
+        writes = [((row, cols[0]), [[cells[col] for col in cols]]) for cols in ranges]
+        return self.submit_many(worksheet, writes, guard=guard)
+
+    def _queue(self,
+               worksheet: pygsheets.Worksheet,
+               start: tuple[int, int],
+               values: list[list],
+               guard: Callable[[], None] | None) -> Future:
+        end = (start[0] + len(values) - 1, start[1] + max(len(row) for row in values) - 1)
+        label = database.a1_range(worksheet, start, end)
+        key = (worksheet.spreadsheet.id, label)
+        write = PendingWrite(worksheet, label, values, guard)
+        previous = self._pending.pop(key, None)
+        if previous:
+            # Старое значение диапазона так и не ушло в таблицу - его заменяет новое
+            write.merge(previous)
+        self._pending[key] = write
+        self.queued_count += 1
+        future = write.futures[0]
+        with self._unwritten_lock:
+            self._unwritten.add(future)
+        future.add_done_callback(self._written)
+        return future
+
+    def _written(self, future: Future) -> None:
+        with self._unwritten_lock:
+            self._unwritten.discard(future)
+
+    def barrier(self) -> Future:
+        """
+        Возвращает Future, который завершится, когда завершатся все записи, уже поставленные в очередь,
+        в том числе отправляемые прямо сейчас и отложенные до восстановления Google.
+        Если какая-то из них не удалась, Future завершится с ее исключением
+        """
+        with self._unwritten_lock:
+            return gather(list(self._unwritten))
+
+    def flush(self) -> None:
+        """
+        Немедленно отправляет все накопленные записи
+        """
+        with self._cond:
+            batch = self._take_batch()
+        self._write(batch)
+
+    def shutdown(self) -> None:
+        """
+        Отправляет оставшиеся записи и останавливает фоновый поток
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread:
+            thread.join()
+        self.flush()
+        if self._pending:
+            logger.error(f'{len(self._pending)} ranges are not written to the table: Google API is unavailable')
+
+    def _ensure_started(self) -> None:
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name='gsheets-batch-writer', daemon=True)
+            self._thread.start()
+
+    def _take_batch(self) -> list[PendingWrite]:
+        batch = list(self._pending.values())
+        self._pending = {}
+        self._first_at = None
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                deadline = max(self._first_at + self.interval, self._paused_until)
+                while (len(self._pending) < self.max_size or time.monotonic() < self._paused_until) \
+                        and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+            self._write(batch)
+
+    def _write(self, batch: list[PendingWrite]) -> None:
+        by_spreadsheet: dict[tuple[int, str], list[PendingWrite]] = {}
+        for write in batch:
+            by_spreadsheet.setdefault((write.lane, write.worksheet.spreadsheet.id), []).append(write)
+
+        for (lane, _), writes in sorted(by_spreadsheet.items(), key=lambda item: item[0][0]):  # INTERACTIVE первыми
+            with quota.lane(lane):
+                self._write_spreadsheet(writes)
+
+    def _write_spreadsheet(self, writes: list[PendingWrite]) -> None:
+        """
+        Отправляет записи одной таблицы из одной полосы одним запросом
+        """
+        spreadsheet = writes[0].worksheet.spreadsheet
+        writes = self._check_guards(writes)
+        if not writes:
+            return
+        data = [{'range': write.label, 'majorDimension': 'ROWS', 'values': write.values} for write in writes]
+        try:
+            database.batch_update(spreadsheet, data)
+        except SheetsUnavailable as e:
+            logger.warning(f'Batch update of {len(data)} ranges is postponed: {e}')
+            self._requeue(writes)
+        except Exception as e:
+            logger.error(f'Batch update of {len(data)} ranges failed: {e}', exc_info=True)
+            for write in writes:
+                write.resolve(e)
+        else:
+            logger.info(f'Flushed {len(data)} ranges to {spreadsheet.title}')
+            for write in writes:
+                write.resolve()
+
+    def _requeue(self, writes: list[PendingWrite]) -> None:
+        """
+        Возвращает в очередь записи, которые не удалось отправить. Более новые записи в те же диапазоны важнее
+        """
+        with self._cond:
+            for write in writes:
+                key = (write.worksheet.spreadsheet.id, write.label)
+                newer = self._pending.get(key)
+                if newer:
+                    newer.merge(write)
+                else:
+                    self._pending[key] = write
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+            self._paused_until = time.monotonic() + max(breaker.retry_in(), self.interval)
+            self._cond.notify()
+
+    def _check_guards(self, writes: list[PendingWrite]) -> list[PendingWrite]:
+        """
+        returns the writes which passed their guards
+        """
+        checked = []
+        for i, write in enumerate(writes):
+            try:
+                if self._check_guard(write):
+                    checked.append(write)
+            except SheetsUnavailable as e:
+                # Проверку не выполнить, пока Google недоступен - весь пакет ждет следующей попытки
+                logger.warning(f'Batch update of {len(writes)} ranges is postponed: {e}')
+                self._requeue(checked + writes[i:])
+                return []
+        return checked
+
+    @staticmethod
+    def _check_guard(write: PendingWrite) -> bool:
+        if not write.guard:
+            return True
+        try:
+            write.guard()
+        except SheetsUnavailable:
+            raise
+        except Exception as e:
+            logger.warning(f'Write to {write.label} is rejected: {e}')
+            write.resolve(e)
+            return False
+        return True
+
+
+writer = BatchWriter()
@@ -0,0 +1,330 @@
+"""
+Статистика расхода картриджей по Реестру принтеров
+
+Даты замен (столбец Printers.CHANGE_COLUMN) всех принтеров читаются одним запросом values.batchGet,
+а ресурс картриджа бот считает сам по разностям соседних дат - вместо формул рядом с датами на каждом листе.
+Статистика собирается по принтерам, по моделям картриджей (карточки bot.models.printer) и по этажам:
+    - сколько всего замен и сколько за последние 12 месяцев
+    - средний ресурс картриджа в месяцах
+    - последняя замена
+
+Отчет хранится в памяти: команда /cartridge_stats отвечает сразу. Раз в CARTRIDGE_STATS_INTERVAL секунд
+истории перечитываются, а отчет записывается на лист Summary одним запросом values.batchUpdate.
+Отчет занимает свой блок с левым верхним углом в CARTRIDGE_STATS_CELL, остальной лист ведут люди. Высота блока
+хранится в его первой строке: следующий отчет, даже после перезапуска бота, очищает только строки прошлого отчета.
+Замена, которую регистрирует бот (record_change), попадает в отчет сразу, без чтения таблицы.
+
+Прогноз следующей замены (forecast) считается по тем же историям для всего парка за один проход:
+последняя замена + средний ресурс картриджа этого принтера, а если замена была одна - средний ресурс
+той же модели картриджа или всего парка. Раз в день в CARTRIDGE_REMIND_HOUR часов админы получают список
+принтеров, которым замена понадобится в ближайшие CARTRIDGE_REMIND_DAYS дней, и какие картриджи взять с собой.
+
+Метрики:
+    cartridge_stats_changes       - сколько замен картриджей в истории
+    cartridge_stats_computed_at   - когда (unix time) статистика последний раз пересчитывалась
+"""
+import logging
+import re
+import statistics
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+import bot.database as database
+import bot.repository as repository
+from bot import quota
+from bot.gsheets_connector import Printers, printers
+from bot.models.printer import Printer
+from bot.settings import Config
+from bot.utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+DAYS_IN_MONTH = 365.25 / 12
+YEAR_DAYS = 365
+
+
+def parse_dates(values: list[list]) -> list[date]:
+    """
+    returns the dates ДД.ММ.ГГГГ from a column block in order; заголовки и пустые ячейки пропускаются
+    """
+    dates = []
+    for row in values:
+        try:
+            dates.append(datetime.strptime(str(row[0]).strip(), '%d.%m.%Y').date())
+        except (IndexError, ValueError):
+            continue
+    return dates
+
+
+@dataclass
+class PrinterStats:
+    room: str
+    device: str
+    cartridge: str
+    dates: list[date]
+
+    @property
+    def title(self) -> str:
+        return f'{self.room} {self.device}'
+
+    @property
+    def floor(self) -> str:
+        return self.room[:1]
+
+    @property
+    def lifetimes(self) -> list[int]:
+        """
+        returns the lifetimes (in days) of every replaced cartridge: разности соседних дат замен
+        """
+        ordinals = sorted(day.toordinal() for day in self.dates)
+        return [end - start for start, end in zip(ordinals, ordinals[1:])]
+
+    @property
+    def last_change(self) -> date | None:
+        return max(self.dates, default=None)
+
+    def changes_since(self, day: date) -> int:
+        return sum(1 for change in self.dates if change > day)
+
+
+@dataclass
+class GroupStats:
+    name: str
+    printers: int = 0
+    changes: int = 0
+    last_year: int = 0
+    lifetimes: list[int] = field(default_factory=list)
+    last_change: date | None = None
+
+    @property
+    def mean_months(self) -> float | None:
+        """
+        returns the mean cartridge lifetime in months or None if no cartridge was replaced twice
+        """
+        if not self.lifetimes:
+            return None
+        return round(statistics.fmean(self.lifetimes) / DAYS_IN_MONTH, 1)
+
+    def add(self, printer: PrinterStats, year_ago: date) -> None:
+        self.printers += 1
+        self.changes += len(printer.dates)
+        self.last_year += printer.changes_since(year_ago)
+        self.lifetimes += printer.lifetimes
+        if printer.last_change and (not self.last_change or printer.last_change > self.last_change):
+            self.last_change = printer.last_change
+
+
+@dataclass
+class CartridgeReport:
+    by_printer: list[GroupStats]
+    by_model: list[GroupStats]
+    by_floor: list[GroupStats]
+    computed_at: datetime
+
+    HEADER = ['', 'Принтеров', 'Замен', 'Замен за 12 мес', 'Средний ресурс, мес', 'Последняя замена']
+    HEIGHT_LABEL = 'Строк в отчете'  # В первой строке отчета рядом с его высотой
+
+    def rows(self) -> list[list]:
+        """
+        returns the report as rows for the Summary sheet: три таблицы одна под другой,
+        в конце первой строки - высота отчета
+        """
+        title = [f'Расход картриджей на {self.computed_at.strftime(Config.TIMESTAMP)}']
+        rows = [title + [''] * (len(self.HEADER) - 3) + [self.HEIGHT_LABEL]]
+        for title, groups in (('Принтер', self.by_printer),
+                              ('Модель картриджа', self.by_model),
+                              ('Этаж', self.by_floor)):
+            rows += [[], [title] + self.HEADER[1:]]
+            rows += [[group.name, group.printers, group.changes, group.last_year,
+                      '' if group.mean_months is None else group.mean_months,
+                      group.last_change.strftime('%d.%m.%Y') if group.last_change else '']
+                     for group in groups]
+        rows[0].append(len(rows))
+        return rows
+
+
+def compute(stats: list[PrinterStats], today: date | None = None) -> CartridgeReport:
+    """
+    Собирает статистику по принтерам, моделям картриджей и этажам
+    """
+    today = today or date.today()
+    year_ago = date.fromordinal(today.toordinal() - YEAR_DAYS)
+
+    def group_by(key: Callable[[PrinterStats], str], name: Callable[[str], str] = str) -> list[GroupStats]:
+        groups: dict[str, GroupStats] = {}
+        for printer in stats:
+            value = key(printer)
+            groups.setdefault(value, GroupStats(name(value))).add(printer, year_ago)
+        return sorted(groups.values(), key=lambda group: (-group.last_year, -group.changes, group.name))
+
+    return CartridgeReport(
+        by_printer=group_by(lambda printer: printer.title),
+        by_model=group_by(lambda printer: printer.cartridge or 'Не указан'),
+        by_floor=sorted(group_by(lambda printer: printer.floor, lambda floor: f'{floor} этаж'),
+                        key=lambda group: group.name),
+        computed_at=datetime.now(),
+    )
+
+
+@dataclass
+class Forecast:
+    printer: PrinterStats
+    due: date  # Когда картридж, вероятно, закончится
+    lifetime: int  # Ожидаемый ресурс картриджа, дней
+    basis: str  # По чьей истории посчитан ресурс: printer, model или fleet
+
+    @property
+    def overdue(self) -> bool:
+        return self.due < date.today()
+
+
+def forecast(stats: list[PrinterStats]) -> list[Forecast]:
+    """
+    Прогноз следующей замены для всех принтеров, у которых была хотя бы одна замена, - по дате, ближайшие первыми
+    """
+    by_model: dict[str, list[int]] = {}
+    for printer in stats:
+        by_model.setdefault(printer.cartridge, []).extend(printer.lifetimes)
+    fleet = [lifetime for lifetimes in by_model.values() for lifetime in lifetimes]
+
+    forecasts = []
+    for printer in stats:
+        if not printer.dates:
+            continue
+        history = (('printer', printer.lifetimes), ('model', by_model[printer.cartridge]), ('fleet', fleet))
+        for basis, lifetimes in history:
+            if lifetimes:
+                break
+        else:
+            continue  # Во всем парке ни один картридж еще не меняли дважды
+        lifetime = round(statistics.fmean(lifetimes))
+        due = date.fromordinal(printer.last_change.toordinal() + lifetime)
+        forecasts.append(Forecast(printer, due, lifetime, basis))
+    return sorted(forecasts, key=lambda item: (item.due, item.printer.title))
+
+
+def due_within(forecasts: list[Forecast], days: int, today: date | None = None) -> list[Forecast]:
+    """
+    returns the printers which need a new cartridge in <days> days.
+    Принтер, просрочивший замену больше чем на целый ресурс, пропускается - вероятно, им не пользуются
+    """
+    today = (today or date.today()).toordinal()
+    return [item for item in forecasts
+            if item.due.toordinal() <= today + days and item.due.toordinal() + item.lifetime >= today]
+
+
+class CartridgeStats:
+    def __init__(self, registry: Printers):
+        self.printers = registry
+        self.histories: dict[tuple[str, str], PrinterStats] = {}  # (кабинет, принтер) -> даты замен
+        self.report: CartridgeReport | None = None
+        self._summary_rows: int | None = None  # Сколько строк занимает отчет на листе Summary, None - не известно
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Читает даты замен всех принтеров одним запросом values.batchGet. Выполняется в пуле потоков
+        """
+        sheets = [(room, device, sheet)
+                  for room, devices in self.printers._loaded_registry().items() for device, sheet in devices.items()]
+        blocks = database.batch_get_sheets(
+            self.printers.table,
+            [(sheet, (Printers.START_ROW, Printers.CHANGE_COLUMN), (max(sheet.rows, Printers.START_ROW),
+                                                                     Printers.CHANGE_COLUMN))
+             for _, _, sheet in sheets]
+        ) if sheets else []
+        cards = {(printer.room, printer.device): printer
+                 for room in self.printers.registry for printer in self.printers.in_room(room)}
+        histories = {}
+        for (room, device, _), block in zip(sheets, blocks):
+            card = cards.get((room, device)) or Printer(room, device)
+            histories[(room, device)] = PrinterStats(room, device, card.cartridge, parse_dates(block))
+        with self._lock:
+            self.histories = histories
+            self._compute()
+        logger.info(f'Cartridge histories are loaded for {len(histories)} printers')
+
+    def record_change(self, room: str, device: str, day: str | date) -> None:
+        """
+        Добавляет замену, которую записал бот, и пересчитывает отчет без запросов к таблице
+        """
+        if isinstance(day, str):
+            day = datetime.strptime(day, '%d.%m.%Y').date()
+        with self._lock:
+            printer = self.histories.get((room, device))
+            if printer is None:
+                return  # Истории еще не загружены - замена попадет в отчет при загрузке
+            if day not in printer.dates:
+                printer.dates.append(day)
+            self._compute()
+
+    def _compute(self) -> None:
+        self.report = compute(list(self.histories.values()))
+        metrics.set_value('cartridge_stats_changes', sum(len(printer.dates) for printer in self.histories.values()))
+        metrics.set_value('cartridge_stats_computed_at', round(self.report.computed_at.timestamp()))
+
+    def forecast(self) -> list[Forecast]:
+        with self._lock:
+            return forecast(list(self.histories.values()))
+
+    def write_summary(self) -> None:
+        """
+        Записывает отчет в блок бота на листе Summary одним запросом. Очищаются только строки прошлого отчета,
+        если он был длиннее, - ячейки вне блока не меняются
+        """
+        rows = self.report.rows()
+        width = len(CartridgeReport.HEADER)
+        sheet = self.printers.summary_sheet
+        top, left = summary_cell()
+        if self._summary_rows is None:
+            self._summary_rows = self._read_summary_rows(sheet, top, left)
+        height = max(len(rows), self._summary_rows)
+        values = [[*row, *[''] * (width - len(row))] for row in rows] + [[''] * width] * (height - len(rows))
+        database.batch_update(self.printers.table, [{
+            'range': database.a1_range(sheet, (top, left), (top + height - 1, left + width - 1)),
+            'majorDimension': 'ROWS',
+            'values': values,
+        }])
+        self._summary_rows = len(rows)
+        logger.info(f'Cartridge report is written to {sheet.title}: {len(rows)} rows')
+
+    @staticmethod
+    def _read_summary_rows(sheet, top: int, left: int) -> int:
+        """
+        returns the height of the report written before the restart or 0 if the block has no report
+        """
+        width = len(CartridgeReport.HEADER)
+        block, = database.batch_get(sheet, [((top, left + width - 2), (top, left + width - 1))])
+        label, height = (block[0] + ['', ''])[:2] if block else ('', '')
+        if label != CartridgeReport.HEIGHT_LABEL or not str(height).isdigit():
+            return 0
+        return int(height)
+
+
+def summary_cell() -> tuple[int, int]:
+    """
+    returns (row, column) of CARTRIDGE_STATS_CELL, e.g. 'H1' -> (1, 8)
+    """
+    match = re.fullmatch(r'([A-Z]+)([1-9][0-9]*)', Config.CARTRIDGE_STATS_CELL.strip().upper())
+    if not match:
+        raise ValueError(f'CARTRIDGE_STATS_CELL must be a cell like A1, got {Config.CARTRIDGE_STATS_CELL!r}')
+    column = 0
+    for letter in match[1]:
+        column = column * 26 + ord(letter) - ord('A') + 1
+    return int(match[2]), column
+
+
+stats = CartridgeStats(printers)
+
+
+def update() -> None:
+    stats.load()
+    stats.write_summary()
+
+
+async def update_stats() -> None:
+    with quota.lane(quota.BACKGROUND):
+        await repository.run_blocking(update)
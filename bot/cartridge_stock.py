@@ -0,0 +1,156 @@
+"""
+Склад картриджей: сколько картриджей каждой модели есть в наличии
+
+Остатки ведутся в памяти (StockLedger) и меняются на месте: привоз (/cartridge - Привоз) прибавляет картриджи,
+а каждая замена (bot.repository.change_cartridge) списывает один картридж модели из карточки принтера
+(bot.models.printer). Узнать остаток - это обращение к словарю, историю замен перечитывать не нужно.
+
+Остатки хранятся на листе "Картриджи" Реестра принтеров - строка на модель:
+    A - Модель картриджа, B - В наличии, C - Последнее изменение
+Лист читается один раз (и заново по /reload_printers), а изменения уходят в таблицу через очередь
+bot.batch_writer: несколько изменений одной модели до отправки сливаются в одну запись.
+Лист перечитывается, только когда все изменения бота уже в таблице, и под той же блокировкой,
+что и изменения: привоз или замена ждут, пока лист читается, и не теряются при замене остатков.
+В журнал bot.journal записывается остаток, а не разница, поэтому повтор записи ничего не испортит.
+
+Метрики:
+    cartridges_received     - сколько картриджей привезено
+    cartridges_used         - сколько картриджей списано при заменах
+"""
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+
+import bot.database as database
+from bot.batch_writer import writer
+from bot.gsheets_connector import Printers, printers
+from bot.journal import journal
+from bot.settings import Config
+from bot.utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class StockLedger:
+    FIRST_ROW = 2  # Строка 1 - заголовки
+    MODEL_COLUMN, AMOUNT_COLUMN, UPDATED_COLUMN = 1, 2, 3
+    HEADER = ['Модель картриджа', 'В наличии', 'Последнее изменение']
+
+    def __init__(self, registry: Printers):
+        self.printers = registry
+        self._stock: dict[str, int] | None = None  # модель -> в наличии
+        self._rows: dict[str, int] = {}  # модель -> строка на листе "Картриджи"
+        self._lock = threading.RLock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._stock is not None
+
+    def _sheet(self):
+        self.printers._loaded_registry()
+        return self.printers.cartridge_sheet
+
+    def load(self) -> None:
+        """
+        Читает остатки с листа "Картриджи" одним запросом, если они еще не загружены. Выполняется в пуле потоков
+        """
+        with self._lock:
+            if self._stock is None:
+                self._read()
+
+    def reload(self) -> bool:
+        """
+        Перечитывает остатки (их могли поправить на листе руками), если все изменения бота уже в таблице.
+        Выполняется в пуле потоков
+
+        :return: True, если остатки перечитаны
+        """
+        with self._lock:
+            writer.flush()
+            if not writer.barrier().done() or journal.pending_count:
+                logger.warning('Queued writes are not in the table yet, the cartridge stock is not reloaded')
+                return False
+            self._read()
+            return True
+
+    def _read(self) -> None:
+        # Вызывается под self._lock
+        sheet = self._sheet()
+        rows = database.read_rows(sheet, 1, self.UPDATED_COLUMN)
+        stock, positions = {}, {}
+        for row, values in enumerate(rows[self.FIRST_ROW - 1:], start=self.FIRST_ROW):
+            model = str(values[0]).strip() if values else ''
+            if not model:
+                continue
+            try:
+                stock[model] = int(values[1])
+            except (IndexError, ValueError):
+                stock[model] = 0
+            positions[model] = row
+        self._stock, self._rows = stock, positions
+        if not rows or not rows[0] or not rows[0][0]:
+            writer.submit(sheet, (1, 1), [self.HEADER])
+        logger.info(f'Cartridge stock is loaded: {len(stock)} models')
+
+    def get(self, model: str) -> int | None:
+        """
+        returns the amount of cartridges in stock without requests to Google, None if the stock is not loaded
+        """
+        if self._stock is None:
+            return None
+        return self._stock.get(model, 0)
+
+    def snapshot(self) -> dict[str, int]:
+        # Без self._lock: вызывается из обработчиков и не должен ждать, пока перечитывается лист
+        return dict(self._stock or {})
+
+    def receive(self, model: str, amount: int) -> int:
+        """
+        Привоз <amount> картриджей модели <model>
+
+        :return: сколько картриджей стало в наличии
+        """
+        metrics.inc('cartridges_received', amount)
+        return self._change(model, amount, f'привоз +{amount}')
+
+    def use(self, model: str) -> int:
+        """
+        Списывает один картридж при замене. Остаток может уйти в минус - значит, привоз не был записан
+
+        :return: сколько картриджей осталось
+        """
+        metrics.inc('cartridges_used')
+        return self._change(model, -1, 'замена -1')
+
+    def _change(self, model: str, delta: int, event: str) -> int:
+        with self._lock:
+            if self._stock is None:
+                self.load()
+            amount = self._stock.get(model, 0) + delta
+            row = self._rows.get(model) or max(self._rows.values(), default=self.FIRST_ROW - 1) + 1
+            self._stock[model] = amount
+            self._rows[model] = row
+            change = {'row': row,
+                      'model': model,
+                      'amount': amount,
+                      'updated': f'{datetime.now().strftime(Config.TIMESTAMP)} {event}'}
+            seq = journal.append('stock', change)  # Сначала на диск, потом в очередь записи
+            journal.ack_when_done(seq, self.replay_write(change))
+        logger.info(f'Cartridge stock of {model}: {event}, {amount} left')
+        return amount
+
+    def replay_write(self, change: dict) -> Future:
+        """
+        Ставит в очередь строку модели. При повторе из журнала пишется текущий остаток, если склад уже загружен
+        """
+        amount = change['amount']
+        if self._stock is not None and self._rows.get(change['model']) == change['row']:
+            amount = self._stock[change['model']]
+        cells = {self.MODEL_COLUMN: change['model'], self.AMOUNT_COLUMN: amount, self.UPDATED_COLUMN: change['updated']}
+        return writer.submit_cells(self._sheet(), change['row'], cells)
+
+
+stock = StockLedger(printers)
+journal.register('stock', stock.replay_write)
@@ -1,52 +1,306 @@
 """
 В модуле реализуется подключение к базе данных
 На данный момент в этом качестве выступают Google-Таблицы
+
+Подключение ленивое: авторизация и открытие таблиц происходят при первом обращении
+к client, task_table, task_sheet, task_map_sheet или task_users_sheet (или при вызове sheets.warm_up).
+Поэтому модуль импортируется без доступа к сети.
+При SHEETS_BACKEND=fake вместо Google используются таблицы в памяти из bot.fake_gsheets.
 """
 import pathlib
 import logging
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import httplib2
 import pygsheets
 
+from bot import quota
+from bot.resilience import resilience
 from bot.settings import Config
 
 logger = logging.getLogger(__name__)
 
 
+class ThreadSafeHttp(httplib2.Http):
+    """
+    httplib2.Http хранит открытые keep-alive соединения в словаре connections и не рассчитан на работу из разных потоков.
+    Здесь у каждого потока свой словарь соединений, поэтому один клиент с одной авторизацией
+    можно использовать из пула потоков bot.repository, а соединения переиспользуются между запросами.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._local = threading.local()
+        super().__init__(*args, **kwargs)
+
+    @property
+    def connections(self) -> dict:
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        return self._local.connections
+
+    @connections.setter
+    def connections(self, value: dict) -> None:
+        self._local.connections = value
+
+
+class SheetsClient:
+    """
+    Один клиент pygsheets на весь процесс: авторизуется при первом обращении
+    и хранит уже открытые таблицы, чтобы не запрашивать их метаданные повторно
+    """
+
+    def __init__(self, service_account_file: pathlib.Path):
+        self.service_account_file = service_account_file
+        self._client: pygsheets.client.Client | None = None
+        self._spreadsheets: dict[str, pygsheets.Spreadsheet] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> pygsheets.client.Client:
+        with self._lock:
+            if self._client is None:
+                if Config.SHEETS_BACKEND == 'fake':
+                    from bot.fake_gsheets import FakeClient
+                    client = FakeClient.from_config()
+                else:
+                    logger.info('Authorizing in Google Sheets')
+                    client = pygsheets.authorize(service_account_file=self.service_account_file,
+                                                 http=ThreadSafeHttp())
+                quota.scheduler.install(client)  # Каждый запрос ждет квоту...
+                resilience.install(client)  # ...а повтор после ошибки ждет ее заново
+                self._client = client
+            return self._client
+
+    def open(self, key: str) -> pygsheets.Spreadsheet:
+        """
+        returns a spreadsheet by its key, it is opened only once
+        """
+        spreadsheet = self._spreadsheets.get(key)
+        if spreadsheet is None:
+            spreadsheet = self.client.open_by_key(key)
+            logger.info(f'Connection succeeded to Google-Table `{spreadsheet.title}`')
+            self._spreadsheets[key] = spreadsheet
+        return spreadsheet
+
+    def worksheet(self, key: str, index: int) -> pygsheets.Worksheet:
+        return self.open(key).worksheet(value=index)
+
+    def warm_up(self, *keys: str) -> None:
+        """
+        Opens the spreadsheets in parallel, so the first user doesn't wait for them
+        """
+        keys = [key for key in keys if key and key not in self._spreadsheets]
+        if not keys:
+            return
+        self.client  # Авторизуемся один раз до того, как потоки начнут открывать таблицы
+        with ThreadPoolExecutor(max_workers=len(keys), thread_name_prefix='gsheets-warm-up') as pool:
+            list(pool.map(self.open, keys))
+
+
+sheets = SheetsClient(Config.SERVICE_FILE_PATH)
+
+_TASK_WORKSHEETS = {
+    'task_sheet': Config.TASKS_PAGE_INDEX,
+    'task_map_sheet': Config.TASKS_SETTINGS_PAGE_INDEX,
+    'task_users_sheet': Config.TASKS_USERS_PAGE_INDEX,
+}
+
+
+def __getattr__(name: str):
+    # Ленивые атрибуты модуля: database.task_sheet и т.п. подключаются к таблице только при первом обращении
+    if name == 'client':
+        return sheets.client
+    if name == 'task_table':
+        return sheets.open(Config.TASKS_GSHEET_KEY)
+    if name in _TASK_WORKSHEETS:
+        return sheets.worksheet(Config.TASKS_GSHEET_KEY, _TASK_WORKSHEETS[name])
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def get_task_sheet() -> pygsheets.Worksheet:
+    return sheets.worksheet(Config.TASKS_GSHEET_KEY, Config.TASKS_PAGE_INDEX)
+
+
 def get_ids() -> list[int]:
     """
     returns a list of all existing task_ids
     """
     logger.debug("Getting all existing task_ids")
-    ids = task_sheet.get_col(Config.task_columns['task_id'], include_tailing_empty=False)[1:]
+    ids = get_task_sheet().get_col(Config.task_columns['task_id'], include_tailing_empty=False)[1:]
     return [int(i) for i in ids]
 
 
-def get_rows_amount(amount: int = 1000):
+def iter_pages(worksheet: pygsheets.Worksheet,
+               first_row: int = 2,
+               last_column: int | None = None,
+               page: int | None = None) -> Iterator[tuple[int, list[list]]]:
+    """
+    yields the rows of a worksheet from <first_row> to the end page by page: (number of the first row, rows).
+    Trailing empty rows of a page are dropped.
+
+    The size of the grid is taken from its metadata (worksheet.rows), which pygsheets keeps with the worksheet.
+    By default a grid up to SHEETS_PAGE_THRESHOLD rows is one page, a larger grid is read by pages
+    of SHEETS_PAGE_ROWS rows. The grid is usually larger than the data (a new sheet has 1000 rows),
+    so the reading stops at the first empty page: the data ends there, the rest of the grid is not requested.
+    If the last page of the grid is full, the sheet could grow after its metadata was loaded: the metadata
+    is refreshed and the reading goes on
+    """
+    last_column = last_column or worksheet.cols
+    if not page:
+        total = worksheet.rows - first_row + 1
+        page = total if total <= Config.SHEETS_PAGE_THRESHOLD else Config.SHEETS_PAGE_ROWS
+    start = first_row
+    while True:
+        last_row = worksheet.rows
+        if start > last_row or page < 1:
+            return
+        end = min(last_row, start + page - 1)
+        block = worksheet.get_values((start, 1), (end, last_column), include_tailing_empty_rows=False)
+        if not block:
+            return  # Целая страница пустых строк - дальше только пустая сетка листа
+        yield start, block
+        if end == last_row and len(block) == end - start + 1:
+            worksheet.refresh()  # Последняя страница заполнена до конца - возможно, лист вырос
+            if worksheet.rows > last_row:
+                logger.info(f'Worksheet {worksheet.title} has grown to {worksheet.rows} rows')
+                page = min(page, Config.SHEETS_PAGE_ROWS)
+        start = end + 1
+
+
+def read_rows(worksheet: pygsheets.Worksheet, first_row: int = 2, last_column: int | None = None) -> list[list]:
+    """
+    returns all rows of a worksheet from <first_row> to the last one with values, columns 1..<last_column>.
+    A sheet with a small grid is read with one values request, a large one by pages until the first empty page
+    (see iter_pages). Empty rows between pages are kept, so row numbers stay correct
+    """
+    last_column = last_column or worksheet.cols
+    rows = []
+    for start, block in iter_pages(worksheet, first_row, last_column):
+        skipped = start - first_row - len(rows)  # Пустые строки в конце прошлой страницы
+        rows += [[''] * last_column for _ in range(skipped)] + block
+    logger.debug(f'Read {len(rows)} rows from {worksheet.title}')
+    return rows
+
+
+def get_task_rows(last_column: int = Config.task_columns['comments']) -> list[list]:
     """
     returns a list of nonzero rows where each row is a list of task attributes
     """
     logger.debug("Getting all rows from the table")
-    return task_sheet.get_values((2, Config.task_columns['task_id']),
-                                 (amount, Config.task_columns['comments']),
-                                 # include_tailing_empty=False,
-                                 include_tailing_empty_rows=False)
-
-
-# TODO найти способ открывать и закрывать подключение по аналогиями с сессиями db (асинхронными?)
-client = pygsheets.authorize(service_account_file=Config.SERVICE_FILE_PATH)
-task_table: pygsheets.Spreadsheet = client.open_by_key(Config.TASKS_GSHEET_KEY)
-logger.info('Connection succeeded to Google-Table `Задачи Admin 1060`')
-logger.debug(f'List of worksheets: {task_table.worksheets()}')
-task_sheet: pygsheets.worksheet.Worksheet = task_table.worksheet(value=Config.TASKS_PAGE_INDEX)
-task_map_sheet: pygsheets.worksheet.Worksheet = task_table.worksheet(value=Config.TASKS_SETTINGS_PAGE_INDEX)
-task_users_sheet: pygsheets.worksheet.Worksheet = task_table.worksheet(value=Config.TASKS_USERS_PAGE_INDEX)
+    return read_rows(get_task_sheet(), 2, last_column)
+
+
+def column_letter(col: int) -> str:
+    """
+    returns the letter of a column by its number: 1 -> A, 27 -> AA
+    """
+    letters = ''
+    while col:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def a1_range(worksheet: pygsheets.Worksheet,
+             start: tuple[int, int],
+             end: tuple[int, int] | None = None) -> str:
+    """
+    returns A1-notation of a range with the title of the worksheet, e.g. 'Задачи'!A5:M5
+    """
+    label = f"'{worksheet.title}'!{column_letter(start[1])}{start[0]}"
+    if end:
+        label += f':{column_letter(end[1])}{end[0]}'
+    return label
+
+
+def batch_get(worksheet: pygsheets.Worksheet, ranges: list[tuple[tuple[int, int], tuple[int, int]]]) -> list[list[list]]:
+    """
+    reads several ranges of a worksheet with one values.batchGet request
+
+    :param ranges: list of pairs (start, end), each is (row, col)
+    :return: list of values for every range in the same order, trailing empty cells are dropped
+    """
+    return batch_get_sheets(worksheet.spreadsheet, [(worksheet, start, end) for start, end in ranges])
+
+
+def batch_get_sheets(spreadsheet: pygsheets.Spreadsheet,
+                     ranges: list[tuple[pygsheets.Worksheet, tuple[int, int], tuple[int, int]]]) -> list[list[list]]:
+    """
+    reads ranges of several worksheets of one spreadsheet with one values.batchGet request
+
+    :param ranges: list of (worksheet, start, end), start and end are (row, col)
+    :return: list of values for every range in the same order, trailing empty cells are dropped
+    """
+    labels = [a1_range(worksheet, start, end) for worksheet, start, end in ranges]
+    logger.debug(f'Batch get of {len(labels)} ranges from {spreadsheet.title}')
+    # SheetAPIWrapper.values_batch_get already returns the 'valueRanges' list of the response
+    return [value_range.get('values', [])
+            for value_range in spreadsheet.client.sheet.values_batch_get(spreadsheet.id, labels)]
+
+
+def get_modified_time(spreadsheet: pygsheets.Spreadsheet) -> datetime:
+    """
+    returns the time of the last modification of a spreadsheet from Google Drive.
+    It is one light request which doesn't touch the cells
+    """
+    return datetime.fromisoformat(spreadsheet.updated.replace('Z', '+00:00'))
+
+
+def group_rows(rows: list[int]) -> list[tuple[int, int]]:
+    """
+    joins row numbers into ranges of adjacent rows: [2, 3, 4, 7] -> [(2, 4), (7, 7)]
+    """
+    ranges = []
+    for row in sorted(set(rows)):
+        if ranges and ranges[-1][1] == row - 1:
+            ranges[-1] = (ranges[-1][0], row)
+        else:
+            ranges.append((row, row))
+    return ranges
+
+
+def delete_rows(worksheet: pygsheets.Worksheet, rows: list[int]) -> None:
+    """
+    deletes rows of a worksheet with one spreadsheets.batchUpdate request.
+    Ranges are deleted from the bottom, so the numbers of the rows above stay valid
+    """
+    requests = [{'deleteDimension': {'range': {'sheetId': worksheet.id,
+                                               'dimension': 'ROWS',
+                                               'startIndex': start - 1,
+                                               'endIndex': end}}}
+                for start, end in reversed(group_rows(rows))]
+    logger.debug(f'Deleting {len(rows)} rows in {len(requests)} ranges from {worksheet.title}')
+    worksheet.client.sheet.batch_update(worksheet.spreadsheet.id, requests)
+    worksheet.refresh()  # Размер листа (worksheet.rows) уменьшился
+
+
+def batch_update(spreadsheet: pygsheets.Spreadsheet, data: list[dict]) -> None:
+    """
+    writes several ranges of a spreadsheet with one values.batchUpdateByDataFilter request.
+    pygsheets.sheet.SheetAPIWrapper.values_batch_update, despite its name, writes one range per request
+
+    :param data: list of ValueRange dicts: {'range': a1_range(...), 'majorDimension': 'ROWS', 'values': [[...]]}
+    """
+    if not data:
+        return  # Нечего записывать - запрос не нужен
+    logger.debug(f'Batch update of {len(data)} ranges in {spreadsheet.title}')
+    spreadsheet.client.sheet.values_batch_update_by_data_filter(spreadsheet.id, [
+        {'dataFilter': {'a1Range': value_range['range']},
+         'majorDimension': value_range.get('majorDimension', 'ROWS'),
+         'values': value_range['values']}
+        for value_range in data
+    ], parse=True)
+
+
 # TODO сделать статусы и админов словариками, забираемыми из task_map_sheet
 
 
 if __name__ == '__main__':
     # now = datetime.now()
-    # range = get_rows_amount(1000)
+    # range = get_task_rows()
     # print(f'Requested 1000 rows in {datetime.now() - now}')
     # for item in range:
     #     print(item)
@@ -54,10 +308,10 @@ if __name__ == '__main__':
     # col = get_ids()
     # print(f'Requested all ids in {datetime.now() - now}')
     # now = datetime.now()
-    # range = get_rows_amount(len(col))
+    # range = get_task_rows()
     # print(f'Requested {len(col)} rows in {datetime.now() - now}')
     # # for item in range:
     # #     print(item)
-    row = len(task_users_sheet.get_col(1, include_tailing_empty=False)) + 1
+    row = len(sheets.worksheet(Config.TASKS_GSHEET_KEY, Config.TASKS_USERS_PAGE_INDEX).get_col(1, include_tailing_empty=False)) + 1
     print(f'{row=}')
 
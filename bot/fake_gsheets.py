@@ -0,0 +1,588 @@
+"""
+Google-Таблицы в памяти - замена pygsheets для запуска бота и замеров без доступа к Google
+
+Включается переменной окружения SHEETS_BACKEND=fake (по умолчанию при APP_ENV=test).
+Клиент повторяет ту часть интерфейса pygsheets, которой пользуется бот:
+    Client.open_by_key, Client.sheet.values_batch_get / values_batch_update / values_batch_update_by_data_filter /
+        values_append / batch_update
+    Spreadsheet.fetch_properties, worksheets, worksheet, worksheet_by_title, add_worksheet, updated
+    Worksheet.get_col, get_row, get_values, get_value, cell, update_value, update_values, update_row, append_table
+
+Имена методов, аргументы и возвращаемые значения совпадают с pygsheets 2.0.6 (tests/test_fake_gsheets.py).
+Отличие одно: append_table возвращает диапазоны A1-строками, а не pygsheets.GridRange.
+
+Значения хранятся строками, как их показывает таблица. Формула =СТРОКА(...) вычисляется в номер строки,
+остальные формулы возвращаются как есть. None в записываемых значениях оставляет ячейку без изменений, как у Google.
+
+Каждый запрос к "таблице" проходит через client.sheet._execute_requests, как в pygsheets, и FaultInjector:
+    FAKE_SHEETS_LATENCY            - задержка каждого запроса, сек
+    FAKE_SHEETS_QUOTA_ERROR_RATE   - доля запросов, которые падают с ошибкой 429 (превышена квота)
+    FAKE_SHEETS_FAILURE_RATE       - доля запросов, которые падают с ошибкой 503
+    FAKE_SHEETS_SEED_FILE          - JSON с начальными данными: {ключ таблицы: {название листа: [[ячейки]]}}
+Счетчики запросов (чтение/запись) лежат в FaultInjector.calls - по ним удобно сравнивать варианты кода.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from bot.settings import Config
+
+
+logger = logging.getLogger(__name__)
+
+_A1_CELL = re.compile(r'^([A-Z]*)(\d*)$')
+_ROW_FORMULA = re.compile(r'^=(?:СТРОКА|ROW)\((?:\$?[A-Z]+\$?(\d+))?\)$', re.IGNORECASE)
+
+
+def column_number(letters: str) -> int:
+    """
+    returns the number of a column by its letter: A -> 1, AA -> 27
+    """
+    col = 0
+    for letter in letters:
+        col = col * 26 + ord(letter) - ord('A') + 1
+    return col
+
+
+def column_letters(col: int) -> str:
+    """
+    returns the letter of a column by its number: 1 -> A, 27 -> AA
+    """
+    letters = ''
+    while col:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def parse_a1(label: str) -> tuple[str | None, tuple[int | None, int | None], tuple[int | None, int | None] | None]:
+    """
+    разбирает диапазон в A1-нотации: "'Задачи'!A5:M5" -> ('Задачи', (5, 1), (5, 13)).
+    Отсутствующие номера строк или столбцов возвращаются как None
+    """
+    title = None
+    if '!' in label:
+        title, label = label.rsplit('!', 1)
+        title = title.strip("'").replace("''", "'")
+
+    def cell(address: str) -> tuple[int | None, int | None]:
+        letters, digits = _A1_CELL.match(address.upper()).groups()
+        return (int(digits) if digits else None), (column_number(letters) if letters else None)
+
+    start, _, end = label.partition(':')
+    return title, cell(start), (cell(end) if end else None)
+
+
+def _render_option(option) -> str:
+    # pygsheets принимает и перечисления ValueRenderOption/DateTimeRenderOption, и строки
+    return getattr(option, 'value', option)
+
+
+def _to_cell_value(value) -> str:
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    return '' if value is None else str(value)
+
+
+class FaultInjector:
+    def __init__(self,
+                 latency: float = 0.0,
+                 quota_error_rate: float = 0.0,
+                 failure_rate: float = 0.0,
+                 seed: int | None = None):
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.failure_rate = failure_rate
+        self.calls: Counter = Counter()  # 'read' / 'write' -> количество запросов
+        self._failures: list[int] = []  # Статусы ошибок, которыми упадут следующие запросы
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def fail_next(self, status: int = 429, times: int = 1) -> None:
+        """
+        Следующие <times> запросов упадут с HTTP-статусом <status>
+        """
+        with self._lock:
+            self._failures += [status] * times
+
+    def __call__(self, kind: str) -> None:
+        with self._lock:
+            self.calls[kind] += 1
+            if self._failures:
+                status = self._failures.pop(0)
+            elif self._random.random() < self.quota_error_rate:
+                status = 429
+            elif self._random.random() < self.failure_rate:
+                status = 503
+            else:
+                status = None
+        if self.latency:
+            time.sleep(self.latency)
+        if status:
+            reason = 'Quota exceeded' if status == 429 else 'Service unavailable'
+            logger.debug(f'Fake {kind} request fails with {status}')
+            raise HttpError(httplib2.Response({'status': str(status), 'reason': reason}),
+                            json.dumps({'error': {'code': status, 'message': reason}}).encode())
+
+
+class FakeRequest:
+    """
+    Аналог googleapiclient.http.HttpRequest: "поход в сеть" с задержкой и ошибками из FaultInjector
+    """
+
+    def __init__(self, client: 'FakeClient', method: str):
+        self.client = client
+        self.method = method
+
+    def execute(self, num_retries: int = 0):
+        self.client.faults('read' if self.method == 'GET' else 'write')
+        return {}
+
+
+class FakeCell:
+    def __init__(self, row: int, col: int, value: str):
+        self.row = row
+        self.col = col
+        self.value = value
+
+    def __repr__(self):
+        return f'<FakeCell R{self.row}C{self.col} {self.value!r}>'
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: 'FakeSpreadsheet', title: str, index: int, sheet_id: int,
+                 values: list[list] | None = None, rows: int = 1000, cols: int = 26):
+        self.spreadsheet = spreadsheet
+        self.client = spreadsheet.client
+        self.title = title
+        self.index = index
+        self.id = sheet_id  # Как у Google: не меняется, когда листы добавляются или удаляются
+        self._grid: list[list[str]] = [[_to_cell_value(value) for value in row] for row in values or []]
+        self.rows = max(rows, len(self._grid))
+        self.cols = max([cols] + [len(row) for row in self._grid])
+
+    def __repr__(self):
+        return f"<FakeWorksheet '{self.title}' index:{self.index}>"
+
+    # Работа с сеткой без задержек - ее используют методы листа и FakeSheetsAPI
+
+    def _display(self, row: int, col: int, formulas: bool = False) -> str:
+        if row > len(self._grid) or col > len(self._grid[row - 1]):
+            return ''
+        value = self._grid[row - 1][col - 1]
+        formula = None if formulas else _ROW_FORMULA.match(value)
+        if formula:
+            return formula.group(1) or str(row)
+        return value
+
+    def _read(self, start: tuple[int | None, int | None], end: tuple[int | None, int | None] | None,
+              formulas: bool = False) -> list[list[str]]:
+        """
+        returns the values of the range with trailing empty cells and rows dropped, like the API does.
+        With <formulas> the formulas are returned as they are written, like value_render_option=FORMULA
+        """
+        end = end or start
+        first_row, first_col = start[0] or 1, start[1] or 1
+        last_row, last_col = end[0] or self.rows, end[1] or self.cols
+        with self.client.lock:
+            matrix = []
+            for row in range(first_row, last_row + 1):
+                values = [self._display(row, col, formulas) for col in range(first_col, last_col + 1)]
+                while values and values[-1] == '':
+                    values.pop()
+                matrix.append(values)
+        while matrix and not matrix[-1]:
+            matrix.pop()
+        return matrix
+
+    def _write(self, start: tuple[int, int], values: list[list]) -> None:
+        first_row, first_col = start[0] or 1, start[1] or 1
+        with self.client.lock:
+            for row, row_values in enumerate(values, start=first_row):
+                while len(self._grid) < row:
+                    self._grid.append([])
+                cells = self._grid[row - 1]
+                for col, value in enumerate(row_values, start=first_col):
+                    if value is None:
+                        continue
+                    cells.extend([''] * (col - len(cells)))
+                    cells[col - 1] = _to_cell_value(value)
+                self.rows = max(self.rows, row)
+                self.cols = max(self.cols, len(cells))
+            self.spreadsheet._touch()
+
+    def _delete_rows(self, start: int, end: int) -> None:
+        """
+        Удаляет строки с индексами [start, end), считая с 0, как deleteDimension
+        """
+        with self.client.lock:
+            del self._grid[start:end]
+            self.rows -= min(end, self.rows) - start
+            self.spreadsheet._touch()
+
+    def _last_row(self) -> int:
+        with self.client.lock:
+            for row in range(len(self._grid), 0, -1):
+                if any(self._grid[row - 1]):
+                    return row
+        return 0
+
+    @staticmethod
+    def _address(addr: str | tuple[int, int]) -> tuple[int, int]:
+        if isinstance(addr, str):
+            _, start, _ = parse_a1(addr)
+            return start
+        return addr
+
+    def _range(self, start: tuple[int, int], end: tuple[int, int]) -> str:
+        return f"'{self.title}'!{column_letters(start[1])}{start[0]}:{column_letters(end[1])}{end[0]}"
+
+    # Интерфейс pygsheets.Worksheet
+
+    def get_values(self, start, end, returnas: str = 'matrix', majdim: str = 'ROWS',
+                   include_tailing_empty: bool = True, include_tailing_empty_rows: bool = False,
+                   value_render='FORMATTED_VALUE', date_time_render_option='SERIAL_NUMBER', grange=None,
+                   **kwargs) -> list[list]:
+        self.client._request('GET')
+        if grange is not None:
+            _, start, end = parse_a1(getattr(grange, 'label', grange))
+        start, end = self._address(start), self._address(end)
+        matrix = self._read(start, end, formulas=_render_option(value_render) == 'FORMULA')
+        first_row, first_col = start[0] or 1, start[1] or 1
+        last_row, last_col = end[0] or self.rows, end[1] or self.cols
+        if include_tailing_empty_rows:
+            matrix += [[] for _ in range(last_row - first_row + 1 - len(matrix))]
+        if include_tailing_empty:
+            matrix = [row + [''] * (last_col - first_col + 1 - len(row)) for row in matrix]
+        if majdim.upper() == 'COLUMNS':
+            width = max((len(row) for row in matrix), default=0)
+            matrix = [[row[col] if col < len(row) else '' for row in matrix] for col in range(width)]
+            if not include_tailing_empty:
+                for column in matrix:
+                    while column and column[-1] == '':
+                        column.pop()
+        if returnas == 'cell':
+            return [[FakeCell(first_row + r, first_col + c, value) for c, value in enumerate(row)]
+                    for r, row in enumerate(matrix)]
+        return matrix
+
+    def get_row(self, row: int, returnas: str = 'matrix', include_tailing_empty: bool = True, **kwargs) -> list:
+        return self.get_values((row, 1), (row, None), returnas=returnas,
+                               include_tailing_empty=include_tailing_empty, include_tailing_empty_rows=True)[0]
+
+    def get_col(self, col: int, returnas: str = 'matrix', include_tailing_empty: bool = True, **kwargs) -> list:
+        values = self.get_values((1, col), (None, col), returnas=returnas, majdim='COLUMNS',
+                                 include_tailing_empty=include_tailing_empty, include_tailing_empty_rows=True)
+        return values[0] if values else []
+
+    def get_value(self, addr, value_render='FORMATTED_VALUE') -> str:
+        self.client._request('GET')
+        return self._display(*self._address(addr), formulas=_render_option(value_render) == 'FORMULA')
+
+    def cell(self, addr) -> FakeCell:
+        self.client._request('GET')
+        row, col = self._address(addr)
+        return FakeCell(row, col, self._display(row, col))
+
+    def update_value(self, addr, val, parse=None) -> None:
+        start = self._address(addr)
+        body = {'range': self._range(start, start), 'majorDimension': 'ROWS', 'values': [[val]]}
+        self.client.sheet.values_batch_update(self.spreadsheet.id, body,
+                                              parse if parse is not None else self.spreadsheet.default_parse)
+
+    def update_values(self, crange=None, values=None, cell_list=None, extend=False, majordim='ROWS',
+                      parse=None) -> None:
+        """
+        <extend> ничего не меняет: лист в памяти растет сам
+        """
+        if cell_list:
+            cells = [cell for row in cell_list for cell in row] if isinstance(cell_list[0], list) else cell_list
+            start = (min(cell.row for cell in cells), min(cell.col for cell in cells))
+            end = (max(cell.row for cell in cells), max(cell.col for cell in cells))
+            values = [[None] * (end[1] - start[1] + 1) for _ in range(end[0] - start[0] + 1)]
+            for cell in cells:
+                values[cell.row - start[0]][cell.col - start[1]] = cell.value
+            majordim = 'ROWS'
+        elif crange and values:
+            if not isinstance(values, list) or not isinstance(values[0], list):
+                raise ValueError('values should be a matrix')
+            if isinstance(crange, str):
+                _, start, end = parse_a1(crange)
+                start = (start[0] or 1, start[1] or 1)
+            else:
+                start, end = crange, None
+            if end is None:
+                width = max(map(len, values))
+                height, width = (len(values), width) if majordim == 'ROWS' else (width, len(values))
+                end = (start[0] + height - 1, start[1] + width - 1)
+        else:
+            raise ValueError('provide either cells or values, not both')
+        body = {'range': self._range(start, end), 'majorDimension': majordim, 'values': values}
+        self.client.sheet.values_batch_update(self.spreadsheet.id, body,
+                                              parse if parse is not None else self.spreadsheet.default_parse)
+
+    def update_row(self, index: int, values: list, col_offset: int = 0) -> None:
+        if not isinstance(values[0], list):
+            values = [values]
+        self.update_values((index, col_offset + 1), values)
+
+    def append_table(self, values: list, start: str = 'A1', end=None, dimension: str = 'ROWS',
+                     overwrite: bool = False, **kwargs) -> dict:
+        """
+        Как у pygsheets, но диапазоны в ответе - A1-строки, а не pygsheets.GridRange
+        """
+        if not isinstance(values[0], list):
+            values = [values]
+        response = self.client.sheet.values_append(self.spreadsheet.id, values, dimension,
+                                                   range=f"'{self.title}'!{start}",
+                                                   insertDataOption='OVERWRITE' if overwrite else 'INSERT_ROWS',
+                                                   **kwargs)
+        return {'tableRange': response['tableRange'], 'updates': response['updates']}
+
+    def refresh(self, update_grid: bool = False) -> None:
+        pass
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: 'FakeClient', key: str, title: str | None = None):
+        self.client = client
+        self.id = key
+        self.title = title or key
+        self.default_parse = True
+        self._sheets: list[FakeWorksheet] = []
+        self._next_sheet_id = 0
+        self._updated = datetime.now(timezone.utc)
+
+    def __repr__(self):
+        return f"<FakeSpreadsheet '{self.title}' Sheets:{len(self._sheets)}>"
+
+    def _touch(self) -> None:
+        self._updated = datetime.now(timezone.utc)
+
+    @property
+    def updated(self) -> str:
+        self.client._request('GET')
+        return self._updated.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+    def fetch_properties(self, jsonsheet=None, fetch_sheets: bool = True) -> None:
+        self.client._request('GET')
+
+    def worksheets(self, sheet_property=None, value=None, force_fetch: bool = False) -> list[FakeWorksheet]:
+        if sheet_property is None:
+            return list(self._sheets)
+        return [sheet for sheet in self._sheets if getattr(sheet, sheet_property) == value]
+
+    def worksheet(self, property: str = 'index', value=0) -> FakeWorksheet:
+        for sheet in self._sheets:
+            if getattr(sheet, property) == value:
+                return sheet
+        raise KeyError(f'Worksheet {property}={value!r} is not found in {self}')
+
+    def worksheet_by_title(self, title: str) -> FakeWorksheet:
+        return self.worksheet('title', title)
+
+    def add_worksheet(self, title: str, rows: int = 100, cols: int = 26, src_tuple=None, src_worksheet=None,
+                      index=None) -> FakeWorksheet:
+        """
+        <src_tuple> - (ключ таблицы, id листа) или <src_worksheet> - лист, значения которого копируются в новый
+        """
+        self.client._request('POST')
+        values = None
+        if src_tuple:
+            src_worksheet = self.client._get(src_tuple[0]).worksheet('id', src_tuple[1])
+        if src_worksheet:
+            with self.client.lock:
+                values = [list(row) for row in src_worksheet._grid]
+                rows, cols = src_worksheet.rows, src_worksheet.cols
+        return self._add_sheet(title, rows, cols, values, index)
+
+    def _add_sheet(self, title: str, rows: int = 1000, cols: int = 26, values: list[list] | None = None,
+                   index: int | None = None) -> FakeWorksheet:
+        with self.client.lock:
+            index = len(self._sheets) if index is None else min(index, len(self._sheets))
+            sheet = FakeWorksheet(self, title, index, self._next_sheet_id, values, rows, cols)
+            self._next_sheet_id += 1
+            self._sheets.insert(index, sheet)
+            for position, other in enumerate(self._sheets):
+                other.index = position
+            self._touch()
+        return sheet
+
+
+class FakeSheetsAPI:
+    """
+    Аналог client.sheet (pygsheets.sheet.SheetAPIWrapper) - запросы к values.* по ключу таблицы
+    """
+
+    def __init__(self, client: 'FakeClient'):
+        self.client = client
+
+    def _worksheet(self, spreadsheet_id: str, label: str) -> tuple[FakeWorksheet, tuple, tuple | None]:
+        title, start, end = parse_a1(label)
+        spreadsheet = self.client._get(spreadsheet_id)
+        sheet = spreadsheet.worksheet_by_title(title) if title else spreadsheet.worksheet()
+        return sheet, start, end
+
+    def _execute_requests(self, request: FakeRequest) -> dict:
+        return request.execute()
+
+    def values_batch_get(self, spreadsheet_id, value_ranges, major_dimension='ROWS',
+                         value_render_option='FORMATTED_VALUE', date_time_render_option='SERIAL_NUMBER'):
+        """values.batchGet - как и у pygsheets, возвращается только список valueRanges из ответа"""
+        self.client._request('GET')
+        result = []
+        for label in value_ranges:
+            sheet, start, end = self._worksheet(spreadsheet_id, label)
+            values = sheet._read(start, end, formulas=_render_option(value_render_option) == 'FORMULA')
+            if major_dimension == 'COLUMNS':
+                values = [list(column) for column in zip(*values)]
+            result.append({'range': label, 'majorDimension': major_dimension, 'values': values})
+        return result
+
+    def values_batch_update(self, spreadsheet_id, body, parse=True):
+        """
+        values.update одного диапазона - несмотря на имя, у pygsheets <body> это один ValueRange
+        """
+        self.client._request('POST')
+        sheet, start, _ = self._worksheet(spreadsheet_id, body['range'])
+        values = body['values']
+        if body.get('majorDimension', 'ROWS') == 'COLUMNS':
+            values = [list(row) for row in zip(*values)]
+        sheet._write(start, values)
+
+    def values_batch_update_by_data_filter(self, spreadsheet_id, data, parse=True):
+        """
+        values.batchUpdateByDataFilter - поддерживаются только фильтры a1Range.
+        Другие фильтры отклоняются целиком, как неверный запрос у Google: HttpError 400, в таблице ничего не меняется
+        """
+        self.client._request('POST')
+        for index, value_range in enumerate(data):
+            if set(value_range['dataFilter']) != {'a1Range'}:
+                message = f'Invalid data[{index}]: the in-memory sheets support only a1Range data filters'
+                raise HttpError(httplib2.Response({'status': '400', 'reason': 'Bad Request'}),
+                                json.dumps({'error': {'code': 400, 'message': message}}).encode())
+        with self.client.lock:
+            for value_range in data:
+                sheet, start, _ = self._worksheet(spreadsheet_id, value_range['dataFilter']['a1Range'])
+                values = value_range['values']
+                if value_range.get('majorDimension', 'ROWS') == 'COLUMNS':
+                    values = [list(row) for row in zip(*values)]
+                sheet._write(start, values)
+
+    def batch_update(self, spreadsheet_id: str, requests: list[dict] | dict, **kwargs) -> dict:
+        """
+        spreadsheets.batchUpdate - поддерживается только удаление строк (deleteDimension).
+        Другие запросы отклоняются целиком, как неверный запрос у Google: HttpError 400, в таблице ничего не меняется
+        """
+        if not isinstance(requests, list):
+            requests = [requests]
+        self.client._request('POST')
+        spreadsheet = self.client._get(spreadsheet_id)
+        for index, request in enumerate(requests):
+            dimension = request.get('deleteDimension', {}).get('range', {})
+            if dimension.get('dimension') != 'ROWS':
+                message = f'Invalid requests[{index}]: the in-memory sheets support only deleteDimension of rows'
+                raise HttpError(httplib2.Response({'status': '400', 'reason': 'Bad Request'}),
+                                json.dumps({'error': {'code': 400, 'message': message}}).encode())
+        for request in requests:
+            dimension = request['deleteDimension']['range']
+            sheet = spreadsheet.worksheet('id', dimension['sheetId'])
+            sheet._delete_rows(dimension['startIndex'], dimension['endIndex'])
+        return {'spreadsheetId': spreadsheet_id, 'replies': [{} for _ in requests]}
+
+    def values_append(self, spreadsheet_id: str, values: list, major_dimension: str, range: str, **kwargs) -> dict:
+        self.client._request('POST')
+        sheet, start, _ = self._worksheet(spreadsheet_id, range)
+        if not isinstance(values[0], list):
+            values = [values]
+        with self.client.lock:
+            row = sheet._last_row() + 1
+            sheet._write((row, start[1] or 1), values)
+        end_row = row + len(values) - 1
+        updated = f"'{sheet.title}'!A{row}:{end_row}"
+        return {'spreadsheetId': spreadsheet_id,
+                'tableRange': f"'{sheet.title}'!A1:{row - 1}",
+                'updates': {'updatedRange': updated, 'updatedRows': len(values),
+                            'updatedColumns': max(map(len, values)), 'updatedCells': sum(map(len, values))}}
+
+
+class FakeClient:
+    """
+    Аналог pygsheets.client.Client. Таблица, которой нет в начальных данных, создается при первом открытии
+    с пустыми листами, количество которых задано в <default_sheets>
+    """
+
+    def __init__(self, faults: FaultInjector | None = None, seed_data: dict | None = None, default_sheets: int = 3):
+        self.faults = faults or FaultInjector()
+        self.sheet = FakeSheetsAPI(self)
+        self.lock = threading.RLock()
+        self.default_sheets = default_sheets
+        self._spreadsheets: dict[str, FakeSpreadsheet] = {}
+        for key, sheets in (seed_data or {}).items():
+            spreadsheet = self._create(key)
+            for title, values in sheets.items():
+                spreadsheet._add_sheet(title, values=values)
+
+    @classmethod
+    def from_config(cls) -> 'FakeClient':
+        seed_data = None
+        if Config.FAKE_SHEETS_SEED_FILE:
+            with open(Config.FAKE_SHEETS_SEED_FILE, encoding='utf-8') as file:
+                seed_data = json.load(file)
+        faults = FaultInjector(latency=Config.FAKE_SHEETS_LATENCY,
+                               quota_error_rate=Config.FAKE_SHEETS_QUOTA_ERROR_RATE,
+                               failure_rate=Config.FAKE_SHEETS_FAILURE_RATE)
+        logger.warning(f'Using in-memory Google Sheets with latency {faults.latency}s, '
+                       f'quota error rate {faults.quota_error_rate}, failure rate {faults.failure_rate}')
+        return cls(faults, seed_data)
+
+    def _request(self, method: str) -> None:
+        """
+        Каждая операция с данными - один запрос через client.sheet._execute_requests, как в pygsheets
+        """
+        self.sheet._execute_requests(FakeRequest(self, method))
+
+    def _create(self, key: str, title: str | None = None) -> FakeSpreadsheet:
+        with self.lock:
+            spreadsheet = FakeSpreadsheet(self, key, title)
+            self._spreadsheets[key] = spreadsheet
+        return spreadsheet
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        spreadsheet = self._get(key)
+        self._request('GET')
+        return spreadsheet
+
+    def _get(self, key: str) -> FakeSpreadsheet:
+        # Без запроса: values.* обращаются к таблице по ключу внутри своего единственного запроса
+        with self.lock:
+            spreadsheet = self._spreadsheets.get(key)
+            if spreadsheet is None:
+                spreadsheet = self._create(key)
+                for index in range(self.default_sheets):
+                    spreadsheet._add_sheet(f'Лист{index + 1}')
+        return spreadsheet
+
+
+if __name__ == '__main__':
+    client = FakeClient(FaultInjector(latency=0.05))
+    table = client.open_by_key('tasks')
+    sheet = table.worksheet()
+    sheet.update_row(2, ['=СТРОКА($A$1)', 101, 'Не работает проектор'])
+    started = time.monotonic()
+    print(sheet.get_row(2, include_tailing_empty=False), f'{time.monotonic() - started:.3f}s')
+    print(client.sheet.values_batch_get('tasks', ["'Лист1'!A2:C2"]))
+    client.faults.fail_next(429)
+    try:
+        sheet.get_col(1)
+    except HttpError as e:
+        print('Injected:', e.resp.status)
+    print(client.faults.calls)
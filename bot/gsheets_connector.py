@@ -1,9 +1,35 @@
+"""
+Реестр принтеров: таблица "Реестр принтеров", по листу на каждый принтер (название листа - "<кабинет> <принтер>")
+
+Список листов кэшируется в Printers.registry на PRINTERS_REGISTRY_TTL секунд. Обработчики читают только кэш
+и никогда не ждут Google: реестр перечитывается в фоне (bot.repository.reload_printers) - при запуске,
+когда кэш устарел, и по команде админа /reload_printers. Новый реестр собирается целиком
+и подменяет старый одним присваиванием, поэтому диалог замены картриджа видит либо старый, либо новый список.
+Вместе с реестром одним запросом values.batchGet читаются карточки всех принтеров (bot.models.printer) -
+по ним отвечает команда /printer.
+
+Замена картриджа записывается одним запросом: последняя заполненная строка столбца дат каждого принтера
+кэшируется на то же время, а ресурс картриджа (полных месяцев с прошлой замены) бот считает сам.
+
+Метрики:
+    printers_registry_size        - сколько принтеров в реестре
+    printers_registry_loaded_at   - когда (unix time) реестр последний раз перечитывался
+"""
 import datetime
+import logging
+import threading
+import time
 
 import pygsheets
 
 from bot.settings import Config
-from bot.database import client
+import bot.database as database
+from bot.journal import journal
+from bot.models.printer import Printer
+from bot.utils import metrics
+
+
+logger = logging.getLogger(__name__)
 
 
 class Printers:
@@ -16,28 +42,97 @@ class Printers:
     EVENT_COLUMN = 7  # Столбец с событиями - G (6)
     START_ROW = 5  # Первый ряд с данными (ряды 1-4 - заголовки)
 
-    AUDITORY_CELL = 'A2'  # Кабинет
-    MODEL_CELL = 'B2'  # Модель принтера
-    CARTRIDGE_CELL = 'B4'  # Модель картриджа
-    STATUS_CELL = 'B5'  # Состояние (Работает, Кончился картридж, Есть проблемы, В ремонте, Готов к выдаче
-    NAME_CELL = 'B7'  # Сетевое имя принтера
-    IP_ADDRESS_CELL = 'B8'  # IP-адрес принтера
-    SERIAL_NUM_CELL = 'B10'  # Серийный № принтера
-    INVENT_NUM_CELL = 'B11'  # Инвентарный № принтера
-    NUM_CELL = 'B12'  # Внутренний № принтера
-
-    def __init__(self):
-        self.table = client.open_by_key(Config.PRINTERS_GSHEET_KEY)
-        self.sheets_list = self.table.worksheets()
-        self.cartridge_sheet = self.sheets_list[0]  # Картриджи - лист 0
-        self.summary_sheet = self.sheets_list[1]  # Summary - лист 1
-        self.sheets_list = self.sheets_list[2:]
-
-        self.registry = self.get_registry()
-
-    def get_registry(self) -> dict[str, dict[str, pygsheets.worksheet]]:
+    # Ячейки карточки принтера (модель, картридж, состояние, IP-адрес...) - в bot.models.printer.Printer.CELLS
+
+    def __init__(self, ttl: float = Config.PRINTERS_REGISTRY_TTL):
+        self.ttl = ttl
+        self._registry: dict[str, dict[str, pygsheets.worksheet]] | None = None  # Загружается в фоне
+        self._printers: dict[str, list[Printer]] = {}  # Карточки принтеров по кабинетам
+        self.loaded_at: float | None = None  # time.monotonic() последней загрузки
+        self._lock = threading.Lock()
+        self._last_changes: dict[int, tuple[int, str, float]] = {}  # id листа -> (строка, дата, когда прочитан столбец)
+        self._changes_lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Перечитывает список листов Реестра принтеров. Выполняется в пуле потоков
+        """
+        with self._lock:
+            self._load()
+
+    def refresh(self) -> bool:
+        """
+        Перечитывает реестр, только если он устарел - параллельные вызовы не повторяют загрузку
+
+        :return: True, если реестр перечитывался
+        """
+        with self._lock:
+            if not self.is_stale:
+                return False
+            self._load()
+            return True
+
+    def _load(self) -> None:
+        table = database.sheets.open(Config.PRINTERS_GSHEET_KEY)
+        if self.loaded_at is not None:
+            table.fetch_properties()  # Список листов в открытой таблице закэширован pygsheets
+        sheets_list = table.worksheets()
+        registry = self.get_registry(sheets_list[2:])
+        printers = Printer.read_all(registry)  # Один запрос на карточки всех принтеров
+
+        self.table = table
+        self.cartridge_sheet = sheets_list[0]  # Картриджи - лист 0
+        self.summary_sheet = sheets_list[1]  # Summary - лист 1
+        self.sheets_list = sheets_list[2:]
+        self._printers = printers
+        self._registry = registry  # Обработчики сразу видят новый реестр целиком
+        self._last_changes = {}  # Листы могли поправить руками
+        self.loaded_at = time.monotonic()
+
+        metrics.set_value('printers_registry_size', len(self.sheets_list))
+        metrics.set_value('printers_registry_loaded_at', round(datetime.datetime.now().timestamp()))
+        logger.info(f'Printers registry is loaded: {len(self.sheets_list)} printers in {len(registry)} rooms')
+
+    @property
+    def loaded(self) -> bool:
+        return self._registry is not None
+
+    @property
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+
+    @property
+    def registry(self) -> dict[str, dict[str, pygsheets.worksheet]]:
+        """
+        returns the cached registry {кабинет: {принтер: лист}} without requests to Google, empty until it is loaded
+        """
+        return self._registry or {}
+
+    def in_room(self, room: str) -> list[Printer]:
+        """
+        returns the cached printers of a room without requests to Google
+        """
+        return self._printers.get(room, [])
+
+    def card(self, room: str, device: str) -> Printer | None:
+        """
+        returns the cached card of a printer or None if it is not loaded
+        """
+        for printer in self.in_room(room):
+            if printer.device == device:
+                return printer
+        return None
+
+    def _loaded_registry(self) -> dict[str, dict[str, pygsheets.worksheet]]:
+        # Для кода в пуле потоков: может подождать загрузки
+        if self._registry is None:
+            self.refresh()
+        return self._registry
+
+    @staticmethod
+    def get_registry(sheets_list: list[pygsheets.worksheet]) -> dict[str, dict[str, pygsheets.worksheet]]:
         registry = {}
-        for sheet in self.sheets_list:
+        for sheet in sheets_list:
             title = sheet.title
             room = title[:3]
             if room not in registry:
@@ -46,32 +141,78 @@ class Printers:
             registry[room][printer] = sheet
         return registry
 
-    def change_cartridge(self, room: str, device: str, date: str) -> tuple[str, str]:
+    def change_cartridge(self, room: str, device: str, date: str) -> tuple[str, int | str]:
         """
         Проставляет дату замены картриджа <date> на страницу принтера <room device>
-        в первую пустую строчку колонки <CHANGE_COLUMN>
+        в первую пустую строчку колонки <CHANGE_COLUMN>. Это один запрос к таблице:
+        последняя заполненная строка берется из кэша, а ресурс картриджа считается на месте
 
         :param room: str, номер кабинета - ключ для соваря <registry>
         :param device: str, название принтера - ключ для словаря <registry[room]>
         :param date: str, дата замены в формате ДД.ММ.ГГГГ
         :return: tuple, предыдущая дата замены и количество месяцев, прошедших с этой даты
         """
-        printer_sheet = self.registry[room][device]
-        dates = [day for day in printer_sheet.get_col(self.CHANGE_COLUMN) if day]
-        last_row = len(dates)
+        printer_sheet = self._loaded_registry()[room][device]
         if isinstance(date, datetime.date):
             date = date.strftime('%d.%m.%Y')
 
-        printer_sheet.update_value((last_row + 1, self.CHANGE_COLUMN), date)
+        with self._changes_lock:
+            last_row, last_date = self._last_change(printer_sheet)
+            try:
+                printer_sheet.update_value((last_row + 1, self.CHANGE_COLUMN), date)
+            except Exception:
+                self._last_changes.pop(printer_sheet.id, None)  # Неизвестно, дошла ли запись - перечитать в следующий раз
+                raise
+            self._last_changes[printer_sheet.id] = (last_row + 1, date, self._last_changes[printer_sheet.id][2])
+
+        return last_date, self.months_between(last_date, date)
+
+    def _last_change(self, printer_sheet: pygsheets.worksheet, force: bool = False) -> tuple[int, str]:
+        """
+        returns the last filled row of <CHANGE_COLUMN> and its date.
+        Столбец читается один раз на PRINTERS_REGISTRY_TTL секунд - дальше строку ведет сам бот
+        """
+        cached = self._last_changes.get(printer_sheet.id)
+        if cached and not force and time.monotonic() - cached[2] <= self.ttl:
+            return cached[0], cached[1]
+        dates = [day for day in printer_sheet.get_col(self.CHANGE_COLUMN) if day]
+        last_row, last_date = len(dates), dates[-1] if dates else ''
+        self._last_changes[printer_sheet.id] = (last_row, last_date, time.monotonic())
+        return last_row, last_date
+
+    @staticmethod
+    def months_between(start: str, end: str) -> int | str:
+        """
+        returns the number of full months between two dates ДД.ММ.ГГГГ, like РАЗНДАТ(start; end; "M") in the sheet.
+        Если в ячейке не дата (заголовок над первой заменой), возвращает пустую строку
+        """
+        try:
+            start = datetime.datetime.strptime(start, '%d.%m.%Y').date()
+            end = datetime.datetime.strptime(end, '%d.%m.%Y').date()
+        except ValueError:
+            return ''
+        return (end.year - start.year) * 12 + end.month - start.month - (end.day < start.day)
+
+    def replay_change(self, change: dict) -> None:
+        """
+        Повторяет замену картриджа из журнала bot.journal, если дата <date> еще не последняя на странице принтера
+        """
+        printer_sheet = self._loaded_registry()[change['room']][change['device']]
+        with self._changes_lock:
+            _, last_date = self._last_change(printer_sheet, force=True)  # Запись могла дойти до таблицы до сбоя
+        if last_date == change['date']:
+            return
+        self.change_cartridge(change['room'], change['device'], change['date'])
+
 
-        last_date = printer_sheet.cell((last_row, self.CHANGE_COLUMN)).value
-        elapsed = printer_sheet.cell((last_row, self.CHANGE_COLUMN + 1)).value
-        return last_date, elapsed
+printers = Printers()  # Экземпляр класса Printers, в котором держатся страницы Реестра принтеров
+journal.register('cartridge', printers.replay_change)
 
 
 if __name__ == '__main__':
 
     printers = Printers()
+    printers.load()
     for item in printers.registry:
         print(item, printers.registry[item])
     buttons = [printer for printer in printers.registry['102']]
@@ -1,6 +1,7 @@
-from .cartridge import cartridge_conversation
+from .cartridge import (cartridge_conversation, reload_printers, show_printer, show_cartridge_stats,
+                        send_cartridge_forecast)
 from .tasks import tasks_conversation, accept_task, update_task, close_task, show_one_task
 from .cancel import exit_command_handler, exit_callback_handler
 from .start import start, sign_up, register, teacher_help, admin_help
-from .admin import approve_new_user, update_fullname_conversation
-from .error import error_handler
+from .admin import approve_new_user, update_fullname_conversation, show_metrics
+from .error import error_handler, report_journal_failures
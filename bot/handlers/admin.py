@@ -12,8 +12,9 @@ from bot.settings import Config
 from bot.handlers.cancel import exit_command_handler, exit_callback_handler
 from bot.handlers.restrictions import admin_only
 from bot.utils.keyboards import make_inline_keyboard
-from bot.utils.users import (User,
-                             write_user_to_table)
+from bot.utils import metrics
+from bot.utils.users import User
+import bot.repository as repository
 
 
 logger = logging.getLogger(__name__)
@@ -68,9 +69,12 @@ async def approve_new_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     new_user = context.bot_data['new_users'].pop(user_id, None)
     if new_user:
         if verdict == APPROVE:
-            write_user_to_table(new_user, context.user_data['table_fullname'])
-            # write_user_to_table(new_user, 'testing')
-            context.bot_data['users'][user_id] = new_user
+            result = await repository.write_user(new_user, context.user_data['table_fullname'])
+            if result is repository.QUEUED:
+                await context.bot.send_message(
+                    update.effective_chat.id,
+                    f'Google-таблица сейчас недоступна. {new_user.fullname} будет записан в таблицу автоматически'
+                )
         await send_verdict(new_user, verdict, context)
     else:
         logger.warning(
@@ -170,6 +174,16 @@ async def get_new_fullname(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     return ConversationHandler.END
 
 
+@admin_only
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    logger.info(f'show_metrics is triggered by user: {update.effective_user}')
+    values = metrics.snapshot()
+    text = ['<b>Метрики</b>', '']
+    text += [f'<code>{name}: </code>{value}' for name, value in values.items()] or ['Пока пусто']
+    text = '\n'.join(text)
+    await update.message.reply_html(text)
+
+
 async def change_role(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     pass
 
@@ -1,20 +1,28 @@
 import datetime
+import html
 import logging
+from collections import Counter
 
 from telegram import Update
-from telegram.ext import CommandHandler, ConversationHandler, CallbackQueryHandler
-from telegram.ext import ContextTypes
-from telegram.constants import ChatAction
-
-from bot.gsheets_connector import Printers
+from telegram.ext import CommandHandler, ConversationHandler, CallbackQueryHandler, MessageHandler, filters
+from telegram.ext import Application, ContextTypes
+from telegram.constants import ChatAction, ParseMode
+
+from bot.gsheets_connector import printers
+from bot.cartridge_stats import stats, GroupStats, due_within
+from bot.cartridge_stock import stock
+import bot.repository as repository
+from bot.handlers.restrictions import admin_only
+from bot import quota
+from bot.settings import Config
 from bot.utils.keyboards import make_inline_keyboard
 from bot.utils.inline_calendar import MyCalendar, RU_STEP
 from bot.handlers.cancel import exit_command_handler, exit_callback_handler
 
 logger = logging.getLogger(__name__)
-# TODO refactor - класс Printer, в котором будет информация о конкретном принтере
-printers = Printers()  # Экземпляр класса Printers, в котором держатся страницы Реестра принтеров
 FLOOR, ROOM, DEVICE, DATE, DONE = range(5)  # Состояния для диалога по картриджам
+INCOMING_MODEL, INCOMING_AMOUNT = range(5, 7)  # Состояния для диалога по привозу картриджей
+STOCK_CALLBACK_PREFIX = 'stock_'
 
 
 async def cartridge_choose_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -25,6 +33,9 @@ async def cartridge_choose_action(update: Update, context: ContextTypes.DEFAULT_
 
     :return: :obj:`int`: Состояние FLOOR - выбор этажа
     """
+    if printers.is_stale:
+        # Реестр перечитывается в фоне, пока пользователь выбирает действие и этаж
+        context.application.create_task(repository.reload_printers(), name='printers_reload')
     buttons = ['Замена', 'Привоз']
     await update.message.reply_text(
         'Что делаем с картриджами?',
@@ -45,7 +56,15 @@ async def cartridge_choose_floor(update: Update, context: ContextTypes.DEFAULT_T
     """
     query = update.callback_query
     await query.answer()
+    return await _show_floors(update)
+
+
+async def _show_floors(update: Update) -> int:
+    """
+    Показывает кнопки этажей вместо кнопок полученного сообщения
 
+    :return: Состояние ROOM - выбор кабинета
+    """
     buttons = {
         '1': 'change_1_floor',
         '2': 'change_2_floor',
@@ -58,7 +77,7 @@ async def cartridge_choose_floor(update: Update, context: ContextTypes.DEFAULT_T
         f'Этаж: выберите'
     ]
     text = '\n'.join(text)
-    await query.edit_message_text(
+    await update.callback_query.edit_message_text(
         text,
         reply_markup=make_inline_keyboard(buttons)  # TODO добавить кнопки "Назад"
     )
@@ -75,6 +94,9 @@ async def cartridge_choose_room(update: Update, context: ContextTypes.DEFAULT_TY
     :return: Состояние DEVICE - выбор принтера
     """
     query = update.callback_query
+    if not printers.loaded:
+        await query.answer('Реестр принтеров еще загружается, попробуйте через минуту')
+        return ROOM
     floor_number = query.data[7]
     buttons = [room for room in printers.registry if room[0] == floor_number]
     if not buttons:
@@ -105,8 +127,12 @@ async def cartridge_choose_device(update: Update, context: ContextTypes.DEFAULT_
     :return: Состояние DATE - выбор даты замены
     """
     query = update.callback_query
-    await query.answer()
     room_number = query.data
+    if room_number not in printers.registry:
+        # Реестр перечитали, пока пользователь выбирал кабинет
+        await query.answer(f'Кабинета {room_number} больше нет в Реестре принтеров, выберите этаж заново')
+        return await _show_floors(update)
+    await query.answer()
     context.user_data['room'] = room_number
     buttons = [printer for printer in printers.registry[room_number]]
     if len(buttons) == 1:
@@ -222,16 +248,25 @@ async def cartridge_change_done(update: Update, context: ContextTypes.DEFAULT_TY
     await query.edit_message_text(text)
 
     await context.bot.send_chat_action(update.effective_message.chat_id, ChatAction.TYPING)
-    # TODO сделать корутиной запись в таблицу
-    last_date, elapsed = printers.change_cartridge(room, printer, date)
+    result = await repository.change_cartridge(printers, room, printer, date)
     username = update.effective_user.username
     logger.info(f'[ЗАМЕНА] {username=} {room=} {printer=} {date=}')
 
-    await context.bot.send_message(
-        update.effective_chat.id,
-        f'Прошлая замена: {last_date}\n'
-        f'Ресурс картриджа в месяцах: {elapsed}'
-    )
+    if result is repository.QUEUED:
+        await context.bot.send_message(
+            update.effective_chat.id,
+            'Google-таблица сейчас недоступна. Замена сохранена и будет внесена в Реестр принтеров автоматически'
+        )
+    else:
+        last_date, elapsed = result
+        stats.record_change(room, printer, date)
+        card = printers.card(room, printer)
+        left = f'\nОсталось картриджей {card.cartridge}: {stock.get(card.cartridge)}' if card and card.cartridge else ''
+        await context.bot.send_message(
+            update.effective_chat.id,
+            f'Прошлая замена: {last_date}\n'
+            f'Ресурс картриджа в месяцах: {elapsed}{left}'
+        )
 
     context.user_data.clear()
     return ConversationHandler.END
@@ -239,20 +274,196 @@ async def cartridge_change_done(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def cartridge_incoming(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
-    Первый этап из диалога по привозу картриджей: Этаж-Кабинет-Принтер-Дата-**Готово**.
+    Первый этап из диалога по привозу картриджей: **Модель**-Количество-Готово.
 
-    Регистрирует замену картриджа в Google-таблице и выдает сообщение о предыдущей замене.
+    Дает выбрать модель картриджа из карточек принтеров и склада или написать название новой модели.
 
-    :return: Состояние ConversationHandler.END
+    :return: Состояние INCOMING_MODEL - выбор модели
     """
     query = update.callback_query
     await query.answer()
-    await query.edit_message_text(
-        'Я пока не умею регистрировать привоз картриджей, увы...',
+    if not stock.loaded:
+        await repository.run_blocking(stock.load)  # Один раз - дальше остатки в памяти
+    models = set(stock.snapshot())
+    models.update(printer.cartridge for room in printers.registry for printer in printers.in_room(room))
+    models = sorted(model for model in models if model)
+    context.user_data['models'] = models  # В callback_data - номер модели: название может не влезть в 64 байта
+    buttons = {model: f'{STOCK_CALLBACK_PREFIX}{index}' for index, model in enumerate(models)}
+    text = [
+        'Привоз картриджей\n',
+        'Модель: выберите или напишите название новой модели'
+    ]
+    await query.edit_message_text('\n'.join(text), reply_markup=make_inline_keyboard(buttons, max_columns=2))
+    return INCOMING_MODEL
+
+
+async def cartridge_incoming_model(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Второй этап из диалога по привозу картриджей: Модель-**Количество**-Готово.
+
+    :return: Состояние INCOMING_AMOUNT - ввод количества
+    """
+    if update.callback_query:
+        query = update.callback_query
+        await query.answer()
+        model = context.user_data['models'][int(query.data.removeprefix(STOCK_CALLBACK_PREFIX))]
+    else:
+        model = update.message.text.strip()
+    context.user_data['model'] = model
+    text = [
+        'Привоз картриджей\n',
+        f'Модель: {model}',
+        f'В наличии: {stock.get(model)}',
+        'Количество: напишите, сколько картриджей привезли'
+    ]
+    text = '\n'.join(text)
+    if update.callback_query:
+        await update.callback_query.edit_message_text(text)
+    else:
+        await update.message.reply_text(text)
+    return INCOMING_AMOUNT
+
+
+async def cartridge_incoming_done(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Последний этап из диалога по привозу картриджей: Модель-Количество-**Готово**.
+
+    Прибавляет картриджи к остатку на складе (bot.cartridge_stock).
+
+    :return: Состояние ConversationHandler.END
+    """
+    model = context.user_data['model']
+    amount = int(update.message.text)
+    in_stock = await repository.receive_cartridges(model, amount)
+    logger.info(f'[ПРИВОЗ] username={update.effective_user.username} {model=} {amount=}')
+    await update.message.reply_text(
+        'Привоз картриджей\n\n'
+        f'Модель: {model}\n'
+        f'Привезено: {amount}\n'
+        f'В наличии: {in_stock}'
     )
+    context.user_data.clear()
     return ConversationHandler.END
 
 
+async def cartridge_wrong_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.message.reply_text('Напишите количество картриджей числом, например: 5')
+    return INCOMING_AMOUNT
+
+
+@admin_only
+async def reload_printers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Перечитывает Реестр принтеров: новые листы принтеров появятся в диалоге замены без перезапуска бота
+    """
+    logger.info(f'reload_printers is triggered by user: {update.effective_user}')
+    message = await update.message.reply_text('Перечитываю Реестр принтеров...')
+    await repository.reload_printers(force=True)
+    rooms = printers.registry
+    await message.edit_text(
+        f'Реестр принтеров обновлен: {sum(len(devices) for devices in rooms.values())} принтеров '
+        f'в {len(rooms)} кабинетах'
+    )
+
+
+STATS_TOP_PRINTERS = 10  # Сколько принтеров показывать в /cartridge_stats
+
+PRINTER_LABELS = {  # Поля карточки принтера (bot.models.printer) для /printer
+    'model': 'Модель',
+    'cartridge': 'Картридж',
+    'status': 'Состояние',
+    'network_name': 'Сетевое имя',
+    'ip_address': 'IP-адрес',
+    'serial_number': 'Серийный №',
+    'inventory_number': 'Инвентарный №',
+    'number': 'Внутренний №',
+}
+
+
+@admin_only
+async def show_printer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /printer <кабинет> - карточки принтеров кабинета из кэша Реестра принтеров, без запросов к Google
+    """
+    logger.info(f'show_printer is triggered by user: {update.effective_user}')
+    if not printers.loaded:
+        await update.message.reply_text('Реестр принтеров еще загружается, попробуйте через минуту')
+        return
+    if not context.args:
+        rooms = ', '.join(sorted(printers.registry))
+        await update.message.reply_text(f'Укажите кабинет: /printer 102\n\nКабинеты с принтерами: {rooms}')
+        return
+
+    room = context.args[0]
+    found = printers.in_room(room)
+    if not found:
+        await update.message.reply_text(f'В кабинете {room} нет принтеров из Реестра')
+        return
+    text = [f'<b>Кабинет {html.escape(room)}</b>']
+    for printer in found:
+        text += ['', f'<b>{html.escape(printer.device)}</b>']
+        text += [f'<code>{label}: </code>{html.escape(getattr(printer, attr))}'
+                 for attr, label in PRINTER_LABELS.items() if getattr(printer, attr)]
+    await update.message.reply_html('\n'.join(text))
+
+
+def _format_groups(title: str, groups: list[GroupStats]) -> list[str]:
+    text = ['', f'<b>{title}</b>']
+    for group in groups:
+        lifetime = f', ресурс {group.mean_months} мес' if group.mean_months is not None else ''
+        text.append(f'<code>{html.escape(group.name)}: </code>{group.last_year} за год, {group.changes} всего{lifetime}')
+    return text
+
+
+@admin_only
+async def show_cartridge_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /cartridge_stats - расход картриджей из отчета в памяти (bot.cartridge_stats)
+    """
+    logger.info(f'show_cartridge_stats is triggered by user: {update.effective_user}')
+    if stats.report is None:
+        await update.message.reply_text('Собираю историю замен картриджей...')
+        await repository.run_blocking(stats.load)
+    report = stats.report
+    text = [f'<b>Расход картриджей</b> на {report.computed_at.strftime(Config.TIMESTAMP)}']
+    text += _format_groups('По этажам', report.by_floor)
+    text += _format_groups('По моделям картриджей', report.by_model)
+    text += _format_groups('Принтеры с наибольшим расходом', report.by_printer[:STATS_TOP_PRINTERS])
+    await update.message.reply_html('\n'.join(text))
+
+
+async def send_cartridge_forecast(app: Application) -> None:
+    """
+    Ежедневное напоминание админам: каким принтерам замена картриджа понадобится в ближайшие CARTRIDGE_REMIND_DAYS
+    дней и какие картриджи взять с собой. Истории замен перечитываются одним запросом
+    """
+    with quota.lane(quota.BACKGROUND):
+        await repository.run_blocking(stats.load)
+    due = due_within(stats.forecast(), Config.CARTRIDGE_REMIND_DAYS)
+    if not due:
+        logger.info('No cartridges are due, the reminder is not sent')
+        return
+
+    text = [f'<b>Скоро закончатся картриджи</b> (в ближайшие {Config.CARTRIDGE_REMIND_DAYS} дн.)', '']
+    for item in due:
+        when = 'уже пора' if item.overdue else f'~{item.due.strftime("%d.%m")}'
+        cartridge = f' ({html.escape(item.printer.cartridge)})' if item.printer.cartridge else ''
+        text.append(f'{html.escape(item.printer.title)}{cartridge} - {when}')
+    models = Counter(item.printer.cartridge or 'модель не указана' for item in due)
+    text += ['', '<b>Взять с собой</b>']
+    text += [f'{html.escape(model)} - {amount} шт. (в наличии: {stock.get(model)})'
+             for model, amount in sorted(models.items())]
+    text = '\n'.join(text)
+
+    admins = app.bot_data['users'].admin_ids() if 'users' in app.bot_data else []
+    for admin_id in admins:
+        try:
+            await app.bot.send_message(admin_id, text, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            logger.warning(f'Cartridge reminder is not sent to {admin_id}: {e}')
+    logger.info(f'Cartridge reminder about {len(due)} printers is sent to {len(admins)} admins')
+
+
 cartridge_conversation = ConversationHandler(
     entry_points=[
         CommandHandler('cartridge', cartridge_choose_action)
@@ -282,6 +493,16 @@ cartridge_conversation = ConversationHandler(
             exit_callback_handler,
             CallbackQueryHandler(calendar_react, pattern=MyCalendar.func()),
         ],
+        INCOMING_MODEL: [
+            exit_callback_handler,
+            CallbackQueryHandler(cartridge_incoming_model, pattern='^' f'{STOCK_CALLBACK_PREFIX}'),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, cartridge_incoming_model),
+        ],
+        INCOMING_AMOUNT: [
+            exit_callback_handler,
+            MessageHandler(filters.Regex('^' '[1-9][0-9]{0,3}' '$'), cartridge_incoming_done),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, cartridge_wrong_amount),
+        ],
     },
     fallbacks=[exit_command_handler,
                exit_callback_handler]
@@ -1,12 +1,15 @@
 import html
 import json
+import time
 import traceback
 import logging
 
 from telegram import Update
 from telegram.constants import ParseMode
-from telegram.ext import ContextTypes
+from telegram.ext import Application, ContextTypes
 
+from bot.journal import journal
+from bot.resilience import SheetsUnavailable
 from bot.settings import Config
 
 logger = logging.getLogger(__name__)
@@ -17,6 +20,9 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
     # Log the error before we do anything else, so we can see it even if something breaks.
     logger.error("Exception while handling an update:", exc_info=context.error)
 
+    if isinstance(context.error, SheetsUnavailable):
+        return await sheets_unavailable_handler(update, context)
+
     # traceback.format_exception returns the usual python message about an exception, but as a
     # list of strings rather than a single string, so we have to join them together.
     tb_list = traceback.format_exception(None, context.error, context.error.__traceback__)
@@ -46,3 +52,39 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
     await context.bot.send_message(
         chat_id=Config.SUPERUSER_ID, text=message_with_traceback, parse_mode=ParseMode.HTML
     )
+
+
+async def sheets_unavailable_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Google API недоступен: пользователю - понятное сообщение вместо тишины,
+    суперадмину - короткое сообщение вместо трех с трейсбеком, не чаще раза в SHEETS_ALERT_INTERVAL секунд.
+    Ошибка бывает и без отключения выключателем (bot.resilience.breaker), поэтому повторы отсекаются по времени
+    """
+    if isinstance(update, Update) and update.effective_chat:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text='Google-таблица сейчас недоступна, действие не выполнено. Попробуйте еще раз через несколько минут'
+        )
+    notified_at = context.bot_data.get('sheets_unavailable_notified_at')
+    if notified_at is not None and time.monotonic() - notified_at < Config.SHEETS_ALERT_INTERVAL:
+        return
+    context.bot_data['sheets_unavailable_notified_at'] = time.monotonic()
+    await context.bot.send_message(
+        chat_id=Config.SUPERUSER_ID,
+        text=f'<b>Google API недоступен</b>\n<code>{html.escape(str(context.error))}</code>',
+        parse_mode=ParseMode.HTML
+    )
+
+
+async def report_journal_failures(app: Application) -> None:
+    """
+    Суперадмину - по сообщению на каждое изменение, которое таблица отклонила (bot.journal):
+    оно осталось в журнале и повторится после перезапуска бота, но, скорее всего, таблицу нужно поправить руками
+    """
+    for seq, kind, data, error in journal.take_failures():
+        text = [
+            '<b>Изменение не записано в таблицу</b>',
+            f'<code>{seq} {kind}: {html.escape(json.dumps(data, ensure_ascii=False))}</code>',
+            f'<code>{html.escape(f"{type(error).__name__}: {error}")}</code>',
+        ]
+        await app.bot.send_message(chat_id=Config.SUPERUSER_ID, text='\n'.join(text), parse_mode=ParseMode.HTML)
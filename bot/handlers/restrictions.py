@@ -39,9 +39,8 @@ def admin_only(command):
         current_user = context.bot_data['users'].get(chat_id, None)
 
         if current_user and is_admin(current_user):
-            if not context.user_data.get('table_fullname'):
-                context.user_data['table_fullname'] = current_user.fullname
-                context.user_data['role'] = current_user.role
+            context.user_data['table_fullname'] = current_user.fullname
+            context.user_data['role'] = current_user.role
             if not context.user_data.get('tasks', None):
                 context.user_data['tasks'] = {}
             return await command(*args, **kwargs)
@@ -15,7 +15,7 @@ logger = logging.getLogger(__name__)
 
 def authorize(command):
     """Декоратор, который заполняет поля user_data['table_fullname'] и user_data['role']
-    при первом обращении к команде.
+    по справочнику пользователей: роль, измененная в таблице, действует со следующей команды.
     Если пользователя нет в списке bot_data['users'], перенаправляет на регистрацию."""
 
     @functools.wraps(command)
@@ -23,11 +23,12 @@ def authorize(command):
         update: Update = args[0]
         context: ContextTypes.DEFAULT_TYPE = args[1]
 
-        if not context.user_data.get('table_fullname'):
-            current_user = context.bot_data['users'].get(update.effective_user.id, None)
-            if not current_user:
-                logger.info(f'Telegram ID {update.effective_user.id} not found. Redirecting to sign_up')
-                return await sign_up(update, context)
+        current_user = context.bot_data['users'].get(update.effective_user.id, None)
+        if not current_user:
+            logger.info(f'Telegram ID {update.effective_user.id} not found. Redirecting to sign_up')
+            return await sign_up(update, context)
+        if (context.user_data.get('table_fullname'), context.user_data.get('role')) != (current_user.fullname,
+                                                                                       current_user.role):
             context.user_data['table_fullname'] = current_user.fullname
             context.user_data['role'] = current_user.role
             logger.info(f'authorized: {str(context.user_data)}')
@@ -104,6 +105,10 @@ async def admin_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         'Доступные команды:',
         '/cartridge - начать диалог замены картриджа',
         '/tasks     - создать заявку или посмотреть задачи',
+        '/metrics   - метрики работы бота',
+        '/printer   - карточки принтеров кабинета: /printer 102',
+        '/reload_printers - перечитать Реестр принтеров',
+        '/cartridge_stats - расход картриджей',
     ]
     text = '\n'.join(text)
     await update.message.reply_html(text)
@@ -11,18 +11,20 @@ from telegram.constants import ChatAction, ParseMode
 from telegram.error import BadRequest
 
 from bot.utils.keyboards import make_inline_keyboard
-from bot.utils.users import is_admin, user_is_teacher
+from bot.utils.users import user_is_teacher
 from bot.settings import Config
 from bot.handlers.cancel import exit_command_handler, exit_callback_handler
 from bot.handlers.restrictions import admin_only
 from bot.handlers.start import authorize
 from bot.models.task import Task
+import bot.repository as repository
 
 logger = logging.getLogger(f'{__name__}')
 
 WAIT_ACTION, WAIT_PROBLEM, WAIT_DESCRIPTION, WAIT_ROOM, WAIT_PRIORITY, WAIT_SHOW = range(6)
 CLOSE_TASK = 'close'
 CANCEL_TASK = 'cancel'
+QUEUED_TEXT = '⏳ Google-таблица сейчас недоступна, изменения будут записаны в нее автоматически'
 
 
 @authorize
@@ -274,7 +276,7 @@ async def create_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         await update.message.reply_html(text)
     await context.bot.send_chat_action(update.effective_chat.id, ChatAction.TYPING)
 
-    task = Task.create(
+    task, result = await repository.create_task(
         room,
         f'{category}: {description}',
         f'{context.user_data["table_fullname"]}',
@@ -289,14 +291,15 @@ async def create_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         f'Дата заявки: {task.created_at.strftime(Config.TIMESTAMP)}\n',
         'Если хотите создать еще одну заявку, используйте команду /tasks'
     ]
+    if result is repository.QUEUED:
+        text += ['', QUEUED_TEXT]
     text = '\n'.join(text)
     await context.bot.send_message(update.effective_chat.id, text, parse_mode=ParseMode.HTML)
     return await send_new_task_to_admins(task.task_id, context)
 
 
 async def send_new_task_to_admins(task_id: int, context: ContextTypes.DEFAULT_TYPE) -> int:
-    admin_ids = [
-        user.telegram_id for user in context.bot_data['users'].values() if user.role in ('Админ', 'Суперадмин')]
+    admin_ids = context.bot_data['users'].admin_ids()
     task = context.bot_data['new_tasks'].get(task_id, None)
     if not task:
         logger.error(f'Task {task_id} not found in context.bot_data["new_tasks"]')
@@ -336,7 +339,6 @@ async def tasks_show_which(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     query = update.callback_query
     await query.answer()
     await context.bot.send_chat_action(update.effective_chat.id, ChatAction.TYPING)
-    context.user_data['tasks'] = _get_open_tasks_by_executor(context.user_data['table_fullname'])
     buttons = {
         'Невзятые': 'show_nobodys',
         'Мои': 'show_0'
@@ -350,6 +352,29 @@ async def tasks_show_which(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     return WAIT_SHOW
 
 
+@admin_only
+async def show_task_view(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Показывает первую задачу из выбранного списка: Мои (show_0), Невзятые (show_nobodys) или Все (show_all)
+    """
+    query = update.callback_query
+    _, action, view = query.data.split('_')
+    logger.info(f'show_task_view {view} is triggered by: {update.effective_user}')
+    if view == 'nobodys':
+        tasks = await repository.find_tasks(status=Config.STATUS_NOT_TAKEN)
+    elif view == 'all':
+        tasks = await repository.find_tasks(status=[Config.STATUS_NOT_TAKEN, Config.STATUS_TAKEN])
+    else:
+        tasks = await repository.find_tasks(executor=context.user_data['table_fullname'],
+                                            status=Config.STATUS_TAKEN)
+    context.user_data['tasks'] = {task.task_id: task for task in tasks}
+    if not tasks:
+        await query.answer()
+        await query.edit_message_text('Задач нет')
+        return ConversationHandler.END
+    return await show_one_task(update, context)
+
+
 @admin_only
 async def show_one_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
@@ -357,7 +382,7 @@ async def show_one_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     await query.answer()
     await context.bot.send_chat_action(update.effective_chat.id, ChatAction.TYPING)
     _, action, task_id = query.data.split('_')
-    task_id = int(task_id)
+    task_id = int(task_id) if task_id.isdigit() else 0
 
     if not task_id:
         task_id = next(iter(context.user_data['tasks']))
@@ -401,7 +426,7 @@ async def accept_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         logger.warning(f'Task {task_id} is not found in context.bot_data["new_tasks"]'
                        f'It could be accepted by another admin')
         return
-    task.take(context.user_data['table_fullname'])
+    result = await repository.take_task(task, context.user_data['table_fullname'])
     text = [
         f'{query.message.text}',
         '',
@@ -411,6 +436,8 @@ async def accept_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         '',
         'Команда /tasks покажет все задачи',
     ]
+    if result is repository.QUEUED:
+        text += ['', QUEUED_TEXT]
     text = '\n'.join(text)
     await query.edit_message_text(text, parse_mode=ParseMode.HTML, entities=query.message.entities)
 
@@ -432,23 +459,20 @@ async def close_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         logger.warning(f'Task {task_id} is not found in the table.'
                        f'It could be closed by another admin')
         return
+    result = None
     if action == CLOSE_TASK:
-        task.complete()
+        result = await repository.complete_task(task)
     elif action == CANCEL_TASK:
-        task.cancel()
+        result = await repository.cancel_task(task)
     await show_one_task(update, context)
+    if result is repository.QUEUED:
+        await context.bot.send_message(update.effective_chat.id, QUEUED_TEXT)
 
 
 async def send_notification_to_author(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     pass
 
 
-def _get_open_tasks_by_executor(executor: str) -> dict[int, Task]:
-    tasks = Task.get_all_tasks(executor=executor,
-                               status='Взято')
-    return {task.task_id: task for task in tasks}
-
-
 def _make_task_scrolling_keyboard(task_id: int, tasks: dict[int, Task]) -> InlineKeyboardMarkup:
     # TODO вынести в клавиатуры?
     task_ids = [key for key in tasks.keys()]
@@ -479,7 +503,8 @@ tasks_conversation = ConversationHandler(
                     MessageHandler(filters.Regex('^' '[1-5][0-2][0-9]+' '$'), tasks_get_room),
                     MessageHandler(filters.TEXT & ~filters.COMMAND, tasks_wrong_room)],
         WAIT_PRIORITY: [CallbackQueryHandler(tasks_get_priority, pattern='^' 'tasks_priority_[0-3]' '$')],
-        WAIT_SHOW: [CallbackQueryHandler(show_one_task, pattern='^' 'tasks_show_[0-9]+' '$')]
+        WAIT_SHOW: [CallbackQueryHandler(show_task_view, pattern='^' 'tasks_show_(0|nobodys|all)' '$'),
+                    CallbackQueryHandler(show_one_task, pattern='^' 'tasks_show_[0-9]+' '$')]
     },
     fallbacks=[exit_callback_handler, exit_command_handler]
 )
@@ -0,0 +1,262 @@
+"""
+Журнал изменений (write-ahead log) для записи в Google-Таблицы
+
+Каждое изменение задачи, пользователя или картриджа сначала дописывается в файл JOURNAL_PATH
+и сбрасывается на диск (fsync), и только потом отправляется в таблицу. Когда запись в таблицу прошла,
+в журнал дописывается подтверждение. Если Google недоступен или бот упал, неподтвержденные записи
+применяются повторно (replay) - при запуске и затем фоновой задачей раз в JOURNAL_REPLAY_INTERVAL секунд.
+
+Формат - одна JSON-строка на событие:
+    {"s":12,"k":"task","d":{...}}   - изменение номер 12 вида task с данными d
+    {"a":12}                        - изменение 12 применено
+Подтверждения не сбрасываются на диск: если подтверждение потеряется, изменение просто применится еще раз,
+поэтому обработчики изменений (register) должны быть идемпотентными.
+
+Когда все изменения применены, а файл вырос больше JOURNAL_MAX_BYTES, журнал очищается.
+
+Изменение, которое таблица отклонила (не из-за недоступности Google), не подтверждается. Его получает обработчик
+rejected своего вида (register) при следующем повторе: например, новая задача после TaskIdCollision получает
+следующий номер и записывается заново. Если обработчика нет или он не помог, изменение остается в журнале
+(повторится после перезапуска бота), а суперадмин получает сообщение (take_failures).
+
+Метрики:
+    journal_pending     - сколько изменений ждут записи в таблицу
+    journal_failed      - сколько изменений таблица отклонила, они ждут перезапуска или ручной правки
+"""
+import json
+import logging
+import os
+import pathlib
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future
+
+from bot.resilience import SheetsUnavailable
+from bot.settings import Config
+from bot.utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    def __init__(self, path: pathlib.Path, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._appliers: dict[str, Callable[[dict], None]] = {}
+        self._rejecters: dict[str, Callable[[dict, Exception], bool]] = {}
+        self._pending: dict[int, tuple[str, dict]] = {}  # seq -> (вид, данные)
+        self._inflight: set[int] = set()  # Изменения, которые сейчас отправляет в таблицу сам бот - их не повторять
+        self._rejected: dict[int, Exception] = {}  # Отклонены таблицей, ждут обработчика rejected при повторе
+        self._failed: dict[int, Exception] = {}  # Не применить без перезапуска или ручной правки
+        self._reported: set[int] = set()  # О каких failed уже сообщено суперадмину
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._file = None
+
+    def register(self,
+                 kind: str,
+                 applier: Callable[[dict], Future | None],
+                 rejected: Callable[[dict, Exception], bool] | None = None) -> None:
+        """
+        Задает функцию, которая применяет к таблице изменение вида <kind>. Вызывается при повторе.
+        Функция может вернуть Future записи через bot.batch_writer - тогда изменение подтвердится после записи.
+        <rejected>(данные, ошибка) вызывается при повторе для изменения, которое отклонила таблица,
+        и возвращает True, если исправил его (например, записал заново) - тогда изменение подтверждается
+        """
+        self._appliers[kind] = applier
+        if rejected:
+            self._rejecters[kind] = rejected
+
+    def _open(self) -> None:
+        if self._file:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            self._load()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self) -> None:
+        with open(self.path, encoding='utf-8') as file:
+            for number, line in enumerate(file, start=1):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f'Journal line {number} is broken and skipped: {line!r}')  # Оборванная запись
+                    continue
+                if 'a' in entry:
+                    self._pending.pop(entry['a'], None)
+                else:
+                    self._pending[entry['s']] = (entry['k'], entry['d'])
+                    self._seq = max(self._seq, entry['s'])
+        metrics.set_value('journal_pending', len(self._pending))
+        logger.info(f'Journal is loaded: {len(self._pending)} changes are not applied yet')
+
+    def _write(self, entry: dict, sync: bool) -> None:
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def append(self, kind: str, data: dict) -> int:
+        """
+        Надежно сохраняет изменение до отправки в таблицу
+
+        :return: номер изменения для ack
+        """
+        with self._lock:
+            self._open()
+            self._seq += 1
+            self._write({'s': self._seq, 'k': kind, 'd': data}, sync=True)
+            self._pending[self._seq] = (kind, data)
+            self._inflight.add(self._seq)
+            metrics.set_value('journal_pending', len(self._pending))
+            return self._seq
+
+    def ack(self, seq: int) -> None:
+        """
+        Отмечает изменение <seq> примененным
+        """
+        with self._lock:
+            self._inflight.discard(seq)
+            self._rejected.pop(seq, None)
+            if self._failed.pop(seq, None) is not None:
+                metrics.set_value('journal_failed', len(self._failed))
+            if self._pending.pop(seq, None) is None:
+                return
+            self._write({'a': seq}, sync=False)
+            metrics.set_value('journal_pending', len(self._pending))
+            if not self._pending and self._file.tell() > self.max_bytes:
+                self._truncate()
+
+    def release(self, seq: int) -> None:
+        """
+        Изменение <seq> не удалось записать сразу - его применит replay
+        """
+        with self._lock:
+            self._inflight.discard(seq)
+
+    def reject(self, seq: int, error: Exception) -> None:
+        """
+        Таблица отклонила изменение <seq>. Оно не подтверждается: им займется обработчик rejected при повторе
+        """
+        logger.warning(f'Journal change {seq} is rejected by the table: {error}')
+        with self._lock:
+            self._inflight.discard(seq)
+            if seq in self._pending:
+                self._rejected[seq] = error
+
+    def ack_when_done(self, seq: int, future: Future, handled: tuple[type[Exception], ...] = ()) -> Future:
+        """
+        Подтверждает изменение, когда запись <future> завершится.
+        Ошибки <handled> исправляет тот, кто ждет <future> (например, TaskIdCollision для новой задачи), -
+        изменение тоже подтверждается. Запись, отклоненную таблицей по другой причине, получает reject
+        """
+        def done(result: Future) -> None:
+            error = result.exception()
+            if isinstance(error, SheetsUnavailable):
+                self.release(seq)
+            elif error and not isinstance(error, handled):
+                self.reject(seq, error)
+            else:
+                self.ack(seq)
+
+        future.add_done_callback(done)
+        return future
+
+    def take_failures(self) -> list[tuple[int, str, dict, Exception]]:
+        """
+        returns the changes which failed since the last call: (seq, kind, data, error)
+        """
+        with self._lock:
+            failures = [(seq, *self._pending[seq], error) for seq, error in sorted(self._failed.items())
+                        if seq not in self._reported and seq in self._pending]
+            self._reported.update(seq for seq, *_ in failures)
+            return failures
+
+    def _handle_rejected(self, seq: int, kind: str, data: dict, error: Exception) -> bool:
+        """
+        Передает отклоненное изменение обработчику rejected. Выполняется в пуле потоков
+
+        :return: True, если изменение исправлено и подтверждено
+        """
+        rejecter = self._rejecters.get(kind)
+        try:
+            fixed = bool(rejecter and rejecter(data, error))
+        except SheetsUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f'Rejected journal change {seq} {kind} cannot be fixed: {e}', exc_info=True)
+            fixed = False
+        if fixed:
+            self.ack(seq)
+            return True
+        logger.error(f'Journal change {seq} {kind} {data} is rejected by the table and kept: {error}')
+        with self._lock:
+            self._rejected.pop(seq, None)
+            self._failed[seq] = error
+            metrics.set_value('journal_failed', len(self._failed))
+        return False
+
+    def _truncate(self) -> None:
+        self._file.close()
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.flush()
+            os.fsync(file.fileno())
+        self._file = open(self.path, 'a', encoding='utf-8')
+        logger.info('Journal is truncated: all changes are applied')
+
+    @property
+    def pending_count(self) -> int:
+        with self._lock:
+            self._open()
+            return len(self._pending)
+
+    def replay(self) -> int:
+        """
+        Применяет к таблице все неподтвержденные изменения по порядку. Выполняется в пуле потоков.
+        Останавливается на первом изменении, которое не удалось применить из-за недоступности Google.
+        Изменения, которые таблица отклонила, передаются обработчику rejected, а не применяются снова
+
+        :return: сколько изменений применено
+        """
+        with self._replay_lock:
+            with self._lock:
+                self._open()
+                pending = sorted(item for item in self._pending.items()
+                                 if item[0] not in self._inflight and item[0] not in self._failed)
+                rejected = dict(self._rejected)
+            applied = 0
+            for seq, (kind, data) in pending:
+                applier = self._appliers.get(kind)
+                if not applier:
+                    logger.error(f'No applier for journal change {seq} of kind {kind}')
+                    continue
+                try:
+                    if seq in rejected:
+                        if self._handle_rejected(seq, kind, data, rejected[seq]):
+                            applied += 1
+                        continue
+                    result = applier(data)
+                except SheetsUnavailable as e:
+                    logger.warning(f'Journal replay stopped at change {seq}: {e}')
+                    break
+                except Exception as e:
+                    if self._handle_rejected(seq, kind, data, e):
+                        applied += 1
+                    continue
+                if isinstance(result, Future):
+                    # Изменение ушло в очередь bot.batch_writer - подтвердится, когда запишется
+                    with self._lock:
+                        self._inflight.add(seq)
+                    self.ack_when_done(seq, result)
+                else:
+                    self.ack(seq)
+                applied += 1
+            if applied:
+                logger.info(f'Journal replay applied {applied} of {len(pending)} changes')
+            return applied
+
+
+journal = Journal(Config.JOURNAL_PATH, Config.JOURNAL_MAX_BYTES)
@@ -0,0 +1,93 @@
+"""
+Перенос изменений из SQLite в Google-Таблицы (только для STORAGE_BACKEND=sqlite)
+
+Бот пишет задачи и пользователей в bot.storage, а раз в MIRROR_INTERVAL секунд эта фоновая задача
+переносит в таблицу все, что помечено как неперенесенное:
+    - измененные ячейки задач - через очередь bot.batch_writer, одним запросом values.batchUpdate
+    - новых пользователей - в конец листа пользователей
+Пока таблица недоступна, изменения копятся в SQLite и уходят при следующем удачном запуске.
+Правки, сделанные в таблице руками, забирает обратно синхронизация bot.sync.
+
+Метрики:
+    mirror_pending_tasks    - сколько задач ждало переноса при последнем запуске
+    mirror_failures         - сколько раз перенос не удался
+"""
+import functools
+import logging
+from concurrent.futures import wait
+
+import bot.database as database
+import bot.repository as repository
+import bot.storage as storage
+from bot import quota
+from bot.batch_writer import writer
+from bot.models.task import Task
+from bot.models.task_codec import get_codec
+from bot.models.task_index import task_index
+from bot.models.task_ids import TaskIdCollision, check_row_is_free
+from bot.settings import Config
+from bot.utils import metrics
+from bot.utils.users import append_user_to_table
+
+
+logger = logging.getLogger(__name__)
+
+
+def push_tasks() -> int:
+    """
+    :return: сколько задач перенесено в таблицу
+    """
+    dirty = storage.store.dirty_tasks()
+    metrics.set_value('mirror_pending_tasks', len(dirty))
+    if not dirty:
+        return 0
+
+    codec = get_codec()
+    futures = {}
+    for task_id, row, cells, fields, is_new, version in dirty:
+        task = Task.from_row(cells)
+        if is_new:
+            fields = Config.task_columns
+        values = codec.to_columns({attr: task._to_cell(attr) for attr in fields})
+        guard = functools.partial(check_row_is_free, task_id, row) if is_new else None
+        futures[writer.submit_cells(database.task_sheet, row, values, guard=guard)] = (task_id, version)
+    wait(futures)
+
+    pushed = 0
+    for future, (task_id, version) in futures.items():
+        error = future.exception()
+        if error is None:
+            storage.store.mark_task_clean(task_id, version)
+            pushed += 1
+        elif isinstance(error, TaskIdCollision):
+            # Строку заняли в таблице вручную - задача получит новый номер и уйдет в таблицу в следующий раз
+            task = task_index.get(task_id)
+            if task:
+                task.renumber()
+                logger.warning(f'Task {task_id} is renumbered to {task.task_id} before copying to the table')
+        else:
+            metrics.inc('mirror_failures')
+    logger.info(f'{pushed} of {len(dirty)} tasks are copied from SQLite to the table')
+    return pushed
+
+
+def push_users() -> int:
+    """
+    :return: сколько пользователей перенесено в таблицу
+    """
+    pushed = 0
+    for values in storage.store.dirty_users():
+        append_user_to_table(values)
+        storage.store.mark_user_clean(values[0])
+        pushed += 1
+    return pushed
+
+
+def push() -> None:
+    push_tasks()
+    push_users()
+
+
+async def mirror() -> None:
+    with quota.lane(quota.BACKGROUND):
+        await repository.run_blocking(push)
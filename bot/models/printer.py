@@ -0,0 +1,70 @@
+"""
+Класс Printer - карточка принтера со страницы Реестра принтеров
+
+Карточка - столбец B2:B12 листа принтера "<кабинет> <принтер>" (Printer.CELLS).
+Карточки всех принтеров читаются одним запросом values.batchGet (Printer.read_all) вместе с перечитыванием
+Реестра принтеров (bot.gsheets_connector) и хранятся в памяти до следующего перечитывания.
+"""
+from dataclasses import dataclass
+
+import pygsheets
+
+import bot.database as database
+
+
+@dataclass
+class Printer:
+    room: str  # Кабинет - из названия листа
+    device: str  # Название принтера - из названия листа
+    model: str = ''
+    cartridge: str = ''
+    status: str = ''  # Работает, Кончился картридж, Есть проблемы, В ремонте, Готов к выдаче
+    network_name: str = ''
+    ip_address: str = ''
+    serial_number: str = ''
+    inventory_number: str = ''
+    number: str = ''
+
+    COLUMN = 2  # Значения карточки - столбец B
+    CELLS = {  # Поле: строка карточки на листе принтера
+        'model': 2,  # B2 - Модель принтера
+        'cartridge': 4,  # B4 - Модель картриджа
+        'status': 5,  # B5 - Состояние
+        'network_name': 7,  # B7 - Сетевое имя принтера
+        'ip_address': 8,  # B8 - IP-адрес принтера
+        'serial_number': 10,  # B10 - Серийный № принтера
+        'inventory_number': 11,  # B11 - Инвентарный № принтера
+        'number': 12,  # B12 - Внутренний № принтера
+    }
+    FIRST_ROW, LAST_ROW = min(CELLS.values()), max(CELLS.values())  # Карточка читается одним диапазоном B2:B12
+
+    @classmethod
+    def from_block(cls, room: str, device: str, block: list[list]) -> 'Printer':
+        """
+        Собирает принтер из ячеек диапазона B<FIRST_ROW>:B<LAST_ROW> его листа
+        """
+        fields = {}
+        for attr, row in cls.CELLS.items():
+            values = block[row - cls.FIRST_ROW] if row - cls.FIRST_ROW < len(block) else []
+            fields[attr] = str(values[0]).strip() if values else ''
+        return cls(room, device, **fields)
+
+    @classmethod
+    def read_all(cls, registry: dict[str, dict[str, pygsheets.worksheet]]) -> dict[str, list['Printer']]:
+        """
+        Читает карточки всех принтеров реестра одним запросом values.batchGet
+
+        :param registry: {кабинет: {принтер: лист}} - как Printers.registry
+        :return: {кабинет: [Printer, ...]}
+        """
+        sheets = [(room, device, sheet) for room, devices in registry.items() for device, sheet in devices.items()]
+        if not sheets:
+            return {}
+        blocks = database.batch_get_sheets(
+            sheets[0][2].spreadsheet,
+            [(sheet, (cls.FIRST_ROW, cls.COLUMN), (cls.LAST_ROW, cls.COLUMN)) for _, _, sheet in sheets]
+        )
+        printers = {}
+        for (room, device, _), block in zip(sheets, blocks):
+            printers.setdefault(room, []).append(cls.from_block(room, device, block))
+        return printers
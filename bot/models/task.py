@@ -1,7 +1,7 @@
 """
 Класс Task, который описывает задачу для Google-таблицы "Задачи Admin 1060"
 
-Столбцы (поля):
+Столбцы (поля) по умолчанию - бот находит их по заголовкам (bot.models.task_codec):
     id          A - 1
     Кабинет     B - 2
     Задача      C - 3
@@ -17,11 +17,20 @@
     Блок        M - 13
 """
 import dataclasses
+import functools
 import logging
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
 from datetime import datetime
 
 import bot.database as database
+import bot.storage as storage
+from bot.batch_writer import writer
+from bot.journal import journal
 from bot.settings import Config
+from bot.models.task_codec import TaskCodec, canonical_codec, get_codec, parse_comments
+from bot.models.task_index import task_index
+from bot.models.task_ids import task_ids, check_row_is_free, TaskIdCollision
 
 
 logger = logging.getLogger(__name__)
@@ -72,20 +81,13 @@ class Task:
             completed_at = datetime.strptime(completed_at, Config.TIMESTAMP)
         self.completed_at = completed_at
 
-        self.comments = self._parse_comments_from_str(comments)
+        self.comments = comments if isinstance(comments, list) else self._parse_comments_from_str(comments)
         self.is_blocked = is_blocked
         self.changed = dict()
 
     @staticmethod
     def _parse_comments_from_str(comments: str) -> list[tuple[datetime, str]]:
-        result = []
-        if comments:
-            comments = comments.split('\n')
-            for comment in comments:
-                time, comment = [item.strip() for item in comment.split(']')]
-                time = datetime.strptime(time[1:], Config.TIMESTAMP)
-                result.append((time, comment))
-        return result
+        return list(parse_comments(comments)) if comments else []
 
     @staticmethod
     def _parse_comments_to_str(comments: list[tuple[datetime, str]]) -> str:
@@ -96,36 +98,109 @@ class Task:
             result.append(f'[{time.strftime(Config.TIMESTAMP)}] {comment}')
         return '\n'.join(result)
 
-    def write_to_table(self, row: int | None = None):
+    def _to_cell(self, attr: str) -> str | int:
+        """
+        Convert an attribute of the Task to the value of its cell in the table
+        """
+        value = getattr(self, attr)
+        if attr == 'task_id':
+            # Число, а не формула =СТРОКА(): формулы сдвигаются, когда bot.archiver удаляет строки
+            return self.task_id
+        if attr == 'comments':
+            return self._parse_comments_to_str(self.comments)
+        if attr in ('created_at', 'taken_at', 'complete_until', 'completed_at'):
+            return value.strftime(Config.TIMESTAMP) if value else ''
+        if attr == 'status' and value in Config.mappings:
+            return Config.mappings[value]
+        if attr == 'executor' and value and isinstance(value, int):
+            return Config.mappings[value]
+        return '' if value is None else value
+
+    def write_to_table(self,
+                       row: int | None = None,
+                       new: bool = False,
+                       handled: tuple[type[Exception], ...] = (TaskIdCollision,)) -> Future:
+        """
+        Queue the changed cells of the Task for writing to the table.
+
+        Only attributes from :attr:`changed` are written, so the cells edited in the table by hand are kept.
+        Adjacent cells are joined into one range.
+        With the SQLite storage the cells are saved locally and :mod:`bot.mirror` copies them to the table later,
+        otherwise the change is saved to :mod:`bot.journal` first, so it survives a crash or a Google outage.
+        Use ``new=True`` for a Task which is not in the table yet: the whole row is written,
+        and the write fails with :class:`TaskIdCollision` if the row is already taken in the table.
+        The caller handles the errors from <handled> (gives the Task a new id and writes it again),
+        so the journal change is acked on them; other rejected writes stay in the journal.
+
+        Returns :class:`concurrent.futures.Future` which is done when the cells are written
+        (at once if nothing is changed)
+        """
         logger.info(f'Pushing {self} with {self.changed} to the table')
-        if not row:
-            row = self.row
-
-        dict_to_write = self.__dict__.copy()
-        dict_to_write.pop('changed')
-        dict_to_write['task_id'] = f'=СТРОКА($A${self.task_id})'  # Фиксируем id задачи на случай сортировок
-        dict_to_write['comments'] = self._parse_comments_to_str(self.comments)
-
-        # Преобразование дат
-        for key in ('created_at', 'taken_at', 'complete_until', 'completed_at'):
-            if dict_to_write[key]:
-                dict_to_write[key] = self.__dict__[key].strftime(Config.TIMESTAMP)
-        if dict_to_write['status'] in Config.mappings:
-            dict_to_write['status'] = Config.mappings[dict_to_write['status']]
-        if dict_to_write['executor'] and isinstance(dict_to_write['executor'], int):
-            dict_to_write['executor'] = Config.mappings[dict_to_write['executor']]
-
-        logger.info(f'Values to be inserted: {dict_to_write}')
-        database.task_sheet.update_row(row, list(dict_to_write.values()))
-        logger.info(f'{self} is successfully pushed to the table')
-        result = self.changed
-        self.changed.clear()
-        return result
+        with task_index.rows_lock:  # Строка не должна сдвинуться, пока запись не встанет в очередь
+            if not row:
+                row = self.row
+
+            fields = Config.task_columns if new else self.changed
+            cells = {attr: self._to_cell(attr) for attr in fields}
+            logger.info(f'Values to be inserted: {cells}')
+            task_index.put(self, row)
+            self.changed.clear()
+            if storage.store:
+                logger.info(f'{self} is saved to SQLite')
+                return storage.store.save_task(self.task_id, row, cells, new=new)
+            if not cells:
+                logger.info(f'{self} has no changes to write')
+                nothing = Future()  # Ждать чужие записи в очереди незачем
+                nothing.set_result(None)
+                return nothing
+            logger.info(f'{self} is queued for writing to the table')
+            change = {'task_id': self.task_id,
+                      'row': row,
+                      'cells': get_codec().to_columns(cells),
+                      'new': new}
+            seq = journal.append('task', change)  # Сначала на диск, потом в очередь записи
+            written = journal.ack_when_done(seq, self.replay_write(change), handled)
+            task_index.mark_written(self.task_id, written)
+            return written
+
+    @staticmethod
+    def replay_write(change: dict) -> Future:
+        """
+        Queue the cells of a journal change for writing. Used by :meth:`write_to_table` and on journal replay
+        """
+        cells = {int(col): value for col, value in change['cells'].items()}
+        guard = functools.partial(check_row_is_free, change['task_id'], change['row']) if change['new'] else None
+        return writer.submit_cells(database.task_sheet, change['row'], cells, guard=guard)
+
+    @classmethod
+    def replay_rejected(cls, change: dict, error: Exception) -> bool:
+        """
+        Called on journal replay for a change the table rejected. A new Task which hit :class:`TaskIdCollision`
+        gets the next free id and is written again as a new journal change, like in ``repository._write_new_task``.
+        Returns False for other errors: the change stays in the journal
+        """
+        if not change['new'] or not isinstance(error, TaskIdCollision):
+            return False
+        task = task_index.get(change['task_id'])
+        if task is None:  # Бот перезапускался - задача есть только в журнале
+            codec = get_codec()
+            values = [''] * codec.last_column
+            for col, value in change['cells'].items():
+                values[int(col) - 1] = value
+            task = cls.from_row(values, codec)
+        task.renumber()
+        task.write_to_table(new=True, handled=())  # Новая коллизия снова попадет сюда при следующем повторе
+        return True
 
     @property
     def row(self) -> int:
-        task_ids = database.get_ids()
-        return task_ids.index(self.task_id) + 2
+        row = task_index.row_of(self.task_id)
+        if row is None:
+            logger.warning(f'{self} is not in the task index. Searching the table')
+            task_ids = database.get_ids()
+            row = task_ids.index(self.task_id) + 2
+            task_index.put(self, row)
+        return row
 
     def take(self, executor_id: int | str, taken_at: datetime | None = None):
         logger.info(f'ID {executor_id} is trying to take {self} ')
@@ -160,6 +235,8 @@ class Task:
             raise AttributeError(message)
         setattr(self, attr, value)
         self.changed[attr] = value
+        if attr in task_index.INDEXED_FIELDS:
+            task_index.reindex(self)
         logger.info(f'Updated attribute {attr} with {value}')
         return {'ok': True}
 
@@ -179,7 +256,7 @@ class Task:
         """
         if not given_at:
             given_at = datetime.now()
-        self._edit_one('comment', [(given_at, new_comment)])
+        self._edit_one('comments', [(given_at, new_comment)])
         return self.write_to_table()
 
     def add_comment(self, new_comment: str, given_at: datetime | None = None):
@@ -196,8 +273,8 @@ class Task:
         if not given_at:
             given_at = datetime.now()
         self.comments.append((given_at, new_comment))
-        self.changed['comments'] = self._parse_comments_to_str([(given_at, new_comment)])
-        logger.info(f'Updated attribute comment with {self.changed['comments']}')
+        self.changed['comments'] = self._to_cell('comments')  # В ячейку пишутся все комментарии, а не только новый
+        logger.info(f'Updated attribute comments with {self.changed['comments']}')
         return {'ok': True}
 
     def change_executor(self, new_executor: int, taken_at: datetime | None = None):
@@ -295,10 +372,46 @@ class Task:
     @classmethod
     def get_last_id(cls) -> int:
         logger.info('Finding last used task_id')
-        last_id = sorted(database.get_ids())[-1]
+        last_id = max(database.get_ids(), default=0)
         logger.info(f'Last task_id found: {last_id}')
         return int(last_id)
 
+    @classmethod
+    def new(cls,
+            room: int,
+            text: str,
+            author: str,
+            created_at: datetime | None = None,
+            priority: int = 2):
+        """
+        Make a Task with the next free id and put it to the task index. Nothing is written to the table
+        """
+        if not task_ids.seeded:
+            cls.load_index()
+        new_id = task_ids.allocate()
+        if not created_at:
+            created_at = datetime.now()
+        new_task = Task(new_id, room, text, created_at, author, priority)
+        task_index.reserve_row(new_task)
+        logger.info(f'Task created: {new_task}')
+        return new_task
+
+    def renumber(self) -> None:
+        """
+        Give the Task the next free id and the next row after :class:`TaskIdCollision`.
+        The allocator is re-seeded from the table, so the ids taken by hand are skipped
+        """
+        old_id = self.task_id
+        task_ids.seed(max(self.get_last_id(), old_id))
+        with task_index.rows_lock:
+            taken_row = task_index.row_of(old_id) or task_index.FIRST_ROW
+            task_index.remove(old_id)
+            self.task_id = task_ids.allocate()
+            row = task_index.reserve_row(self, min_row=taken_row + 1)  # Занятую вручную строку пропускаем
+            if storage.store:
+                storage.store.renumber_task(old_id, self.task_id, row)
+        logger.warning(f'Task id {old_id} is taken in the table, {self} got a new one')
+
     @classmethod
     def create(cls,
                room: int,
@@ -306,51 +419,189 @@ class Task:
                author: str,
                created_at: datetime | None = None,
                priority: int = 2):
-        new_id = cls.get_last_id() + 1
-        database.task_sheet.update_value((new_id + 1, Config.task_columns['task_id']), new_id)
-        logger.info(f'{new_id=} is reserved on the table')
-        if not created_at:
-            created_at = datetime.now()
-        new_task = Task(new_id, room, text, created_at, author, priority)
-        logger.info(f'Task created: {new_task}')
-        new_task.write_to_table(row=new_id + 1)
+        """
+        Make a new Task and queue it for writing to the table
+        """
+        new_task = cls.new(room, text, author, created_at, priority)
+        new_task.write_to_table(new=True)
         return new_task
 
     @classmethod
     def get_one_or_none(cls, task_id: int):
         logger.info(f'Finding {task_id=}')
-        ids = database.get_ids()
+        if not task_index.loaded:
+            cls.load_index()
 
-        try:
-            row = ids.index(task_id) + 2  # rows begin from 1, 1st row - title
-        except ValueError:
-            logger.error(f'{task_id} is not found in the table')
+        task = task_index.get(task_id)
+        if not task:
+            logger.error(f'{task_id} is not found in the task index')
             return None
-        logger.info(f'Found {task_id=} on {row=}. Pulling the task from the table')
-        task = Task(*database.task_sheet.get_row(row=row, include_tailing_empty=False))
-        logger.info(f'{task} is pulled from the table')
+        logger.info(f'Found {task} on row={task_index.row_of(task_id)}')
         return task
 
+    @classmethod
+    def from_row(cls, values: list[str], codec: TaskCodec = canonical_codec) -> 'Task':
+        """
+        Make a Task from the cells of its row. By default the cells are in the order of Config.task_columns
+        """
+        return Task(*codec.decode(values))
+
+    @classmethod
+    def from_rows(cls, rows: dict[int, list[str]], codec: TaskCodec = canonical_codec) -> dict[int, 'Task']:
+        """
+        Make Tasks from a block of rows: {row number: cells}. The rows without id are skipped
+        """
+        return {row: Task(*args) for row, args in codec.decode_rows(rows).items()}
+
+    @classmethod
+    def load_index(cls,
+                   rows: list[list[str]] | None = None,
+                   generation: int | None = None,
+                   since: int | None = None) -> dict[int, 'Task']:
+        """
+        Fill the task index from the table rows. Rows are downloaded if not given.
+
+        With the SQLite storage the rows are imported to SQLite first (the tasks with changes
+        not copied to the table yet are kept), and the index is filled from SQLite.
+        If the table is unavailable, the bot starts with the tasks it has in SQLite.
+        Pass <generation> (TaskIndex.generation before reading the rows) if the rows were read earlier:
+        the index is not touched if the rows were moved by :mod:`bot.archiver` since then.
+        Pass <since> (TaskIndex.local_version before reading the rows) to keep the tasks changed by the bot
+        while the rows were read, see :meth:`TaskIndex.is_dirty`
+
+        Returns the loaded tasks: {row number: Task}
+        """
+        with task_index.rows_lock:
+            if generation is not None and generation != task_index.generation:
+                logger.info('Task rows were moved while they were read, the task index is not reloaded')
+                return {}
+            return cls._load_index(rows, since)
+
+    @classmethod
+    def _load_index(cls, rows: list[list[str]] | None, since: int | None = None) -> dict[int, 'Task']:
+        codec = get_codec()
+        if storage.store:
+            if rows is None:
+                try:
+                    rows = database.get_task_rows(last_column=codec.last_column)
+                except Exception as e:
+                    logger.error(f'Cannot read the tasks from the table, using SQLite only: {e}')
+            if rows is not None:
+                storage.store.import_rows({row: codec.canonical(values)
+                                           for row, values in enumerate(rows, start=task_index.FIRST_ROW)})
+            tasks = cls.from_rows(storage.store.load_rows())
+        else:
+            if rows is None:
+                rows = database.get_task_rows(last_column=codec.last_column)
+            tasks = cls.from_rows(dict(enumerate(rows, start=task_index.FIRST_ROW)), codec)
+            if since is not None:
+                tasks = {row: (task_index.get(task.task_id) or task) if task_index.is_dirty(task.task_id, since) else task
+                         for row, task in tasks.items()}
+        task_index.load(tasks)
+        task_ids.seed(max((task.task_id for task in tasks.values()), default=0))
+        return tasks
+
+    @classmethod
+    def patch_index(cls, rows: dict[int, list[str]], generation: int | None = None, since: int | None = None) -> None:
+        """
+        Update the task index with some rows of the table: {row number: cells}.
+        The tasks with changes which are not in the table yet are kept as they are.
+        <generation> and <since> work like in :meth:`load_index`
+        """
+        codec = get_codec()
+        with task_index.rows_lock:
+            if generation is not None and generation != task_index.generation:
+                logger.info('Task rows were moved while they were read, the task index is not patched')
+                return
+            if storage.store:
+                storage.store.import_rows({row: codec.canonical(values) for row, values in rows.items()})
+            for row, task in cls.from_rows(rows, codec).items():
+                task_ids.seed(task.task_id)  # Задачи, добавленные вручную, не должны получить повторный номер
+                if storage.store and storage.store.is_dirty(task.task_id):
+                    continue
+                if since is not None and task_index.is_dirty(task.task_id, since):
+                    continue
+                task_index.put(task, row)
+
+    @classmethod
+    def find(cls, **criteria) -> list['Task']:
+        """
+        Find the tasks in the task index without reading the table, see :meth:`TaskIndex.find`::
+
+            Task.find(status=Config.STATUS_TAKEN, executor='Акимов Дмитрий')
+        """
+        if not task_index.loaded:
+            cls.load_index()
+        return task_index.find(**criteria)
+
     @classmethod
     def get_all_tasks(cls, **filter_by) -> list:
-        rows = database.get_rows_amount()
+        """
+        Find the tasks by the values of their cells, e.g. ``get_all_tasks(status='Взято')``.
+        Rows are filtered before decoding, so only the found tasks are parsed
+        """
+        if storage.store:
+            codec = canonical_codec
+            rows = storage.store.load_rows()
+        else:
+            codec = get_codec()
+            generation = task_index.generation
+            rows = dict(enumerate(database.get_task_rows(last_column=codec.last_column), start=task_index.FIRST_ROW))
         logger.info(f'Applying {filter_by=}')
-        keys = list(filter_by.keys())
-        for key in keys:
-            if key not in Config.task_columns:
+        matches = cls._row_filter(codec, filter_by)
+        found = {row: values for row, values in rows.items() if matches(values)}
+        if storage.store:
+            result = list(cls.from_rows(found).values())
+        else:
+            # Таблица уже скачана целиком - заодно обновляем индекс
+            tasks = cls.load_index(list(rows.values()), generation) or cls.from_rows(found, codec)
+            result = [tasks[row] for row in found if row in tasks]
+        logger.info(f'{len(result)} tasks found with query {filter_by}')
+        return result
+
+    @classmethod
+    def iter_tasks(cls,
+                   filter_by: dict[str, str] | Callable[['Task'], bool] | None = None,
+                   chunk_size: int = Config.SHEETS_PAGE_ROWS) -> Iterator['Task']:
+        """
+        Yield the tasks one by one, reading the table (or SQLite) by chunks of <chunk_size> rows.
+        Only one chunk is kept in memory, and the rest of the table is not read if the caller stops early::
+
+            for task in Task.iter_tasks({'status': 'Выполнено'}):
+                ...
+
+        :param filter_by: cell values like in :meth:`get_all_tasks` (checked before decoding)
+            or a function which gets a decoded Task and returns True for the tasks to yield
+        """
+        if storage.store:
+            codec = canonical_codec
+            chunks = storage.store.iter_rows(chunk_size)
+        else:
+            codec = get_codec()
+            pages = database.iter_pages(database.task_sheet, task_index.FIRST_ROW, codec.last_column, chunk_size)
+            chunks = (dict(enumerate(block, start=start)) for start, block in pages)
+        predicate = filter_by if callable(filter_by) else None
+        matches = cls._row_filter(codec, {} if predicate else dict(filter_by or {}))
+        for rows in chunks:
+            for row, task in cls.from_rows({row: values for row, values in rows.items() if matches(values)},
+                                           codec).items():
+                if predicate is None or predicate(task):
+                    yield task
+
+    @staticmethod
+    def _row_filter(codec: TaskCodec, filter_by: dict[str, str]) -> Callable[[list], bool]:
+        """
+        returns a function which checks the raw cells of a row against <filter_by> (unknown fields are skipped)
+        """
+        for key in list(filter_by):
+            if key not in codec.columns:
                 logger.warning(f'Task has not an attribute called {key}, skipping')
                 filter_by.pop(key)
+        conditions = [(codec.columns[key] - 1, value) for key, value in filter_by.items()]
+        return lambda values: all(index < len(values) and values[index] == value for index, value in conditions)
 
-        result = []
-        for row in rows:
-            # print(row)
-            for key, value in filter_by.items():
-                if row[Config.task_columns[key] - 1] != value:
-                    break
-            else:
-                result.append(Task(*row))
-        logger.info(f'{len(result)} tasks found with query {filter_by}')
-        return result
+
+journal.register('task', Task.replay_write, Task.replay_rejected)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,225 @@
+"""
+Разбор строк листа задач "Задачи Admin 1060"
+
+Конструктор Task для каждой строки вызывал datetime.strptime четыре раза, дважды искал значение перебором
+Config.get_from_mappings и разбирал примечания - и так для всех строк при каждом get_all_tasks.
+TaskCodec строится один раз по строке заголовков листа (названия столбцов - в Config.task_headers),
+поэтому столбцы находятся по названию, а не по жестко заданным номерам Config.task_columns,
+и разбирает сразу целый блок строк:
+    - даты - быстрым разбором формата Config.TIMESTAMP с кэшем: от вызова к вызову читаются одни и те же строки
+    - статус и исполнитель - по обратному словарю Config.mappings
+    - примечания - один раз на каждое уникальное значение ячейки
+
+Строки из SQLite (bot.storage) всегда хранятся в порядке Config.task_columns - их разбирает canonical_codec.
+
+Замер скорости разбора листа из 10 000 строк:
+    python -m bot.models.task_codec
+"""
+import functools
+import logging
+import sys
+import threading
+from collections.abc import Callable
+from datetime import datetime
+
+import bot.database as database
+from bot.settings import Config
+
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FIELDS = ('created_at', 'taken_at', 'complete_until', 'completed_at')
+CACHE_SIZE = 1 << 16  # Уникальных дат и примечаний в кэше
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse_timestamp(value: str) -> datetime:
+    """
+    То же, что datetime.strptime(value, Config.TIMESTAMP), но формат ДД.ММ.ГГГГ ЧЧ:ММ[:СС] разбирается без strptime
+    """
+    if Config.TIMESTAMP in ('%d.%m.%Y %H:%M', '%d.%m.%Y %H:%M:%S'):
+        date, _, clock = value.partition(' ')
+        clock = clock.split(':')
+        try:
+            day, month, year = date.split('.')
+            if len(clock) == Config.TIMESTAMP.count(':') + 1:
+                return datetime(int(year), int(month), int(day), *[int(part) for part in clock])
+        except ValueError:
+            pass
+    return datetime.strptime(value, Config.TIMESTAMP)  # Нестандартное значение - пусть strptime сообщит об ошибке
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse_comments(value: str) -> tuple[tuple[datetime, str], ...]:
+    """
+    Разбирает ячейку "Примечания": строки вида [ДД.ММ.ГГГГ ЧЧ:ММ] текст
+    """
+    result = []
+    for line in value.split('\n'):
+        time, comment = [item.strip() for item in line.split(']', 1)]
+        result.append((parse_timestamp(time[1:]), comment))
+    return tuple(result)
+
+
+class TaskCodec:
+    def __init__(self, columns: dict[str, int]):
+        self.columns = dict(columns)  # поле Task: номер столбца (с 1)
+        self.last_column = max(self.columns.values())
+        names = {name: key for key, name in Config.mappings.items()}
+        converters: dict[str, Callable | None] = {
+            'task_id': int,
+            'room': int,
+            'created_at': lambda value: parse_timestamp(value) if isinstance(value, str) else value,
+            'status': lambda value: names.get(value) if isinstance(value, str) else value,
+            'executor': lambda value: names.get(value) if isinstance(value, str) else value,
+            'comments': lambda value: list(parse_comments(value)) if value else [],
+            'is_blocked': lambda value: value in ('TRUE', '1', 1, True),
+        }
+        for attr in TIMESTAMP_FIELDS[1:]:
+            converters[attr] = lambda value: parse_timestamp(value) if value and isinstance(value, str) else value
+        # (индекс ячейки, разбор) в порядке аргументов Task. Поле без столбца всегда получает ''
+        self._fields = [(self.columns[attr] - 1 if attr in self.columns else sys.maxsize, converters.get(attr))
+                        for attr in Config.task_columns]
+        self._id_index = self.columns['task_id'] - 1
+
+    def __repr__(self):
+        return f'<TaskCodec: {self.columns}>'
+
+    @classmethod
+    def from_header(cls, header: list[str]) -> 'TaskCodec':
+        """
+        Находит столбцы по строке заголовков. Поле без заголовка остается на месте из Config.task_columns,
+        если этот столбец не занят другим полем
+        """
+        columns = {}
+        for col, title in enumerate(header, start=1):
+            attr = Config.task_headers.get(str(title).strip())
+            if attr and attr not in columns:
+                columns[attr] = col
+        missing = [attr for attr in Config.task_columns if attr not in columns]
+        if missing and columns:
+            logger.warning(f'Task sheet header has no columns for {missing}, the default positions are used')
+        taken = set(columns.values())
+        for attr in missing:
+            if Config.task_columns[attr] not in taken:
+                columns[attr] = Config.task_columns[attr]
+        if 'task_id' not in columns:
+            logger.error(f'Task sheet header {header} has no id column, the default columns are used')
+            return cls(Config.task_columns)
+        return cls({attr: columns[attr] for attr in Config.task_columns if attr in columns})
+
+    def task_id(self, values: list) -> int | None:
+        """
+        returns task_id from the cells of a row or None for an empty row
+        """
+        if len(values) > self._id_index and values[self._id_index]:
+            return int(values[self._id_index])
+        return None
+
+    def decode(self, values: list) -> list:
+        """
+        returns the arguments of Task(...) made from the cells of one row
+        """
+        width = len(values)
+        args = []
+        for index, convert in self._fields:
+            value = values[index] if index < width else ''
+            args.append(convert(value) if convert else value)
+        return args
+
+    def decode_rows(self, rows: dict[int, list]) -> dict[int, list]:
+        """
+        Разбирает блок строк {номер строки: ячейки}. Строки без id пропускаются
+
+        :return: {номер строки: аргументы Task(...)}
+        """
+        id_index, decode = self._id_index, self.decode
+        return {row: decode(values) for row, values in rows.items() if len(values) > id_index and values[id_index]}
+
+    def canonical(self, values: list) -> list:
+        """
+        Переставляет ячейки строки листа в порядок Config.task_columns (так задачи хранятся в SQLite)
+        """
+        width = len(values)
+        return [values[self.columns[attr] - 1] if attr in self.columns and self.columns[attr] <= width else ''
+                for attr in Config.task_columns]
+
+    def to_columns(self, cells: dict[str, object]) -> dict[int, object]:
+        """
+        Переводит {поле Task: значение ячейки} в {номер столбца: значение}. Поля без столбца пропускаются
+        """
+        return {self.columns[attr]: value for attr, value in cells.items() if attr in self.columns}
+
+
+canonical_codec = TaskCodec(Config.task_columns)
+
+_codec: TaskCodec | None = None
+_lock = threading.Lock()
+
+
+def get_codec() -> TaskCodec:
+    """
+    returns the codec of the task sheet. The header row is read from the table once
+    """
+    global _codec
+    with _lock:
+        if _codec is None:
+            try:
+                header = database.task_sheet.get_row(1, include_tailing_empty=False)
+            except Exception as e:
+                logger.error(f'Cannot read the header of the task sheet, the default columns are used: {e}')
+                return canonical_codec
+            _codec = TaskCodec.from_header(header)
+            logger.info(f'Task sheet columns: {_codec.columns}')
+        return _codec
+
+
+def reset() -> None:
+    """
+    Заголовки будут перечитаны при следующем get_codec - например, если столбцы переставили в таблице
+    """
+    global _codec
+    with _lock:
+        _codec = None
+
+
+def benchmark(amount: int = 10_000) -> None:
+    import random
+    import time
+    from bot.models.task import Task
+
+    random.seed(1060)
+    statuses = [Config.mappings[status] for status in range(4)]
+    executors = ['', 'Акимов Дмитрий', 'Глобин Никита']
+
+    def timestamp() -> str:
+        return datetime(2024, random.randint(1, 12), random.randint(1, 28),
+                        random.randint(8, 20), random.randint(0, 59)).strftime(Config.TIMESTAMP)
+
+    rows = {}
+    for task_id in range(1, amount + 1):
+        status = random.choice(statuses)
+        taken = status != statuses[0]
+        comments = '\n'.join(f'[{timestamp()}] Комментарий {n}' for n in range(random.randint(0, 2)))
+        rows[task_id + 1] = [str(task_id), str(random.randint(100, 420)), f'Задача {task_id}', timestamp(), 'Акимов',
+                             str(random.randint(0, 3)), status, random.choice(executors[1:]) if taken else '',
+                             timestamp() if taken else '', '', timestamp() if status in statuses[2:] else '',
+                             comments, 'FALSE']
+
+    def measure(name: str, decode: Callable[[], object]) -> None:
+        started = time.perf_counter()
+        decode()
+        elapsed = time.perf_counter() - started
+        print(f'{name:<34} {elapsed * 1000:8.1f} ms  {amount / elapsed:10,.0f} rows/sec')
+
+    print(f'{amount} rows of the task sheet')
+    measure('Task(*row)', lambda: [Task(*values[:Config.task_columns['comments']]) for values in rows.values()])
+    codec = TaskCodec.from_header(list(Config.task_headers))
+    parse_timestamp.cache_clear()
+    parse_comments.cache_clear()
+    measure('TaskCodec.decode_rows, cold cache', lambda: Task.from_rows(rows, codec))
+    measure('TaskCodec.decode_rows, warm cache', lambda: Task.from_rows(rows, codec))
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
@@ -0,0 +1,62 @@
+"""
+Выдача номеров новых задач
+
+Номер задачи не связан с номером строки: строки сдвигаются, когда bot.archiver убирает закрытые задачи в архив,
+а номера задач остаются прежними. Новая задача занимает первую строку после всех известных (TaskIndex.reserve_row).
+Счетчик один раз инициализируется максимальным id из таблицы (Task.load_index), дальше номера выдаются
+из памяти процесса под блокировкой, поэтому два одновременных диалога не получат один и тот же номер.
+
+Если строку успели занять вручную прямо в таблице, это выясняется перед отправкой записи (check_row_is_free):
+запись отклоняется с TaskIdCollision, а задача получает следующий свободный номер.
+"""
+import logging
+import threading
+
+import bot.database as database
+from bot.models.task_codec import get_codec
+
+
+logger = logging.getLogger(__name__)
+
+
+class TaskIdCollision(Exception):
+    def __init__(self, task_id: int, row: int, found: str):
+        self.task_id = task_id
+        self.row = row
+        super().__init__(f'Row {row} for task_id={task_id} is already taken in the table by {found!r}')
+
+
+class TaskIdAllocator:
+    def __init__(self):
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self.seeded = False
+
+    def seed(self, last_id: int) -> None:
+        """
+        Сдвигает счетчик так, чтобы следующий номер был больше <last_id>. Назад счетчик не идет никогда
+        """
+        with self._lock:
+            self._last_id = max(self._last_id, last_id)
+            self.seeded = True
+        logger.info(f'Task id allocator is seeded with {last_id=}')
+
+    def allocate(self) -> int:
+        with self._lock:
+            if not self.seeded:
+                raise RuntimeError('Task id allocator is not seeded. Call Task.load_index first')
+            self._last_id += 1
+            return self._last_id
+
+
+def check_row_is_free(task_id: int, row: int) -> None:
+    """
+    Проверяет, что ячейка id в строке <row> пустая. Вызывается из BatchWriter прямо перед записью новой задачи.
+    Если в строке уже эта же задача, значит, прошлая попытка записи дошла до таблицы - повтор ничего не испортит
+    """
+    found = database.task_sheet.get_value((row, get_codec().columns['task_id']))
+    if found and str(found) != str(task_id):
+        raise TaskIdCollision(task_id, row, found)
+
+
+task_ids = TaskIdAllocator()
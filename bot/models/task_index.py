@@ -0,0 +1,233 @@
+"""
+Индекс задач в памяти процесса
+
+Хранит для каждого task_id номер строки в таблице "Задачи Admin 1060" и последний известный объект Task,
+чтобы поиск задачи по id не требовал скачивания столбца A.
+Загружается один раз при старте бота (Task.load_index) и обновляется всеми методами Task, которые меняют таблицу.
+
+Вторичные индексы по полям INDEXED_FIELDS (статус, исполнитель, кабинет, автор, приоритет) хранят множества task_id
+для каждого значения поля, поэтому выборки вида "взятые задачи исполнителя" - это пересечение множеств (find),
+без скачивания таблицы. Индексы обновляются при каждом изменении задачи (put, reindex, remove).
+
+Номера строк меняются, когда bot.archiver удаляет закрытые задачи из листа. Поэтому:
+    - запись задачи в таблицу (поиск строки + постановка в очередь) и архивация идут под rows_lock
+    - архивация увеличивает generation: строки, прочитанные до нее, в индекс уже не попадут
+
+Пока изменение задачи, сделанное ботом, не записано в таблицу, строка из таблицы устарела. Синхронизация
+(bot.sync) пропускает такие задачи: is_dirty(task_id, since) - запись еще в очереди или поставлена после чтения.
+"""
+import logging
+import threading
+from concurrent.futures import Future
+from typing import TYPE_CHECKING
+
+from bot.settings import Config
+
+if TYPE_CHECKING:
+    from bot.models.task import Task
+
+
+logger = logging.getLogger(__name__)
+
+
+class TaskIndex:
+    FIRST_ROW = 2  # Первая строка с задачами (строка 1 - заголовки)
+    INDEXED_FIELDS = ('status', 'executor', 'room', 'author', 'priority')
+
+    def __init__(self):
+        self._rows: dict[int, int] = {}  # task_id -> номер строки
+        self._tasks: dict[int, 'Task'] = {}  # task_id -> Task
+        self._by_field: dict[str, dict[object, set[int]]] = {field: {} for field in self.INDEXED_FIELDS}
+        self._keys: dict[int, tuple] = {}  # task_id -> значения INDEXED_FIELDS, под которыми задача лежит в индексах
+        self._lock = threading.RLock()  # к индексу обращаются потоки из пула bot.repository
+        self.rows_lock = threading.RLock()  # номера строк не меняются, пока он захвачен
+        self.generation = 0  # Сколько раз строки задач сдвигались в таблице
+        self.local_version = 0  # Сколько изменений задач бот поставил в очередь записи
+        self._writes: dict[int, tuple[int, int]] = {}  # task_id -> (незавершенных записей, local_version последней)
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, task_id: int) -> bool:
+        return task_id in self._rows
+
+    def load(self, tasks: dict[int, 'Task']) -> None:
+        """
+        Заменяет содержимое индекса задачами из таблицы.
+        Новые задачи ниже последней строки таблицы остаются: они еще стоят в очереди на запись
+
+        :param tasks: словарь вида номер строки: Task
+        """
+        last_row = max(tasks, default=self.FIRST_ROW - 1)
+        with self._lock:
+            pending = {task_id: row for task_id, row in self._rows.items() if row > last_row}
+            self._rows = {task.task_id: row for row, task in tasks.items()} | pending
+            self._tasks = {task.task_id: task for task in tasks.values()} | {
+                task_id: self._tasks[task_id] for task_id in pending}
+            self._by_field = {field: {} for field in self.INDEXED_FIELDS}
+            self._keys = {}
+            for task in self._tasks.values():
+                self._index(task)
+            self.loaded = True
+        logger.info(f'Task index loaded: {len(self._rows)} tasks')
+
+    def put(self, task: 'Task', row: int) -> None:
+        with self._lock:
+            self._rows[task.task_id] = row
+            self._tasks[task.task_id] = task
+            self._unindex(task.task_id)
+            self._index(task)
+
+    def reserve_row(self, task: 'Task', min_row: int = FIRST_ROW) -> int:
+        """
+        Кладет новую задачу в индекс на первую свободную строку после всех известных задач, но не выше <min_row>
+
+        :return: номер строки
+        """
+        with self._lock:
+            row = max(max(self._rows.values(), default=self.FIRST_ROW - 1) + 1, min_row)
+            self.put(task, row)
+            return row
+
+    def move_rows(self, moves: dict[int, int], removed: list[int]) -> None:
+        """
+        Убирает задачи <removed> и переносит остальные на новые строки <moves> (task_id: строка) одним действием
+        """
+        with self._lock:
+            for task_id in removed:
+                self.remove(task_id)
+            self._rows.update(moves)
+            self.generation += 1
+        logger.info(f'Task index: {len(removed)} tasks removed, {len(moves)} tasks moved')
+
+    def reindex(self, task: 'Task') -> None:
+        """
+        Обновляет вторичные индексы после изменения полей задачи. Задачи не из индекса пропускаются
+        """
+        with self._lock:
+            if self._tasks.get(task.task_id) is task:
+                self._unindex(task.task_id)
+                self._index(task)
+
+    def remove(self, task_id: int) -> None:
+        with self._lock:
+            self._rows.pop(task_id, None)
+            self._tasks.pop(task_id, None)
+            self._writes.pop(task_id, None)
+            self._unindex(task_id)
+
+    def mark_written(self, task_id: int, future: Future) -> None:
+        """
+        Отмечает изменение задачи, поставленное в очередь записи. <future> завершится, когда оно попадет в таблицу
+        """
+        with self._lock:
+            self.local_version += 1
+            pending, _ = self._writes.get(task_id, (0, 0))
+            self._writes[task_id] = (pending + 1, self.local_version)
+        future.add_done_callback(lambda _: self._write_done(task_id))
+
+    def _write_done(self, task_id: int) -> None:
+        with self._lock:
+            if task_id in self._writes:
+                pending, version = self._writes[task_id]
+                self._writes[task_id] = (max(pending - 1, 0), version)
+
+    def is_dirty(self, task_id: int, since: int) -> bool:
+        """
+        True, если строка задачи, прочитанная из таблицы при local_version == <since>, могла устареть:
+        изменение бота еще не записано или поставлено в очередь после чтения
+        """
+        with self._lock:
+            pending, version = self._writes.get(task_id, (0, 0))
+            return pending > 0 or version > since
+
+    @staticmethod
+    def key(field: str, value) -> object:
+        """
+        Приводит значение поля к виду, под которым оно лежит в индексе: в памяти исполнитель может быть
+        и id, и ФИО из таблицы, а приоритет - и числом, и строкой
+        """
+        if isinstance(value, str):
+            if field in ('status', 'executor'):
+                key = Config.get_from_mappings(value)
+                return (value or None) if key is None else key
+            if not value:
+                return None
+        if field == 'priority' and value is not None:
+            return str(value)
+        return value
+
+    def _index(self, task: 'Task') -> None:
+        keys = tuple(self.key(field, getattr(task, field, None)) for field in self.INDEXED_FIELDS)
+        for field, key in zip(self.INDEXED_FIELDS, keys):
+            self._by_field[field].setdefault(key, set()).add(task.task_id)
+        self._keys[task.task_id] = keys
+
+    def _unindex(self, task_id: int) -> None:
+        keys = self._keys.pop(task_id, None)
+        if keys is None:
+            return
+        for field, key in zip(self.INDEXED_FIELDS, keys):
+            ids = self._by_field[field].get(key)
+            if ids is not None:
+                ids.discard(task_id)
+                if not ids:
+                    del self._by_field[field][key]
+
+    def find(self, **criteria) -> list['Task']:
+        """
+        Задачи, у которых поля равны <criteria>, по возрастанию task_id. Значение-список означает "любое из":
+
+            task_index.find(status=Config.STATUS_TAKEN, executor='Акимов Дмитрий')
+            task_index.find(status=[Config.STATUS_NOT_TAKEN, Config.STATUS_TAKEN])
+        """
+        for field in criteria:
+            if field not in self._by_field:
+                raise KeyError(f'Task index has no index for {field}')
+        with self._lock:
+            if not criteria:
+                return [self._tasks[task_id] for task_id in sorted(self._tasks)]
+            sets = sorted((self._ids(field, value) for field, value in criteria.items()), key=len)
+            found = sets[0].intersection(*sets[1:])  # Начинаем с самого маленького множества
+            return [self._tasks[task_id] for task_id in sorted(found)]
+
+    def _ids(self, field: str, value) -> set[int]:
+        values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+        ids = set()
+        for item in values:
+            ids |= self._by_field[field].get(self.key(field, item), set())
+        return ids
+
+    def count(self, field: str) -> dict[object, int]:
+        """
+        Сколько задач с каждым значением поля <field>, например count('status')
+        """
+        with self._lock:
+            return {key: len(ids) for key, ids in self._by_field[field].items()}
+
+    def rows_where(self, predicate) -> list[int]:
+        """
+        Номера строк задач, для которых predicate(task) истинно
+        """
+        with self._lock:
+            return [self._rows[task_id] for task_id, task in self._tasks.items() if predicate(task)]
+
+    def ids_by_row(self) -> dict[int, int]:
+        with self._lock:
+            return {row: task_id for task_id, row in self._rows.items()}
+
+    def row_of(self, task_id: int) -> int | None:
+        return self._rows.get(task_id)
+
+    def get(self, task_id: int) -> 'Task | None':
+        return self._tasks.get(task_id)
+
+    @property
+    def last_row(self) -> int:
+        """Номер последней занятой строки таблицы"""
+        with self._lock:
+            return max(self._rows.values(), default=self.FIRST_ROW - 1)
+
+
+task_index = TaskIndex()
@@ -0,0 +1,136 @@
+"""
+Планировщик запросов к Google Sheets API с учетом квоты
+
+Google ограничивает количество запросов на чтение и на запись в минуту для сервисного аккаунта.
+При превышении pygsheets засыпает на 100 секунд или бросает ошибку 429, и пользователь остается без ответа.
+Поэтому каждый запрос к API (client.sheet._execute_requests) сначала получает токен из своего ведра:
+    read  - GET-запросы, SHEETS_READS_PER_MINUTE в минуту
+    write - все остальные, SHEETS_WRITES_PER_MINUTE в минуту
+Ведро вмещает SHEETS_QUOTA_BURST токенов - столько запросов можно сделать подряд без ожидания.
+
+Очередь к ведру разделена на полосы: запросы из полосы INTERACTIVE (действия пользователей) получают токен
+раньше запросов из BACKGROUND (синхронизация, перенос в таблицу, отчеты). Полоса задается контекстом:
+
+    with quota.lane(quota.BACKGROUND):
+        await repository.run_blocking(...)
+
+Метрики (kind - read или write):
+    sheets_<kind>_requests            - сколько запросов выполнено
+    sheets_<kind>_queue_depth         - сколько запросов сейчас ждут токен
+    sheets_<kind>_wait_seconds_total  - суммарное время ожидания токена
+    sheets_<kind>_wait_seconds_max    - самое долгое ожидание токена
+"""
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections.abc import Callable
+
+from bot.settings import Config
+from bot.utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BACKGROUND = range(2)
+
+current_lane: contextvars.ContextVar[int] = contextvars.ContextVar('sheets_lane', default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def lane(priority: int):
+    """
+    Запросы к таблицам внутри блока with выполняются в полосе <priority>
+    """
+    token = current_lane.set(priority)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, name: str, per_minute: float, burst: int):
+        self.name = name
+        self.rate = per_minute / 60  # Токенов в секунду
+        self.capacity = burst
+        self.tokens = float(burst)
+        self._updated = time.monotonic()
+        self._waiting: list[tuple[int, int]] = []  # Куча (полоса, номер) ожидающих запросов
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority: int = INTERACTIVE) -> float:
+        """
+        Ждет своей очереди и свободного токена
+
+        :return: сколько секунд пришлось ждать
+        """
+        started = time.monotonic()
+        ticket = (priority, next(self._counter))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            metrics.set_value(f'sheets_{self.name}_queue_depth', len(self._waiting))
+            self._cond.notify_all()  # Запрос с более высоким приоритетом мог встать в начало очереди
+            try:
+                while True:
+                    self._refill()
+                    first = self._waiting[0] == ticket
+                    if first and self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    timeout = (1 - self.tokens) / self.rate if first else None
+                    self._cond.wait(timeout)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                metrics.set_value(f'sheets_{self.name}_queue_depth', len(self._waiting))
+                self._cond.notify_all()
+        return time.monotonic() - started
+
+
+class QuotaScheduler:
+    def __init__(self, reads_per_minute: float, writes_per_minute: float, burst: int):
+        self.buckets = {
+            kind: TokenBucket(kind, per_minute, burst)
+            for kind, per_minute in (('read', reads_per_minute), ('write', writes_per_minute))
+            if per_minute > 0
+        }
+
+    def run(self, kind: str, func: Callable, /, *args, **kwargs):
+        """
+        Выполняет запрос <func> к API, когда для него появится токен из ведра <kind>
+        """
+        bucket = self.buckets.get(kind)
+        if bucket:
+            waited = bucket.acquire(current_lane.get())
+            metrics.inc(f'sheets_{kind}_wait_seconds_total', round(waited, 3))
+            if waited > metrics.get(f'sheets_{kind}_wait_seconds_max', 0):
+                metrics.set_value(f'sheets_{kind}_wait_seconds_max', round(waited, 3))
+            if waited > 1:
+                logger.info(f'Sheets {kind} request waited {waited:.1f}s for the quota')
+        metrics.inc(f'sheets_{kind}_requests')
+        return func(*args, **kwargs)
+
+    def install(self, client) -> None:
+        """
+        Пропускает через планировщик все запросы клиента pygsheets (или bot.fake_gsheets)
+        """
+        execute = client.sheet._execute_requests
+
+        def scheduled_execute(request):
+            kind = 'read' if getattr(request, 'method', 'GET') == 'GET' else 'write'
+            return self.run(kind, execute, request)
+
+        client.sheet._execute_requests = scheduled_execute
+
+
+scheduler = QuotaScheduler(Config.SHEETS_READS_PER_MINUTE, Config.SHEETS_WRITES_PER_MINUTE, Config.SHEETS_QUOTA_BURST)
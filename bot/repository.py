@@ -0,0 +1,231 @@
+"""
+Асинхронный слой доступа к Google-Таблицам
+
+pygsheets - синхронная библиотека: каждый запрос блокирует поток до ответа Google.
+Функции модуля выполняют такие запросы в ограниченном пуле потоков, поэтому event loop
+бота продолжает обслуживать других пользователей, пока идет запись в таблицу.
+
+Размер пула задается переменной окружения SHEETS_MAX_WORKERS.
+
+Изменения задач уходят в таблицу через очередь bot.batch_writer: функции модуля
+возвращают управление, только когда запись действительно попала в таблицу.
+Если за SHEETS_WRITE_TIMEOUT секунд запись не завершилась (Google недоступен, и запись ждет повтора),
+функции возвращают QUEUED - обработчик может сообщить пользователю, что изменения будут записаны позже.
+
+Каждое изменение сначала попадает в журнал bot.journal, поэтому QUEUED-изменения переживают и перезапуск бота:
+replay_journal раз в JOURNAL_REPLAY_INTERVAL секунд дописывает их в таблицу.
+"""
+import asyncio
+import contextvars
+import datetime
+import functools
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from bot import quota
+from bot.settings import Config
+from bot.batch_writer import writer
+from bot.journal import journal
+from bot.resilience import SheetsUnavailable
+from bot.models.task import Task
+from bot.models.task_ids import TaskIdCollision
+from bot.models.task_index import task_index
+from bot.gsheets_connector import Printers, printers as printer_registry
+from bot.cartridge_stock import stock
+from bot.utils.users import User, users_directory, write_user_to_table
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = {'queued': True}  # Изменение принято, но еще не записано в таблицу
+
+_unfinished: set[asyncio.Task] = set()  # Записи новых задач, которые завершаются в фоне
+
+executor = ThreadPoolExecutor(max_workers=Config.SHEETS_MAX_WORKERS, thread_name_prefix='gsheets')
+
+
+async def run_blocking(func, /, *args, **kwargs):
+    """
+    Выполняет блокирующую функцию <func> в пуле потоков и возвращает ее результат
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()  # Полоса планировщика bot.quota переходит в поток пула
+    return await loop.run_in_executor(executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+async def wait_written(result: Future | dict) -> dict | None:
+    """
+    Дожидается записи в таблицу, если метод Task поставил ее в очередь.
+    Методы, которые ничего не записали, возвращают словарь с причиной - он возвращается как есть.
+    Если запись не завершилась за SHEETS_WRITE_TIMEOUT секунд, возвращает QUEUED, а запись остается в очереди
+    """
+    if isinstance(result, Future):
+        result = asyncio.wrap_future(result)
+    if not asyncio.isfuture(result):
+        return result
+    try:
+        return await asyncio.wait_for(asyncio.shield(result), Config.SHEETS_WRITE_TIMEOUT)
+    except TimeoutError:
+        logger.warning(f'Write is not confirmed in {Config.SHEETS_WRITE_TIMEOUT}s, it stays queued')
+        return QUEUED
+
+
+async def create_task(room: int, text: str, author: str, priority: int = 2) -> tuple[Task, dict | None]:
+    """
+    :return: задача и QUEUED, если она еще не попала в таблицу (запись будет завершена в фоне)
+    """
+    task = await run_blocking(Task.new, room, text, author, priority=priority)
+    writing = asyncio.ensure_future(_write_new_task(task))
+    result = await wait_written(writing)
+    if result is QUEUED:
+        _unfinished.add(writing)
+        writing.add_done_callback(_finish_writing)
+    return task, result
+
+
+async def _write_new_task(task: Task) -> None:
+    while True:
+        try:
+            # Журнал делает fsync, а запись ждет rows_lock - не в event loop
+            await asyncio.wrap_future(await run_blocking(task.write_to_table, new=True))
+        except TaskIdCollision as e:
+            logger.warning(f'{e}. Trying the next id')
+            await run_blocking(task.renumber)
+        else:
+            return
+
+
+def _finish_writing(writing: asyncio.Task) -> None:
+    _unfinished.discard(writing)
+    if not writing.cancelled() and writing.exception():
+        logger.error(f'Queued write failed: {writing.exception()}', exc_info=writing.exception())
+
+
+async def take_task(task: Task, executor_id: int | str) -> dict | None:
+    return await wait_written(await run_blocking(task.take, executor_id))
+
+
+async def complete_task(task: Task) -> dict | None:
+    return await wait_written(await run_blocking(task.complete))
+
+
+async def cancel_task(task: Task) -> dict | None:
+    return await wait_written(await run_blocking(task.cancel))
+
+
+async def get_tasks(**filter_by) -> list[Task]:
+    return await run_blocking(Task.get_all_tasks, **filter_by)
+
+
+async def find_tasks(**criteria) -> list[Task]:
+    """
+    Ищет задачи в индексе bot.models.task_index - таблица читается, только если индекс еще не загружен
+    """
+    if task_index.loaded:
+        return task_index.find(**criteria)
+    return await run_blocking(Task.find, **criteria)
+
+
+async def change_cartridge(printers: Printers,
+                           room: str,
+                           device: str,
+                           date: str | datetime.date) -> tuple[str, int | str] | dict:
+    """
+    :return: предыдущая дата замены и ресурс картриджа или QUEUED, если таблица недоступна
+    """
+    if isinstance(date, datetime.date):
+        date = date.strftime('%d.%m.%Y')
+    seq = await run_blocking(journal.append, 'cartridge', {'room': room, 'device': device, 'date': date})
+    try:
+        result = await run_blocking(printers.change_cartridge, room, device, date)
+    except SheetsUnavailable as e:
+        logger.warning(f'Cartridge change {room} {device} {date} is queued: {e}')
+        journal.release(seq)
+        result = QUEUED
+    except Exception:
+        journal.release(seq)  # Повтор из журнала разберется с ошибкой или сообщит о ней
+        raise
+    else:
+        journal.ack(seq)
+    await use_cartridge(printers, room, device)  # Замена принята - даже если попадет в таблицу позже
+    return result
+
+
+async def use_cartridge(printers: Printers, room: str, device: str) -> int | None:
+    """
+    Списывает со склада картридж модели из карточки принтера
+
+    :return: сколько картриджей этой модели осталось или None, если модель картриджа у принтера не указана
+    """
+    card = printers.card(room, device)
+    if not card or not card.cartridge:
+        logger.warning(f'Cartridge model of {room} {device} is unknown, the stock is not changed')
+        return None
+    return await run_blocking(stock.use, card.cartridge)
+
+
+async def receive_cartridges(model: str, amount: int) -> int:
+    """
+    :return: сколько картриджей модели <model> стало в наличии
+    """
+    return await run_blocking(stock.receive, model, amount)
+
+
+async def reload_printers(force: bool = False) -> bool:
+    """
+    Перечитывает Реестр принтеров в фоне, если кэш старше PRINTERS_REGISTRY_TTL секунд (или сразу при <force>).
+    Склад картриджей (bot.cartridge_stock) читается при первой загрузке и заново - только при <force>
+
+    :return: True, если реестр перечитывался
+    """
+    with quota.lane(quota.BACKGROUND):
+        if force:
+            await run_blocking(printer_registry.load)
+            await run_blocking(stock.reload)
+            return True
+        reloaded = await run_blocking(printer_registry.refresh)
+        if not stock.loaded:
+            await run_blocking(stock.load)
+        return reloaded
+
+
+async def write_user(user: User, who_approved_fullname: str) -> dict | None:
+    """
+    Подтвержденный пользователь сразу попадает в справочник, не дожидаясь записи в таблицу
+
+    :return: QUEUED, если таблица недоступна и пользователь будет записан позже
+    """
+    users_directory[user.telegram_id] = user
+    try:
+        return await run_blocking(write_user_to_table, user, who_approved_fullname)
+    except SheetsUnavailable as e:
+        logger.warning(f'User {user} is queued: {e}')
+        return QUEUED
+
+
+async def refresh_users() -> None:
+    """
+    Сверяет справочник пользователей с таблицей, если таблица изменилась
+    """
+    with quota.lane(quota.BACKGROUND):
+        users = await run_blocking(users_directory.read_if_modified)
+    if users is not None:
+        added, changed, removed = users_directory.sync(users)
+        if added or changed or removed:
+            logger.info(f'Users are refreshed: {added} added, {changed} changed, {removed} removed')
+
+
+async def replay_journal() -> None:
+    if journal.pending_count:
+        with quota.lane(quota.BACKGROUND):
+            await run_blocking(journal.replay)
+
+
+def shutdown() -> None:
+    """
+    Дожидается завершения запросов, которые уже отправлены в пул, останавливает его
+    и отправляет в таблицу оставшиеся в очереди записи
+    """
+    logger.info('Shutting down Google Sheets worker pool')
+    executor.shutdown(wait=True)
+    writer.shutdown()
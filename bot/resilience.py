@@ -0,0 +1,164 @@
+"""
+Повторные попытки и автоматический выключатель (circuit breaker) для запросов к Google API
+
+Google иногда отвечает 429 (превышена квота) или 5xx, а сеть теряет соединения.
+Каждый запрос клиента (client.sheet._execute_requests и client.drive._execute_request) при такой ошибке
+повторяется до SHEETS_RETRIES раз с экспоненциальной задержкой со случайной составляющей (jitter).
+Свои повторы pygsheets (и 100-секундный сон при 429) отключаются, чтобы не умножать ожидание.
+
+Если SHEETS_BREAKER_THRESHOLD запросов подряд не удались, выключатель размыкается: следующие
+SHEETS_BREAKER_RESET секунд запросы сразу завершаются ошибкой SheetsUnavailable, не дожидаясь Google.
+Затем пропускается один пробный запрос - если он удался, выключатель замыкается.
+
+SheetsUnavailable - сигнал для остального кода, что таблица сейчас недоступна:
+bot.batch_writer оставляет такие записи в очереди, а обработчики сообщают пользователю,
+что действие будет выполнено позже (или что его нужно повторить).
+
+Метрики:
+    sheets_retries          - сколько раз запросы повторялись
+    sheets_breaker_open     - 1, пока выключатель разомкнут
+    sheets_breaker_trips    - сколько раз выключатель размыкался
+"""
+import logging
+import random
+import socket
+import threading
+import time
+from collections.abc import Callable
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from bot.settings import Config
+from bot.utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class SheetsUnavailable(Exception):
+    """
+    Google API сейчас недоступен: повторы не помогли или выключатель разомкнут
+    """
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    returns True for the errors which can disappear if the request is repeated
+    """
+    if isinstance(error, HttpError):
+        return int(error.resp.status) in TRANSIENT_STATUSES
+    return isinstance(error, (ConnectionError, TimeoutError, socket.timeout, httplib2.ServerNotFoundError))
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.trips = 0
+        self._opened_at: float | None = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def retry_in(self) -> float:
+        """
+        returns seconds left until a probe request is allowed
+        """
+        if self._opened_at is None:
+            return 0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._probing or self.retry_in() > 0:
+                raise SheetsUnavailable(f'Google API is unavailable, next try in {self.retry_in():.0f}s')
+            self._probing = True  # Пропускаем один пробный запрос
+            logger.info('Circuit breaker is half-open, probing Google API')
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.warning('Circuit breaker is closed: Google API is available again')
+                metrics.set_value('sheets_breaker_open', 0)
+            self.failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self._opened_at is None and self.failures >= self.threshold):
+                if self._opened_at is None:
+                    self.trips += 1
+                    metrics.inc('sheets_breaker_trips')
+                logger.error(f'Circuit breaker is open for {self.reset_timeout}s after {self.failures} failures')
+                metrics.set_value('sheets_breaker_open', 1)
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class Resilience:
+    def __init__(self, retries: int, base_delay: float, max_delay: float, breaker: CircuitBreaker):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+
+    def backoff(self, attempt: int) -> float:
+        """
+        returns a delay before the attempt number <attempt> (from 1): full jitter exponential backoff
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func: Callable, /, *args, **kwargs):
+        """
+        Выполняет запрос <func> с повторами при временных ошибках
+
+        :raises SheetsUnavailable: выключатель разомкнут или все повторы не удались
+        """
+        for attempt in range(self.retries + 1):
+            self.breaker.before_call()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    self.breaker.record_success()  # Google ответил - значит, доступен
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.retries or self.breaker.is_open:
+                    raise SheetsUnavailable(f'Google API request failed: {e}') from e
+                delay = self.backoff(attempt + 1)
+                logger.warning(f'Google API request failed: {e}. Retry {attempt + 1} in {delay:.1f}s')
+                metrics.inc('sheets_retries')
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+    def install(self, client) -> None:
+        """
+        Оборачивает повторами все запросы клиента pygsheets (или bot.fake_gsheets)
+        """
+        sheet_execute = client.sheet._execute_requests
+        client.sheet._execute_requests = lambda request: self.call(sheet_execute, request)
+        if hasattr(client.sheet, 'check'):
+            client.sheet.check = False  # Без 100-секундного сна pygsheets при 429
+            client.sheet.retries = 0
+        drive = getattr(client, 'drive', None)
+        if drive is not None:
+            drive_execute = drive._execute_request
+            drive._execute_request = lambda request: self.call(drive_execute, request)
+            drive.retries = 0
+
+
+breaker = CircuitBreaker(Config.SHEETS_BREAKER_THRESHOLD, Config.SHEETS_BREAKER_RESET)
+resilience = Resilience(Config.SHEETS_RETRIES, Config.SHEETS_RETRY_BASE_DELAY, Config.SHEETS_RETRY_MAX_DELAY, breaker)
@@ -77,6 +77,22 @@ class ConfigTasks:
         'is_blocked': 13  # Блок         M
     }
 
+    task_headers = {  # Заголовки строки 1 листа задач - по ним bot.models.task_codec находит столбцы
+        'id': 'task_id',
+        'Кабинет': 'room',
+        'Задача': 'text',
+        'Создана': 'created_at',
+        'Автор': 'author',
+        'Приоритет': 'priority',
+        'Статус': 'status',
+        'Исполнитель': 'executor',
+        'Дата_взятия': 'taken_at',
+        'Срок': 'complete_until',
+        'Выполнено': 'completed_at',
+        'Примечания': 'comments',
+        'Блок': 'is_blocked',
+    }
+
     user_columns = {
         'telegram_id': 1,        # id          A
         'fullname': 2,           # Кабинет     B
@@ -98,9 +114,50 @@ class Config(ConfigTasks):
     APP_ENV = os.getenv('APP_ENV')
     BASE_DIR = BASE_DIR
 
-    SERVICE_FILE_PATH = BASE_DIR / 'bot' / os.getenv('GOOGLE_SERVICE_FILE')  # путь к файлу доступа к Google-Таблицам
+    SERVICE_FILE_PATH = BASE_DIR / 'bot' / os.getenv('GOOGLE_SERVICE_FILE', '')  # путь к файлу доступа к Google-Таблицам
+    SHEETS_BACKEND = os.getenv('SHEETS_BACKEND', 'fake' if APP_ENV == 'test' else 'google')  # google или fake - таблицы в памяти
+    SHEETS_READS_PER_MINUTE = float(os.getenv('SHEETS_READS_PER_MINUTE', 60))  # квота Google на чтение, 0 - без ограничения
+    SHEETS_WRITES_PER_MINUTE = float(os.getenv('SHEETS_WRITES_PER_MINUTE', 60))  # квота Google на запись, 0 - без ограничения
+    SHEETS_QUOTA_BURST = int(os.getenv('SHEETS_QUOTA_BURST', 10))  # сколько запросов можно сделать подряд без ожидания
+    SHEETS_RETRIES = int(os.getenv('SHEETS_RETRIES', 4))  # сколько раз повторять запрос при ошибках 429/5xx
+    SHEETS_RETRY_BASE_DELAY = float(os.getenv('SHEETS_RETRY_BASE_DELAY', 0.5))  # начальная задержка повтора, сек
+    SHEETS_RETRY_MAX_DELAY = float(os.getenv('SHEETS_RETRY_MAX_DELAY', 8))  # наибольшая задержка повтора, сек
+    SHEETS_BREAKER_THRESHOLD = int(os.getenv('SHEETS_BREAKER_THRESHOLD', 5))  # неудачных запросов подряд до отключения
+    SHEETS_BREAKER_RESET = float(os.getenv('SHEETS_BREAKER_RESET', 30))  # через сколько секунд пробовать снова
+    SHEETS_ALERT_INTERVAL = float(os.getenv('SHEETS_ALERT_INTERVAL', 10 * 60))  # не чаще раза в столько секунд писать суперадмину о недоступности Google
+    SHEETS_WRITE_TIMEOUT = float(os.getenv('SHEETS_WRITE_TIMEOUT', 10))  # сколько ждать записи, прежде чем ответить "в очереди"
+    JOURNAL_PATH = BASE_DIR / 'data' / os.getenv('JOURNAL_FILE', 'journal.log')  # журнал изменений для таблиц
+    JOURNAL_MAX_BYTES = int(os.getenv('JOURNAL_MAX_BYTES', 1_000_000))  # размер, после которого пустой журнал очищается
+    JOURNAL_REPLAY_INTERVAL = float(os.getenv('JOURNAL_REPLAY_INTERVAL', 30))  # как часто (сек) повторять журнал
+    FAKE_SHEETS_LATENCY = float(os.getenv('FAKE_SHEETS_LATENCY', 0))  # задержка каждого запроса к таблицам в памяти, сек
+    FAKE_SHEETS_QUOTA_ERROR_RATE = float(os.getenv('FAKE_SHEETS_QUOTA_ERROR_RATE', 0))  # доля запросов с ошибкой 429
+    FAKE_SHEETS_FAILURE_RATE = float(os.getenv('FAKE_SHEETS_FAILURE_RATE', 0))  # доля запросов с ошибкой 503
+    FAKE_SHEETS_SEED_FILE = os.getenv('FAKE_SHEETS_SEED_FILE')  # JSON с начальными данными таблиц в памяти
+    SHEETS_PAGE_THRESHOLD = int(os.getenv('SHEETS_PAGE_THRESHOLD', 2000))  # лист больше стольких строк читается по частям
+    SHEETS_PAGE_ROWS = int(os.getenv('SHEETS_PAGE_ROWS', 1000))  # строк в одной части при чтении по частям
+    SHEETS_MAX_WORKERS = int(os.getenv('SHEETS_MAX_WORKERS', 4))  # размер пула потоков для запросов к Google-Таблицам
+    BATCH_WRITE_INTERVAL = float(os.getenv('BATCH_WRITE_INTERVAL', 1.0))  # как часто (сек) отправлять очередь записей
+    BATCH_WRITE_MAX_SIZE = int(os.getenv('BATCH_WRITE_MAX_SIZE', 50))  # сколько диапазонов отправлять без ожидания
+    SYNC_INTERVAL = float(os.getenv('SYNC_INTERVAL', 60))  # как часто (сек) проверять, менялась ли таблица задач
+    SYNC_FULL_EVERY = int(os.getenv('SYNC_FULL_EVERY', 30))  # каждая N-я синхронизация читает таблицу целиком
+    SYNC_TAIL_ROWS = 50  # сколько строк после последней известной задачи проверять на новые задачи
+    USERS_REFRESH_INTERVAL = float(os.getenv('USERS_REFRESH_INTERVAL', 5 * 60))  # как часто (сек) сверять пользователей с таблицей
+
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'gsheets')  # gsheets - только таблица, sqlite - SQLite + копия в таблице
+    SQLITE_PATH = BASE_DIR / 'data' / os.getenv('SQLITE_FILE', 'support.sqlite3')  # файл SQLite для STORAGE_BACKEND=sqlite
+    MIRROR_INTERVAL = float(os.getenv('MIRROR_INTERVAL', 5))  # как часто (сек) переносить изменения из SQLite в таблицу
+
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))  # через сколько дней закрытая задача уходит в архив, 0 - никогда
+    ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', 24 * 60 * 60))  # как часто (сек) запускать архивацию
+    ARCHIVE_BATCH = int(os.getenv('ARCHIVE_BATCH', 200))  # сколько задач переносить в архив за один запуск
+    ARCHIVE_TITLE = os.getenv('ARCHIVE_TITLE', 'Архив ({trimester} триместр) {start:02}-{end:02}')  # название листа архива
 
     PRINTERS_GSHEET_KEY = os.getenv('PRINTERS_GSHEET_KEY')  # Реестр Принтеров
+    PRINTERS_REGISTRY_TTL = float(os.getenv('PRINTERS_REGISTRY_TTL', 15 * 60))  # через сколько секунд перечитывать список принтеров
+    CARTRIDGE_STATS_INTERVAL = float(os.getenv('CARTRIDGE_STATS_INTERVAL', 6 * 60 * 60))  # как часто (сек) пересчитывать расход картриджей
+    CARTRIDGE_STATS_CELL = os.getenv('CARTRIDGE_STATS_CELL', 'A1')  # левый верхний угол отчета о расходе на листе Summary
+    CARTRIDGE_REMIND_DAYS = int(os.getenv('CARTRIDGE_REMIND_DAYS', 7))  # за сколько дней напоминать о замене, 0 - не напоминать
+    CARTRIDGE_REMIND_HOUR = int(os.getenv('CARTRIDGE_REMIND_HOUR', 9))  # в котором часу присылать напоминание
     macbook_gsheet_key = os.getenv('MACBOOK_GSHEET_KEY')  # Реестр MacBook
     depo_gsheet_key = os.getenv('DEPO_GSHEET_KEY')  # Реестр Depo
     lenovo_gsheet_key = os.getenv('LENOVO_GSHEET_KEY')  # Реестр Lenovo
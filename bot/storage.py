@@ -0,0 +1,246 @@
+"""
+Локальное хранилище задач и пользователей в SQLite
+
+Включается переменной окружения STORAGE_BACKEND=sqlite. Тогда источником правды для бота служит файл SQLITE_PATH:
+чтение и запись задач и пользователей занимают микросекунды и не зависят от Google.
+Google-Таблица остается интерфейсом для людей: фоновая задача bot.mirror переносит в нее изменения,
+а синхронизация bot.sync забирает обратно правки, сделанные в таблице вручную.
+
+Значения хранятся в том виде, в котором они показаны в таблице (строки с датами в формате Config.TIMESTAMP и т.п.),
+поэтому строку из SQLite можно разобрать тем же Task.from_row, что и строку из таблицы.
+Столбец dirty хранит через запятую поля, которые еще не перенесены в таблицу.
+"""
+import logging
+import sqlite3
+import threading
+from collections.abc import Iterator
+from concurrent.futures import Future
+
+from bot.settings import Config
+
+
+logger = logging.getLogger(__name__)
+
+TASK_FIELDS = list(Config.task_columns)
+USER_FIELDS = list(Config.user_columns)
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()  # одно соединение на все потоки пула bot.repository
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        task_columns = ', '.join(f'{field} TEXT' for field in TASK_FIELDS if field != 'task_id')
+        self._conn.execute(
+            f'CREATE TABLE IF NOT EXISTS tasks ('
+            f'task_id INTEGER PRIMARY KEY, {task_columns}, '
+            f"row INTEGER NOT NULL, dirty TEXT NOT NULL DEFAULT '', is_new INTEGER NOT NULL DEFAULT 0, "
+            f'version INTEGER NOT NULL DEFAULT 0)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS tasks_by_row ON tasks(row, task_id)')  # Для iter_rows
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS users ('
+            'telegram_id INTEGER PRIMARY KEY, fullname TEXT, username TEXT, role TEXT, history TEXT, '
+            'dirty INTEGER NOT NULL DEFAULT 0)'
+        )
+        logger.info(f'SQLite store is opened: {path}')
+
+    @staticmethod
+    def saved() -> Future:
+        """
+        Запись в SQLite завершается сразу - вызывающему коду возвращается уже завершенный Future
+        """
+        done = Future()
+        done.set_result(None)
+        return done
+
+    # Задачи
+
+    def save_task(self, task_id: int, row: int, cells: dict[str, object], new: bool = False) -> Future:
+        """
+        Сохраняет значения полей задачи и помечает их для переноса в таблицу
+
+        :param cells: словарь вида поле: значение ячейки
+        :param new: задачи еще нет в таблице - при переносе будет записана вся строка
+        """
+        if not cells:
+            return self.saved()
+        cells = dict(cells)
+        if 'task_id' in cells:
+            cells['task_id'] = task_id  # Номер хранится числом, как он записан и в таблицу
+        fields = [field for field in cells if field != 'task_id']
+        with self._lock:
+            current = self._conn.execute('SELECT dirty FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+            dirty = set(filter(None, current[0].split(','))) if current else set()
+            dirty |= set(cells)
+            if current:
+                assignments = ', '.join(f'{field} = ?' for field in fields)
+                self._conn.execute(
+                    f'UPDATE tasks SET {assignments}{", " if fields else ""}row = ?, dirty = ?, '
+                    f'is_new = is_new OR ?, version = version + 1 WHERE task_id = ?',
+                    [cells[field] for field in fields] + [row, ','.join(sorted(dirty)), new, task_id]
+                )
+            else:
+                self._conn.execute(
+                    f'INSERT INTO tasks (task_id, {", ".join(fields)}, row, dirty, is_new, version) '
+                    f'VALUES (?, {", ".join("?" * len(fields))}, ?, ?, ?, 1)',
+                    [task_id] + [cells[field] for field in fields] + [row, ','.join(sorted(dirty)), new]
+                )
+        return self.saved()
+
+    def load_rows(self) -> dict[int, list]:
+        """
+        returns all the tasks as rows of cells: {номер строки: [значения в порядке Config.task_columns]}
+        """
+        with self._lock:
+            records = self._conn.execute(f'SELECT row, {", ".join(TASK_FIELDS)} FROM tasks ORDER BY row').fetchall()
+        return {record[0]: ['' if value is None else value for value in record[1:]] for record in records}
+
+    def iter_rows(self, chunk_size: int) -> Iterator[dict[int, list]]:
+        """
+        yields the tasks by chunks of <chunk_size> rows: {номер строки: [значения в порядке Config.task_columns]}.
+        Блокировка берется только на чтение одной части. Следующая часть начинается после последней пары (row, task_id):
+        номер строки не уникален, и задачи с одним номером строки на границе частей не пропускаются
+        """
+        after = (0, 0)
+        while True:
+            with self._lock:
+                records = self._conn.execute(
+                    f'SELECT row, {", ".join(TASK_FIELDS)} FROM tasks WHERE (row, task_id) > (?, ?) '
+                    f'ORDER BY row, task_id LIMIT ?',
+                    (*after, chunk_size)
+                ).fetchall()
+            if not records:
+                return
+            yield {record[0]: ['' if value is None else value for value in record[1:]] for record in records}
+            after = (records[-1][0], records[-1][1 + TASK_FIELDS.index('task_id')])
+
+    def dirty_tasks(self) -> list[tuple[int, int, list, set[str], bool, int]]:
+        """
+        returns tasks with changes which are not in the table yet: (task_id, row, cells, поля, is_new, version)
+        """
+        with self._lock:
+            records = self._conn.execute(
+                f"SELECT task_id, row, {', '.join(TASK_FIELDS)}, dirty, is_new, version FROM tasks WHERE dirty != ''"
+            ).fetchall()
+        result = []
+        for record in records:
+            cells = ['' if value is None else value for value in record[2:2 + len(TASK_FIELDS)]]
+            dirty, is_new, version = record[2 + len(TASK_FIELDS):]
+            result.append((record[0], record[1], cells, set(dirty.split(',')), bool(is_new), version))
+        return result
+
+    def mark_task_clean(self, task_id: int, version: int) -> None:
+        """
+        Снимает пометку dirty, если с момента чтения (version) задача не менялась
+        """
+        with self._lock:
+            self._conn.execute("UPDATE tasks SET dirty = '', is_new = 0 WHERE task_id = ? AND version = ?",
+                               (task_id, version))
+
+    def renumber_task(self, old_id: int, new_id: int, row: int) -> None:
+        with self._lock:
+            self._conn.execute('UPDATE tasks SET task_id = ?, row = ?, version = version + 1 WHERE task_id = ?',
+                               (new_id, row, old_id))
+
+    def move_rows(self, moves: dict[int, int], removed: list[int]) -> None:
+        """
+        Удаляет задачи <removed>, убранные в архив, и переносит остальные на новые строки <moves> (task_id: строка)
+        """
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM tasks WHERE task_id = ?', [(task_id,) for task_id in removed])
+            self._conn.executemany('UPDATE tasks SET row = ? WHERE task_id = ?',
+                                   [(row, task_id) for task_id, row in moves.items()])
+
+    def is_dirty(self, task_id: int) -> bool:
+        with self._lock:
+            record = self._conn.execute('SELECT dirty FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return bool(record and record[0])
+
+    def import_rows(self, rows: dict[int, list]) -> int:
+        """
+        Переносит строки из таблицы. Задачи с неперенесенными изменениями бота не трогаются
+
+        :param rows: {номер строки: значения ячеек}
+        :return: сколько задач обновлено
+        """
+        fields = ', '.join(TASK_FIELDS)
+        updates = ', '.join(f'{field} = excluded.{field}' for field in TASK_FIELDS[1:])
+        records = []
+        for row, values in rows.items():
+            if not values or not values[0]:
+                continue
+            values = list(values)[:len(TASK_FIELDS)]
+            values += [''] * (len(TASK_FIELDS) - len(values))
+            records.append([int(values[0])] + values[1:] + [row])
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                f'INSERT INTO tasks ({fields}, row) VALUES ({", ".join("?" * len(TASK_FIELDS))}, ?) '
+                f"ON CONFLICT(task_id) DO UPDATE SET {updates}, row = excluded.row WHERE dirty = ''",
+                records
+            )
+            self._conn.execute('COMMIT')
+            changed = self._conn.total_changes - before
+        logger.info(f'{changed} tasks imported from the table to SQLite')
+        return changed
+
+    def count_tasks(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+    # Пользователи
+
+    def save_user(self, values: list, dirty: bool = True) -> None:
+        """
+        :param values: значения в порядке Config.user_columns
+        """
+        with self._lock:
+            self._conn.execute(
+                f'INSERT OR REPLACE INTO users ({", ".join(USER_FIELDS)}, dirty) '
+                f'VALUES ({", ".join("?" * len(USER_FIELDS))}, ?)',
+                list(values) + [dirty]
+            )
+
+    def load_users(self) -> list[list]:
+        with self._lock:
+            return [list(record) for record in self._conn.execute(f'SELECT {", ".join(USER_FIELDS)} FROM users')]
+
+    def dirty_users(self) -> list[list]:
+        with self._lock:
+            return [list(record) for record in
+                    self._conn.execute(f'SELECT {", ".join(USER_FIELDS)} FROM users WHERE dirty')]
+
+    def mark_user_clean(self, telegram_id: int) -> None:
+        with self._lock:
+            self._conn.execute('UPDATE users SET dirty = 0 WHERE telegram_id = ?', (telegram_id,))
+
+    def import_users(self, users: list[list], prune: bool = False) -> None:
+        """
+        Переносит пользователей из таблицы. Пользователи, которые еще не перенесены в таблицу, не трогаются
+
+        :param prune: удалить пользователей, которых больше нет в таблице
+        """
+        records = [list(user) + [''] * (len(USER_FIELDS) - len(user)) for user in users if user and user[0]]
+        updates = ', '.join(f'{field} = excluded.{field}' for field in USER_FIELDS[1:])
+        imported = [(int(record[0]),) for record in records if str(record[0]).strip().isdigit()]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                f'INSERT INTO users ({", ".join(USER_FIELDS)}) VALUES ({", ".join("?" * len(USER_FIELDS))}) '
+                f'ON CONFLICT(telegram_id) DO UPDATE SET {updates} WHERE NOT dirty',
+                [record[:len(USER_FIELDS)] for record in records]
+            )
+            if prune and imported:
+                self._conn.execute('CREATE TEMP TABLE IF NOT EXISTS imported_users (telegram_id INTEGER PRIMARY KEY)')
+                self._conn.execute('DELETE FROM imported_users')
+                self._conn.executemany('INSERT OR IGNORE INTO imported_users VALUES (?)', imported)
+                self._conn.execute('DELETE FROM users WHERE NOT dirty '
+                                   'AND telegram_id NOT IN (SELECT telegram_id FROM imported_users)')
+            self._conn.execute('COMMIT')
+
+
+store: SQLiteStore | None = SQLiteStore(Config.SQLITE_PATH) if Config.STORAGE_BACKEND == 'sqlite' else None
@@ -0,0 +1,119 @@
+"""
+Фоновая синхронизация индекса задач с таблицей "Задачи Admin 1060"
+
+Админы правят таблицу и руками, поэтому индекс в памяти (bot.models.task_index) может устареть.
+Раз в SYNC_INTERVAL секунд бот спрашивает у Google Drive время последнего изменения таблицы - это один легкий запрос.
+Если таблица менялась, одним запросом values.batchGet перечитываются только строки, которые влияют на работу бота:
+    - строки незакрытых задач
+    - SYNC_TAIL_ROWS строк после последней известной (задачи, добавленные вручную)
+Каждая SYNC_FULL_EVERY-я синхронизация перечитывает таблицу целиком.
+Ограничение: между полными синхронизациями ручные правки закрытых задач и вставка строк выше хвоста
+не видны - индекс узнает о них только на ближайшей полной синхронизации (до SYNC_FULL_EVERY проверок изменений).
+Drive сообщает лишь время изменения всей таблицы, а не какие строки менялись.
+Задачи, которые бот изменил, пока шло чтение, или изменения которых еще в очереди записи, не заменяются
+прочитанными строками (TaskIndex.is_dirty): строки применяются под rows_lock уже после чтения.
+
+Метрики:
+    tasks_sync_lag_seconds   - сколько прошло от последнего изменения таблицы до обновления индекса
+    tasks_sync_rows_read     - сколько строк прочитано при последней синхронизации
+    tasks_sync_checked_at    - когда (unix time) таблица последний раз проверялась на изменения
+"""
+import logging
+from datetime import datetime, timezone
+
+import bot.database as database
+import bot.repository as repository
+from bot import quota
+from bot.batch_writer import writer
+from bot.models import task_codec
+from bot.models.task import Task
+from bot.models.task_index import task_index
+from bot.settings import Config
+from bot.utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class TaskSync:
+    def __init__(self):
+        self.modified_at: datetime | None = None  # Время изменения таблицы, которое уже отражено в индексе
+        self.changes_seen = 0
+
+    def sync(self) -> bool:
+        """
+        Обновляет индекс, если таблица изменилась с прошлой синхронизации. Выполняется в пуле потоков
+
+        :return: True, если индекс обновлялся
+        """
+        modified_at = database.get_modified_time(database.task_table)
+        metrics.set_value('tasks_sync_checked_at', round(datetime.now().timestamp()))
+        if modified_at == self.modified_at:
+            return False
+
+        queued_before = writer.queued_count
+        if not writer.barrier().done():
+            logger.info('Task writes are pending, sync is postponed')
+            return False
+
+        self.changes_seen += 1
+        since = task_index.local_version
+        if self.changes_seen % Config.SYNC_FULL_EVERY == 0 or not task_index.loaded:
+            rows_read = self._sync_full(since)
+        else:
+            rows_read = self._sync_changed_rows(since)
+
+        if writer.queued_count != queued_before:
+            # Бот что-то записал, пока шло чтение: эти задачи пропущены, их строки прочитает следующая синхронизация
+            logger.info('Tasks were changed by the bot during sync, it will be repeated')
+            return False
+
+        self.modified_at = modified_at
+        lag = (datetime.now(timezone.utc) - modified_at).total_seconds()
+        metrics.set_value('tasks_sync_lag_seconds', round(lag, 1))
+        metrics.set_value('tasks_sync_rows_read', rows_read)
+        return True
+
+    def _sync_full(self, since: int) -> int:
+        logger.info('Full sync of the task index')
+        task_codec.reset()  # Столбцы могли переставить в таблице
+        generation = task_index.generation
+        rows = database.get_task_rows(last_column=task_codec.get_codec().last_column)
+        Task.load_index(rows, generation, since)
+        return len(rows)
+
+    def _sync_changed_rows(self, since: int) -> int:
+        generation = task_index.generation
+        open_rows = task_index.rows_where(
+            lambda task: task.status in (Config.STATUS_NOT_TAKEN, Config.STATUS_TAKEN))
+        tail_start = task_index.last_row + 1
+        ranges = database.group_rows(open_rows) + [(tail_start, tail_start + Config.SYNC_TAIL_ROWS - 1)]
+
+        codec = task_codec.get_codec()
+        blocks = database.batch_get(database.task_sheet,
+                                    [((start, 1), (end, codec.last_column)) for start, end in ranges])
+
+        ids_by_row = task_index.ids_by_row()
+        rows = {}
+        for (start, end), block in zip(ranges, blocks):
+            for row, values in enumerate(block, start=start):
+                rows[row] = values
+                task_id = codec.task_id(values)
+                if task_id is None:
+                    continue
+                if ids_by_row.get(row, task_id) != task_id:
+                    # Строки переставлены (например, сортировкой) - частичное обновление не поможет
+                    logger.warning(f'Row {row} holds task {task_id} instead of {ids_by_row[row]}')
+                    return self._sync_full(since)
+        Task.patch_index(rows, generation, since)
+        rows_read = len(rows)
+        logger.info(f'Task index is patched from {len(ranges)} ranges, {rows_read} rows')
+        return rows_read
+
+
+task_sync = TaskSync()
+
+
+async def sync_tasks() -> None:
+    with quota.lane(quota.BACKGROUND):
+        await repository.run_blocking(task_sync.sync)
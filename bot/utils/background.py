@@ -0,0 +1,52 @@
+"""
+Фоновые периодические задачи бота
+
+Задачи запускаются в post_init приложения и останавливаются в post_shutdown.
+Исключение внутри задачи пишется в лог и не останавливает следующие запуски.
+"""
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta
+
+
+logger = logging.getLogger(__name__)
+
+_tasks: list[asyncio.Task] = []
+
+
+def run_periodically(callback: Callable[[], Awaitable], interval: float, name: str, first: float | None = None) -> None:
+    """
+    Запускает корутину <callback> каждые <interval> секунд
+
+    :param first: через сколько секунд выполнить первый запуск, по умолчанию через <interval>
+    """
+    async def loop():
+        await asyncio.sleep(interval if first is None else first)
+        while True:
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f'Background job {name} failed: {e}', exc_info=True)
+            await asyncio.sleep(interval)
+
+    _tasks.append(asyncio.create_task(loop(), name=name))
+    logger.info(f'Background job {name} is scheduled every {interval} seconds')
+
+
+def seconds_until(hour: int) -> float:
+    """
+    returns seconds until the next <hour>:00 of the local time - для ежедневных задач
+    """
+    now = datetime.now()
+    at = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if at <= now:
+        at += timedelta(days=1)
+    return (at - now).total_seconds()
+
+
+async def stop_all() -> None:
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
@@ -0,0 +1,27 @@
+"""
+Простые метрики процесса: значения хранятся в памяти и показываются админу командой /metrics
+"""
+import threading
+
+
+_values: dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def set_value(name: str, value: float) -> None:
+    with _lock:
+        _values[name] = value
+
+
+def inc(name: str, amount: float = 1) -> None:
+    with _lock:
+        _values[name] = _values.get(name, 0) + amount
+
+
+def get(name: str, default: float | None = None) -> float | None:
+    return _values.get(name, default)
+
+
+def snapshot() -> dict[str, float]:
+    with _lock:
+        return dict(sorted(_values.items()))
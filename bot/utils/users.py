@@ -1,11 +1,31 @@
+"""
+Пользователи бота - лист task_users_sheet таблицы "Задачи Admin 1060"
+
+Пользователи хранятся в справочнике UserDirectory (bot_data['users']) с двумя индексами:
+telegram_id -> User и роль -> telegram_id, поэтому поиск пользователя и список админов не перебирают всех.
+Раз в USERS_REFRESH_INTERVAL секунд справочник сверяется с листом (refresh), если таблица менялась:
+новые пользователи добавляются, у измененных меняются роль и имя, удаленные из таблицы - удаляются.
+Смена роли в таблице действует без перезапуска бота.
+Подтвержденный пользователь попадает в справочник сразу, а на лист дописывается одним запросом values.append.
+
+Метрики:
+    users_total             - сколько пользователей в справочнике
+    users_refreshed_at      - когда (unix time) справочник последний раз сверялся с таблицей
+"""
 import logging
+import threading
+from collections.abc import Iterator, Mapping, MutableMapping
 from dataclasses import dataclass
 from datetime import datetime
 
 from telegram.ext import Application, ContextTypes
 
 from bot.settings import Config
-from bot.database import task_users_sheet
+import bot.database as database
+import bot.storage as storage
+from bot.journal import journal
+from bot.resilience import SheetsUnavailable
+from bot.utils import metrics
 
 
 logger = logging.getLogger(__name__)
@@ -29,45 +49,173 @@ class UserInTable(User):
     history: str
 
 
-def get_users_from_table(app: Application, amount: int = 200) -> None:
-    logger.debug(f'Getting {amount} users from the table')
-    users_raw = task_users_sheet.get_values((2, Config.user_columns['telegram_id']),
-                                            (amount, Config.user_columns['role']),
-                                            # include_tailing_empty=False,
-                                            include_tailing_empty_rows=False)
-    app.bot_data['users'] = {int(data[0]): User(*data) for data in users_raw}
-    logger.info(f"Got {len(users_raw)} users from table")
+class UserDirectory(MutableMapping):
+    """
+    Справочник пользователей: telegram_id -> User с индексом роль -> {telegram_id}.
+    Меняется только в потоке бота; пул потоков лишь читает таблицу (read_if_modified)
+    """
+    ADMIN_ROLES = ('Админ', 'Суперадмин')
+
+    def __init__(self):
+        self._users: dict[int, User] = {}
+        self._by_role: dict[str, set[int]] = {}
+        self._pending: set[int] = set()  # Подтверждены ботом, но в таблице их еще может не быть
+        self.modified_at: datetime | None = None
+        self._read_lock = threading.Lock()
+
+    def __getitem__(self, telegram_id: int) -> User:
+        return self._users[telegram_id]
+
+    def __setitem__(self, telegram_id: int, user: User) -> None:
+        self._put(user)
+        self._pending.add(user.telegram_id)
+
+    def __delitem__(self, telegram_id: int) -> None:
+        user = self._users.pop(telegram_id)
+        self._by_role[user.role].discard(telegram_id)
+        self._pending.discard(telegram_id)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._users)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def _put(self, user: User) -> None:
+        old = self._users.get(user.telegram_id)
+        if old:
+            self._by_role[old.role].discard(user.telegram_id)
+        self._users[user.telegram_id] = user
+        self._by_role.setdefault(user.role, set()).add(user.telegram_id)
+
+    def with_role(self, *roles: str) -> list[User]:
+        return [self._users[telegram_id] for role in roles for telegram_id in self._by_role.get(role, ())]
+
+    def admin_ids(self) -> list[int]:
+        return [user.telegram_id for user in self.with_role(*self.ADMIN_ROLES)]
+
+    def sync(self, users: list[User]) -> tuple[int, int, int]:
+        """
+        Сверяет справочник со списком пользователей из таблицы. Меняются только отличающиеся записи
+
+        :return: сколько пользователей добавлено, изменено и удалено
+        """
+        if not users and self._users:
+            logger.warning('The users sheet is empty, the user directory is kept')
+            return 0, 0, 0
+        added = changed = 0
+        seen = set()
+        for user in users:
+            seen.add(user.telegram_id)
+            self._pending.discard(user.telegram_id)
+            old = self._users.get(user.telegram_id)
+            if old == user:
+                continue
+            if old:
+                changed += 1
+                logger.info(f'User {user.telegram_id} is changed in the table: {old.role} -> {user.role}')
+            else:
+                added += 1
+            self._put(user)
+        keep = seen | self._pending
+        removed = [telegram_id for telegram_id in self._users if telegram_id not in keep]
+        for telegram_id in removed:
+            logger.info(f'User {self._users[telegram_id]} is removed from the table')
+            del self[telegram_id]
+        metrics.set_value('users_total', len(self._users))
+        metrics.set_value('users_refreshed_at', round(datetime.now().timestamp()))
+        return added, changed, len(removed)
+
+    def read_if_modified(self) -> list[User] | None:
+        """
+        Читает пользователей, если таблица изменилась с прошлого чтения. Выполняется в пуле потоков
+
+        :return: None, если таблица не менялась
+        """
+        with self._read_lock:
+            modified_at = database.get_modified_time(database.task_table)
+            if modified_at == self.modified_at:
+                return None
+            users = read_users()
+            self.modified_at = modified_at
+            return users
+
+
+users_directory = UserDirectory()
+
+
+def get_users_from_table(app: Application) -> None:
+    users_directory.sync(users_directory.read_if_modified() or [])
+    app.bot_data['users'] = users_directory
+    logger.info(f"Got {len(users_directory)} users from table")
     return
 
 
+def read_users() -> list[User]:
+    if storage.store:
+        try:
+            storage.store.import_users(_read_users(Config.user_columns['history']), prune=True)
+        except Exception as e:
+            logger.error(f'Cannot read the users from the table, using SQLite only: {e}')
+        users_raw = [data[:Config.user_columns['role']] for data in storage.store.load_users()]
+    else:
+        users_raw = _read_users(Config.user_columns['role'])
+    return [User(*data) for data in users_raw]
+
+
+def _read_users(last_column: int) -> list[list]:
+    logger.debug('Getting the users from the table')
+    return [data for data in database.read_rows(database.task_users_sheet, 2, last_column) if data and data[0]]
+
+
 def user_is_teacher(user_data: dict) -> bool:
     return user_data.get('role') == 'Учитель'
 
 
 def is_admin(user: User) -> bool:
-    return user.role in ('Админ', 'Суперадмин')
+    return user.role in UserDirectory.ADMIN_ROLES
 
 
-def get_user_by_id(telegram_id: int, users: dict[int, User]) -> User:
-    for user_id, user in users.items():
-        if telegram_id == user.telegram_id:
-            return user
+def get_user_by_id(telegram_id: int, users: Mapping[int, User]) -> User | None:
+    return users.get(int(telegram_id))
 
 
-def delete_user_from_dict(telegram_id, users: dict[int, User]) -> User:
-    for user_id, user in users.items():
-        if telegram_id == user.telegram_id:
-            return users.pop(telegram_id)
+def delete_user_from_dict(telegram_id, users: MutableMapping[int, User]) -> User | None:
+    return users.pop(int(telegram_id), None)
 
 
 def write_user_to_table(user: User, who_approved_fullname: str) -> None:
-    logger.info(f"Finding first empty row")
-    row = len(task_users_sheet.get_col(1, include_tailing_empty=False)) + 1
     date_str = datetime.now().strftime(Config.TIMESTAMP)
     #
     history_str = f'[{date_str}] {who_approved_fullname} назначил роль {user.role}'
-    task_users_sheet.update_row(
-        row,
-        [user.telegram_id, user.fullname, user.username, user.role, history_str]
-    )
-    logger.info(f"Success: {user} added to the table")
+    values = [user.telegram_id, user.fullname, user.username, user.role, history_str]
+    if storage.store:
+        storage.store.save_user(values)
+        logger.info(f"Success: {user} saved to SQLite")
+        return
+    seq = journal.append('user', {'values': values})
+    try:
+        append_user_to_table(values)
+    except SheetsUnavailable:
+        journal.release(seq)  # Пользователь будет записан при повторе журнала
+        raise
+    journal.ack(seq)
+
+
+def append_user_to_table(values: list, skip_existing: bool = False) -> None:
+    """
+    Дописывает строку пользователя одним запросом values.append: Google сам ставит ее после последней строки листа,
+    поэтому одновременные подтверждения не перезаписывают друг друга, а лист не нужно перечитывать
+
+    :param skip_existing: сначала проверить, нет ли пользователя в таблице, - для повтора из журнала,
+        когда неизвестно, дошла ли прошлая запись
+    """
+    sheet = database.task_users_sheet
+    if skip_existing and str(values[0]) in sheet.get_col(1, include_tailing_empty=False):
+        logger.info(f"User {values[0]} is already in the table")
+        return
+    sheet.append_table([values], start='A1', dimension='ROWS', overwrite=False)
+    logger.info(f"Success: user {values[0]} added to the table")
+
+
+journal.register('user', lambda change: append_user_to_table(change['values'], skip_existing=True))
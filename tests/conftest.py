@@ -0,0 +1,128 @@
+"""
+Тесты работают с таблицами в памяти (bot.fake_gsheets) - ни Google, ни токен бота не нужны:
+    python -m pytest
+
+Модули бота держат общее состояние (очередь записи, журнал, индекс задач), поэтому перед каждым тестом
+оно сбрасывается, а таблицы создаются заново - пустыми, с заголовками на листе задач.
+"""
+import os
+
+os.environ.setdefault('APP_ENV', 'test')  # SHEETS_BACKEND=fake
+os.environ.setdefault('SUPERUSER_ID', '1')
+os.environ.setdefault('TASKS_GSHEET_KEY', 'tasks')
+os.environ.setdefault('PRINTERS_GSHEET_KEY', 'printers')
+os.environ.setdefault('SHEETS_READS_PER_MINUTE', '0')  # Без квоты...
+os.environ.setdefault('SHEETS_WRITES_PER_MINUTE', '0')
+os.environ.setdefault('SHEETS_RETRIES', '1')  # ...и без долгих повторов
+os.environ.setdefault('SHEETS_RETRY_BASE_DELAY', '0.01')
+os.environ.setdefault('BATCH_WRITE_INTERVAL', '0.05')
+
+import json  # noqa: E402
+import pathlib  # noqa: E402
+import shutil  # noqa: E402
+from datetime import datetime  # noqa: E402
+from types import SimpleNamespace  # noqa: E402
+from urllib.parse import parse_qs, urlsplit  # noqa: E402
+
+import googleapiclient  # noqa: E402
+import httplib2  # noqa: E402
+import pytest  # noqa: E402
+from pygsheets.sheet import SheetAPIWrapper  # noqa: E402
+
+import bot.database as database  # noqa: E402
+from bot.batch_writer import writer  # noqa: E402
+from bot.journal import journal  # noqa: E402
+from bot.models import task_codec  # noqa: E402
+from bot.models.task import Task  # noqa: E402
+from bot.models.task_ids import task_ids  # noqa: E402
+from bot.models.task_index import task_index  # noqa: E402
+from bot.resilience import breaker  # noqa: E402
+from bot.settings import Config  # noqa: E402
+from bot.sync import task_sync  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def client(tmp_path):
+    """
+    returns the in-memory client of fresh spreadsheets
+    """
+    writer.shutdown()
+    writer.__init__()
+    appliers, rejecters = journal._appliers, journal._rejecters
+    if journal._file:
+        journal._file.close()
+    journal.__init__(tmp_path / 'journal.log', Config.JOURNAL_MAX_BYTES)
+    journal._appliers, journal._rejecters = appliers, rejecters
+    task_index.__init__()
+    task_ids.__init__()
+    task_sync.__init__()
+    task_codec.reset()
+    breaker.__init__(Config.SHEETS_BREAKER_THRESHOLD, Config.SHEETS_BREAKER_RESET)
+    database.sheets.__init__(database.sheets.service_account_file)
+    database.task_sheet.update_row(1, list(Config.task_headers))
+    yield database.client
+    writer.shutdown()
+
+
+def task_row(task_id: int, status: str = 'Не начато', completed_at: str = '', executor: str = '') -> list:
+    """
+    returns the cells of a task row in the order of Config.task_columns
+    """
+    return [task_id, 101, f'Задача {task_id}', '01.09.2025 10:00', 'Учитель', 2, status, executor,
+            '02.09.2025 10:00' if executor else '', '', completed_at, '', 'FALSE']
+
+
+@pytest.fixture
+def tasks():
+    """
+    Заполняет лист задач строками и загружает индекс: tasks(task_row(1), task_row(2), ...)
+    """
+    def fill(*rows: list) -> dict[int, Task]:
+        database.task_sheet.update_values((2, 1), [[str(value) for value in row] for row in rows])
+        return Task.load_index()
+
+    return fill
+
+
+def timestamp(day: datetime) -> str:
+    return day.strftime(Config.TIMESTAMP)
+
+
+class GoogleHttp:
+    """
+    Транспорт httplib2 для настоящего pygsheets.sheet.SheetAPIWrapper: запоминает запросы к Google
+    и отвечает заготовленным JSON - так видно, какие запросы на самом деле строит код бота
+    """
+
+    def __init__(self):
+        self.requests: list[SimpleNamespace] = []
+        self.responses: list[dict] = []  # Ответы на следующие запросы, по порядку
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        url = urlsplit(uri)
+        self.requests.append(SimpleNamespace(method=method, path=url.path, query=parse_qs(url.query),
+                                             body=json.loads(body) if body else None))
+        content = json.dumps(self.responses.pop(0) if self.responses else {}).encode()
+        return httplib2.Response({'status': '200', 'content-type': 'application/json'}), content
+
+
+@pytest.fixture
+def google(tmp_path):
+    """
+    returns a GoogleHttp; its spreadsheet(key, *titles) makes a spreadsheet and worksheets
+    whose client.sheet is the real SheetAPIWrapper on top of it
+    """
+    documents = pathlib.Path(googleapiclient.__file__).parent / 'discovery_cache' / 'documents'
+    shutil.copy(documents / 'sheets.v4.json', tmp_path / 'sheets_discovery.json')
+    http = GoogleHttp()
+    sheet = SheetAPIWrapper(http, str(tmp_path))
+
+    def spreadsheet(key: str, *titles: str) -> tuple[SimpleNamespace, list[SimpleNamespace]]:
+        table = SimpleNamespace(id=key, title=key, client=SimpleNamespace(sheet=sheet))
+        worksheets = [SimpleNamespace(id=index, title=title, spreadsheet=table, client=table.client,
+                                      refresh=lambda update_grid=False: None)
+                      for index, title in enumerate(titles)]
+        return table, worksheets
+
+    http.spreadsheet = spreadsheet
+    return http
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+import bot.database as database
+from bot import archiver
+from bot.models.task_index import task_index
+from bot.settings import Config
+
+from conftest import task_row, timestamp
+
+EXECUTOR = 262388958
+
+
+def closed_long_ago() -> str:
+    return timestamp(datetime.now() - timedelta(days=Config.ARCHIVE_AFTER_DAYS + 10))
+
+
+def test_closed_tasks_move_to_the_archive(tasks):
+    tasks(task_row(1, 'Выполнено', closed_long_ago()), task_row(2), task_row(3, 'Отменено', closed_long_ago()),
+          task_row(4))
+
+    assert archiver.archive_closed() == 2
+
+    assert database.get_ids() == [2, 4]
+    assert (task_index.row_of(2), task_index.row_of(4)) == (2, 3)
+    assert 1 not in task_index and 3 not in task_index
+    archive = database.task_table.worksheets()[-1]
+    assert archive.get_col(1, include_tailing_empty=False)[1:] == ['1', '3']
+
+
+def test_task_changed_while_archiving_postpones_the_delete(tasks, monkeypatch):
+    tasks(task_row(1, 'Выполнено', closed_long_ago()), task_row(2), task_row(3))
+    append = archiver._append_to_archive
+
+    def append_then_take(*args):
+        append(*args)
+        task_index.get(2).take(EXECUTOR)  # Бот продолжает работать, пока архив дописывается
+
+    monkeypatch.setattr(archiver, '_append_to_archive', append_then_take)
+
+    assert archiver.archive_closed() == 0
+
+    assert database.get_ids() == [1, 2, 3]
+    assert task_index.row_of(2) == 3
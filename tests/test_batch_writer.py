@@ -0,0 +1,94 @@
+import threading
+
+import bot.database as database
+from bot import quota
+from bot.batch_writer import writer
+from bot.models.task_index import task_index
+
+from conftest import task_row
+
+
+def test_concurrent_submits_go_in_one_request(client, monkeypatch):
+    monkeypatch.setattr(writer, 'interval', 60)  # Отправляет только flush
+    sheet = database.task_sheet
+    threads = [threading.Thread(target=writer.submit, args=(sheet, (row, 3), [[f'text {row}']]))
+               for row in range(2, 12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writes = client.faults.calls['write']
+
+    writer.flush()
+
+    assert client.faults.calls['write'] == writes + 1
+    assert sheet.get_col(3, include_tailing_empty=False)[1:] == [f'text {row}' for row in range(2, 12)]
+
+
+def test_later_write_to_the_same_range_wins(client, monkeypatch):
+    monkeypatch.setattr(writer, 'interval', 60)
+    first = writer.submit(database.task_sheet, (2, 3), [['old']])
+    second = writer.submit(database.task_sheet, (2, 3), [['new']])
+
+    writer.flush()
+
+    assert first.result(timeout=1) is None and second.result(timeout=1) is None
+    assert database.task_sheet.get_value((2, 3)) == 'new'
+
+
+def test_guard_rejects_only_its_write(monkeypatch):
+    monkeypatch.setattr(writer, 'interval', 60)
+
+    def guard():
+        raise ValueError('row is taken')
+
+    rejected = writer.submit_many(database.task_sheet, [((2, 3), [['rejected']])], guard=guard)
+    written = writer.submit(database.task_sheet, (3, 3), [['written']])
+
+    writer.flush()
+
+    assert isinstance(rejected.exception(timeout=1), ValueError)
+    assert written.result(timeout=1) is None
+    assert database.task_sheet.get_col(3, include_tailing_empty=False)[1:] == ['', 'written']
+
+
+def test_writes_wait_while_google_is_unavailable(client, monkeypatch):
+    monkeypatch.setattr(writer, 'interval', 60)
+    future = writer.submit(database.task_sheet, (2, 3), [['later']])
+    client.faults.fail_next(503, 2)  # Запрос и его повтор
+
+    writer.flush()
+    assert not future.done()
+
+    writer.flush()
+    assert future.result(timeout=1) is None
+    assert database.task_sheet.get_value((2, 3)) == 'later'
+
+
+def test_barrier_waits_for_postponed_writes(client, monkeypatch):
+    monkeypatch.setattr(writer, 'interval', 60)
+    postponed = writer.submit(database.task_sheet, (2, 3), [['interactive']])
+    with quota.lane(quota.BACKGROUND):
+        written = writer.submit(database.task_sheet, (3, 3), [['background']])
+    client.faults.fail_next(503, 2)  # Первым идет запрос полосы INTERACTIVE
+
+    writer.flush()
+    barrier = writer.barrier()
+
+    assert written.done() and not postponed.done()
+    assert not barrier.done()
+    writer.flush()
+    assert barrier.result(timeout=1) is None
+    assert writer.barrier().done()
+
+
+def test_nothing_to_submit_is_done_at_once():
+    assert writer.submit_many(database.task_sheet, []).result(timeout=0) is None
+
+
+def test_unchanged_task_does_not_wait_for_the_queue(tasks, monkeypatch):
+    tasks(task_row(1))
+    monkeypatch.setattr(writer, 'interval', 60)
+    writer.submit(database.task_sheet, (3, 3), [['not written yet']])
+
+    assert task_index.get(1).write_to_table().done()
@@ -0,0 +1,28 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot.handlers.cartridge import ROOM, cartridge_choose_device
+
+
+class Query:
+    def __init__(self, data: str):
+        self.data = data
+        self.answers = []
+        self.edits = []
+
+    async def answer(self, text: str | None = None):
+        self.answers.append(text)
+
+    async def edit_message_text(self, text: str, reply_markup=None):
+        self.edits.append(text)
+
+
+def test_removed_room_leads_back_to_floors():
+    query = Query('999')  # Кабинет убрали из Реестра, пока пользователь выбирал
+    update = SimpleNamespace(callback_query=query)
+
+    state = asyncio.run(cartridge_choose_device(update, SimpleNamespace(user_data={})))
+
+    assert state == ROOM
+    assert 'выберите этаж заново' in query.answers[0]
+    assert query.edits == ['Замена картриджа\n\nЭтаж: выберите']
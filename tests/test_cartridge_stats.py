@@ -0,0 +1,69 @@
+from datetime import date
+from types import SimpleNamespace
+
+import bot.database as database
+from bot.cartridge_stats import CartridgeReport, CartridgeStats
+from bot.gsheets_connector import Printers
+from bot.settings import Config
+
+
+def add_printer(table, title: str, dates: list[str]) -> None:
+    worksheet = table.add_worksheet(title)
+    worksheet.update_values((4, Printers.CHANGE_COLUMN), [['Дата']] + [[day] for day in dates])
+
+
+def test_summary_report_keeps_cells_outside_its_block(monkeypatch):
+    monkeypatch.setattr(Config, 'CARTRIDGE_STATS_CELL', 'B2')
+    table = database.sheets.open(Config.PRINTERS_GSHEET_KEY)
+    summary = table.worksheets()[1]
+    summary.update_values((1, 1), [['Итоги закупок'] + [''] * 7] + [['заметка'] + [''] * 6 + ['справа']] * 30)
+    add_printer(table, '102 HP', ['10.01.2025', '10.04.2025'])
+    add_printer(table, '305 Kyocera', ['05.05.2024'])
+    registry = Printers()
+    stats = CartridgeStats(registry)
+    stats.load()
+
+    stats.write_summary()
+    long_report = len(stats.report.rows())
+    summary.update_value((long_report + 5, 2), 'ниже отчета')
+    del registry.registry['305']  # Принтер списали - отчет станет короче
+    restarted = CartridgeStats(registry)  # Высоту прошлого отчета бот прочитает из его первой строки
+    restarted.load()
+    restarted.write_summary()
+
+    rows = summary.get_values((1, 1), (long_report + 5, 8))
+    assert rows[0][0] == 'Итоги закупок'
+    assert all(row[0] == 'заметка' and row[7] == 'справа' for row in rows[1:])
+    short_report = len(restarted.report.rows())
+    assert short_report < long_report
+    assert rows[1][1].startswith('Расход картриджей на') and rows[1][6] == str(short_report)
+    assert all(row[1:7] == [''] * 6 for row in rows[1 + short_report:1 + long_report])
+    assert rows[long_report + 4][1] == 'ниже отчета'
+
+
+def test_load_and_summary_use_the_real_batch_requests(google, monkeypatch):
+    monkeypatch.setattr(Config, 'CARTRIDGE_STATS_CELL', 'H1')
+    table, (_, summary, hp, kyocera) = google.spreadsheet('printers', 'Реестр', 'Summary', '102 HP', '305 Kyocera')
+    hp.rows = kyocera.rows = 20
+    registry = SimpleNamespace(table=table, summary_sheet=summary, registry={}, in_room=lambda room: [],
+                               _loaded_registry=lambda: {'102': {'HP': hp}, '305': {'Kyocera': kyocera}})
+    google.responses += [
+        {'valueRanges': [{'values': [['10.01.2025'], ['10.04.2025']]}, {'values': [['05.05.2024']]}]},
+        {'valueRanges': [{'values': [[CartridgeReport.HEIGHT_LABEL, '30']]}]},  # Прошлый отчет длиннее
+    ]
+    stats = CartridgeStats(registry)
+
+    stats.load()
+    stats.write_summary()
+
+    load, summary_height, write = google.requests
+    assert load.path == summary_height.path == '/v4/spreadsheets/printers/values:batchGet'
+    assert load.query['ranges'] == ["'102 HP'!E5:E20", "'305 Kyocera'!E5:E20"]
+    assert summary_height.query['ranges'] == ["'Summary'!L1:M1"]
+    assert [history.dates for history in stats.histories.values()] == [
+        [date(2025, 1, 10), date(2025, 4, 10)], [date(2024, 5, 5)]]
+    assert write.path == '/v4/spreadsheets/printers/values:batchUpdateByDataFilter'
+    value_range, = write.body['data']
+    assert value_range['dataFilter'] == {'a1Range': "'Summary'!H1:M30"}
+    rows = len(stats.report.rows())
+    assert value_range['values'][rows:] == [[''] * len(CartridgeReport.HEADER)] * (30 - rows)
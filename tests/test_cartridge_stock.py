@@ -0,0 +1,49 @@
+import threading
+
+import bot.database as database
+from bot.batch_writer import writer
+from bot.cartridge_stock import StockLedger
+from bot.gsheets_connector import Printers
+from bot.settings import Config
+
+
+def test_change_during_reload_is_not_lost(monkeypatch):
+    sheet = database.sheets.open(Config.PRINTERS_GSHEET_KEY).worksheets()[0]
+    sheet.update_values((1, 1), [StockLedger.HEADER, ['CF283A', '3', '']])
+    stock = StockLedger(Printers())
+    stock.load()
+    read_rows = database.read_rows
+    receiving = []
+
+    def read_then_receive(*args):
+        rows = read_rows(*args)
+        thread = threading.Thread(target=stock.receive, args=('CF283A', 2))  # Привоз, пока лист читается
+        thread.start()
+        thread.join(0.2)
+        receiving.append(thread)
+        return rows
+
+    monkeypatch.setattr(database, 'read_rows', read_then_receive)
+
+    assert stock.reload()
+
+    thread, = receiving
+    thread.join(1)
+    assert stock.get('CF283A') == 5
+    writer.flush()
+    assert sheet.get_value((2, StockLedger.AMOUNT_COLUMN)) == '5'
+
+
+def test_stock_is_not_reloaded_over_queued_changes(monkeypatch):
+    sheet = database.sheets.open(Config.PRINTERS_GSHEET_KEY).worksheets()[0]
+    sheet.update_values((1, 1), [StockLedger.HEADER, ['CF283A', '3', '']])
+    stock = StockLedger(Printers())
+    stock.load()
+    monkeypatch.setattr(writer, 'interval', 60)
+    client = database.client
+    stock.use('CF283A')
+    client.faults.fail_next(503, 2)  # Списание не дошло до таблицы
+
+    assert not stock.reload()
+
+    assert stock.get('CF283A') == 2
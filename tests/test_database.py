@@ -0,0 +1,67 @@
+import bot.database as database
+from bot.settings import Config
+
+
+def test_large_grid_is_read_up_to_the_data(client, monkeypatch):
+    monkeypatch.setattr(Config, 'SHEETS_PAGE_THRESHOLD', 200)
+    monkeypatch.setattr(Config, 'SHEETS_PAGE_ROWS', 100)
+    worksheet = database.task_table.add_worksheet('Большой лист', rows=10000, cols=3)
+    worksheet.update_values((2, 1), [[str(row), 'x', ''] for row in range(2, 251)])
+    worksheet.update_values((150, 1), [['', '', '']])  # Пустая строка внутри данных
+    reads = client.faults.calls['read']
+
+    rows = database.read_rows(worksheet, 2, 3)
+
+    assert [row[0] for row in rows] == [str(row) if row != 150 else '' for row in range(2, 251)]
+    assert client.faults.calls['read'] - reads == 4  # Три страницы с данными и одна пустая из 100 страниц сетки
+
+
+def test_batch_update_is_one_google_request(google):
+    table, (sheet,) = google.spreadsheet('tasks', 'Задачи')
+
+    database.batch_update(table, [
+        {'range': database.a1_range(sheet, (2, 3), (2, 3)), 'majorDimension': 'ROWS', 'values': [['text']]},
+        {'range': database.a1_range(sheet, (5, 7), (5, 8)), 'majorDimension': 'ROWS', 'values': [['Взято', 'Акимов']]},
+    ])
+
+    request, = google.requests
+    assert (request.method, request.path) == ('POST', '/v4/spreadsheets/tasks/values:batchUpdateByDataFilter')
+    assert request.body['valueInputOption'] == 'USER_ENTERED'
+    assert request.body['data'] == [
+        {'dataFilter': {'a1Range': "'Задачи'!C2:C2"}, 'majorDimension': 'ROWS', 'values': [['text']]},
+        {'dataFilter': {'a1Range': "'Задачи'!G5:H5"}, 'majorDimension': 'ROWS', 'values': [['Взято', 'Акимов']]},
+    ]
+
+
+def test_batch_get_sheets_reads_the_value_ranges_list(google):
+    table, (tasks, printers) = google.spreadsheet('tasks', 'Задачи', 'Принтеры')
+    google.responses.append({'spreadsheetId': 'tasks', 'valueRanges': [
+        {'range': "'Задачи'!A2:B3", 'majorDimension': 'ROWS', 'values': [['1', 'text'], ['2']]},
+        {'range': "'Принтеры'!B2:B4", 'majorDimension': 'ROWS'},  # Пустой диапазон приходит без values
+    ]})
+
+    values = database.batch_get_sheets(table, [(tasks, (2, 1), (3, 2)), (printers, (2, 2), (4, 2))])
+
+    assert values == [[['1', 'text'], ['2']], []]
+    request, = google.requests
+    assert (request.method, request.path) == ('GET', '/v4/spreadsheets/tasks/values:batchGet')
+    assert request.query['ranges'] == ["'Задачи'!A2:B3", "'Принтеры'!B2:B4"]
+
+
+def test_delete_rows_is_one_batch_update_from_the_bottom(google):
+    table, (_, archive) = google.spreadsheet('tasks', 'Задачи', 'Архив')
+
+    database.delete_rows(archive, [2, 3, 7])
+
+    request, = google.requests
+    assert (request.method, request.path) == ('POST', '/v4/spreadsheets/tasks:batchUpdate')
+    assert request.body == {'requests': [
+        {'deleteDimension': {'range': {'sheetId': 1, 'dimension': 'ROWS', 'startIndex': 6, 'endIndex': 7}}},
+        {'deleteDimension': {'range': {'sheetId': 1, 'dimension': 'ROWS', 'startIndex': 1, 'endIndex': 3}}},
+    ]}
+
+
+def test_batch_update_without_ranges_sends_nothing(google):
+    table, _ = google.spreadsheet('tasks', 'Задачи')
+    database.batch_update(table, [])
+    assert google.requests == []
@@ -0,0 +1,26 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot.handlers.error import sheets_unavailable_handler
+from bot.resilience import SheetsUnavailable
+from bot.settings import Config
+
+
+class Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def test_sheets_unavailable_is_reported_once_per_interval(monkeypatch):
+    context = SimpleNamespace(bot=Bot(), bot_data={}, error=SheetsUnavailable('503 Service Unavailable'))
+
+    for _ in range(3):  # Выключатель не размыкался - ошибки после повторов
+        asyncio.run(sheets_unavailable_handler(None, context))
+    assert len(context.bot.sent) == 1
+
+    monkeypatch.setattr(Config, 'SHEETS_ALERT_INTERVAL', 0)
+    asyncio.run(sheets_unavailable_handler(None, context))
+    assert len(context.bot.sent) == 2
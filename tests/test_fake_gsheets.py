@@ -0,0 +1,70 @@
+import inspect
+
+import pytest
+from pygsheets.client import Client
+from pygsheets.sheet import SheetAPIWrapper
+from pygsheets.spreadsheet import Spreadsheet
+from pygsheets.worksheet import Worksheet
+
+from bot import database
+from bot.fake_gsheets import FakeClient, FakeSheetsAPI, FakeSpreadsheet, FakeWorksheet
+
+
+FAKE_ONLY = {'from_config'}  # Публичные методы таблиц в памяти, которых нет у pygsheets
+
+
+def _parameters(function) -> list[tuple]:
+    # Аннотации не сравниваются, перечисления pygsheets в значениях по умолчанию - по их строковому значению
+    return [(parameter.name, parameter.kind, getattr(parameter.default, 'value', parameter.default))
+            for parameter in inspect.signature(function).parameters.values()]
+
+
+@pytest.mark.parametrize('fake, real', [(FakeSheetsAPI, SheetAPIWrapper), (FakeWorksheet, Worksheet),
+                                        (FakeSpreadsheet, Spreadsheet), (FakeClient, Client)])
+def test_fake_matches_pygsheets(fake, real):
+    for name, member in vars(fake).items():
+        if name.startswith('_') and name != '_execute_requests' or name in FAKE_ONLY:
+            continue
+        original = inspect.getattr_static(real, name, None)
+        assert original is not None, f'{fake.__name__}.{name} is not in {real.__name__}'
+        if isinstance(member, property) or isinstance(original, property):
+            assert isinstance(member, property) and isinstance(original, property), f'{fake.__name__}.{name}'
+        elif callable(member):
+            assert _parameters(member) == _parameters(original), f'{fake.__name__}.{name}'
+
+
+# Одинаковые вызовы для настоящего SheetAPIWrapper (ответ Google заготовлен) и таблиц в памяти.
+# Диапазоны без названия листа относятся к первому листу, его sheetId - 0
+CALLS = [
+    ('values_batch_get', (['A1:B2'],), {'valueRanges': [{'range': 'A1:B2', 'values': [['1']]}]}),
+    ('values_batch_update', ({'range': 'A2:B2', 'majorDimension': 'ROWS', 'values': [['1', 'x']]},), {}),
+    ('values_batch_update_by_data_filter',
+     ([{'dataFilter': {'a1Range': 'A2:A2'}, 'majorDimension': 'ROWS', 'values': [['1']]}],), {}),
+    ('batch_update', ({'deleteDimension': {'range': {'sheetId': 0, 'dimension': 'ROWS',
+                                                     'startIndex': 1, 'endIndex': 2}}},), {'replies': [{}]}),
+    ('values_append', ([['1', 'x']], 'ROWS', 'A1'),
+     {'tableRange': 'A1:B1',
+      'updates': {'updatedRange': 'A2:B2', 'updatedRows': 1, 'updatedColumns': 2, 'updatedCells': 2}}),
+]
+
+
+@pytest.mark.parametrize('method, args, response', CALLS, ids=[call[0] for call in CALLS])
+def test_fake_takes_and_returns_what_pygsheets_does(google, method, args, response):
+    table, _ = google.spreadsheet('tasks', 'Задачи')
+    google.responses.append(response)
+
+    expected = getattr(table.client.sheet, method)('tasks', *args)
+    result = getattr(database.client.sheet, method)('tasks', *args)
+
+    assert type(result) is type(expected)
+    if isinstance(expected, dict):
+        assert set(expected) <= set(result)
+
+
+def test_worksheet_ids_survive_inserted_sheets():
+    table = database.task_table
+    archive = table.add_worksheet('Архив', rows=10, cols=3)
+    first = table.add_worksheet('Первый', index=0)
+
+    assert (first.index, table.worksheet('id', archive.id)) == (0, archive)
+    assert archive.index == len(table.worksheets()) - 1
@@ -0,0 +1,77 @@
+import json
+
+import bot.database as database
+from bot.batch_writer import writer
+from bot.journal import journal
+from bot.models.task_index import task_index
+from bot.settings import Config
+
+from conftest import task_row
+
+EXECUTOR = 262388958
+
+
+def restart() -> None:
+    """
+    Бот упал: журнал читается из файла заново, индекс задач - из таблицы
+    """
+    from bot.models.task import Task
+    appliers, rejecters, path = journal._appliers, journal._rejecters, journal.path
+    if journal._file:
+        journal._file.close()
+    journal.__init__(path, Config.JOURNAL_MAX_BYTES)
+    journal._appliers, journal._rejecters = appliers, rejecters
+    task_index.__init__()
+    Task.load_index()
+
+
+def test_change_survives_google_outage_and_restart(client, tasks, monkeypatch):
+    tasks(task_row(1))
+    monkeypatch.setattr(writer, 'interval', 60)
+    task_index.get(1).take(EXECUTOR)
+    client.faults.fail_next(503, 2)
+    writer.flush()
+    assert journal.pending_count == 1
+
+    writer.shutdown()
+    writer.__init__()
+    restart()
+    journal.replay()
+    writer.flush()
+
+    assert journal.pending_count == 0
+    assert task_index.get(1).status == Config.STATUS_TAKEN
+    assert database.task_sheet.get_value((2, Config.task_columns['status'])) == 'Взято'
+
+
+def test_new_task_colliding_on_replay_gets_the_next_id(tasks):
+    tasks(task_row(1), task_row(5))  # Строку 3 заняли руками, пока бот лежал
+    cells = {str(col): value for col, value in enumerate(task_row(2), start=1)}
+    journal.path.write_text(json.dumps({'s': 1, 'k': 'task', 'd': {'task_id': 2, 'row': 3, 'cells': cells,
+                                                                   'new': True}}) + '\n')
+    restart()
+
+    journal.replay()
+    writer.flush()
+    journal.replay()  # Отклоненная запись получает новый номер
+    writer.flush()
+
+    assert journal.pending_count == 0
+    assert database.get_ids() == [1, 5, 6]
+    assert database.task_sheet.get_value((4, Config.task_columns['text'])) == 'Задача 2'
+
+
+def test_rejected_change_is_kept_and_reported_once(monkeypatch):
+    def apply(change: dict) -> None:
+        raise KeyError(change['room'])
+
+    monkeypatch.setitem(journal._appliers, 'test', apply)
+    seq = journal.append('test', {'room': '999'})
+    journal.release(seq)
+
+    journal.replay()
+    journal.replay()
+
+    assert journal.pending_count == 1
+    assert [(failed_seq, kind) for failed_seq, kind, _, _ in journal.take_failures()] == [(seq, 'test')]
+    assert journal.take_failures() == []
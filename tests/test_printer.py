@@ -0,0 +1,21 @@
+from bot.models.printer import Printer
+
+
+def test_read_all_reads_every_card_with_one_batch_get(google):
+    table, (hp, canon) = google.spreadsheet('printers', '102 HP', '203 Canon')
+    google.responses.append({'spreadsheetId': 'printers', 'valueRanges': [
+        {'range': "'102 HP'!B2:B12", 'majorDimension': 'ROWS',
+         'values': [['HP LJ 1020'], [], ['Q2612A'], ['Работает'], [], ['PRN-102'], ['10.0.0.5']]},
+        {'range': "'203 Canon'!B2:B12", 'majorDimension': 'ROWS'},  # Пустая карточка
+    ]})
+
+    printers = Printer.read_all({'102': {'HP': hp}, '203': {'Canon': canon}})
+
+    assert printers == {
+        '102': [Printer('102', 'HP', model='HP LJ 1020', cartridge='Q2612A', status='Работает',
+                        network_name='PRN-102', ip_address='10.0.0.5')],
+        '203': [Printer('203', 'Canon')],
+    }
+    request, = google.requests
+    assert (request.method, request.path) == ('GET', '/v4/spreadsheets/printers/values:batchGet')
+    assert request.query['ranges'] == ["'102 HP'!B2:B12", "'203 Canon'!B2:B12"]
@@ -0,0 +1,23 @@
+from bot.storage import TASK_FIELDS, SQLiteStore
+
+
+def test_chunks_do_not_skip_tasks_with_the_same_row(tmp_path):
+    store = SQLiteStore(tmp_path / 'support.sqlite3')
+    for task_id, row in ((1, 2), (2, 3), (3, 3), (4, 4)):  # Задачу 3 перенумеровали в занятую строку
+        store.save_task(task_id, row, {'task_id': task_id, 'text': f'Задача {task_id}'}, new=True)
+
+    chunks = list(store.iter_rows(2))
+
+    id_index = TASK_FIELDS.index('task_id')
+    assert [[values[id_index] for values in chunk.values()] for chunk in chunks] == [[1, 2], [3, 4]]
+
+
+def test_task_is_clean_once_written(tmp_path):
+    store = SQLiteStore(tmp_path / 'support.sqlite3')
+    store.save_task(1, 2, {'task_id': 1, 'text': 'Задача 1'}, new=True)
+    (task_id, row, _, fields, new, version), = store.dirty_tasks()
+    assert (task_id, row, fields, new) == (1, 2, {'task_id', 'text'}, True)
+
+    store.mark_task_clean(task_id, version)
+
+    assert store.dirty_tasks() == []
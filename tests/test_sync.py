@@ -0,0 +1,38 @@
+import bot.database as database
+from bot.models.task_index import task_index
+from bot.settings import Config
+from bot.sync import task_sync
+
+from conftest import task_row
+
+EXECUTOR = 262388958  # Акимов Дмитрий в Config.mappings
+
+
+def test_hand_edits_reach_the_index(tasks):
+    tasks(task_row(1), task_row(2))
+    task_sync.sync()
+    database.task_sheet.update_value((3, Config.task_columns['status']), 'Отменено')
+
+    assert task_sync.sync()
+
+    assert task_index.get(2).status == Config.STATUS_CANCELED
+
+
+def test_task_taken_during_sync_is_not_overwritten(tasks, monkeypatch):
+    tasks(task_row(1), task_row(2))
+    task_sync.sync()
+    database.task_sheet.update_value((3, Config.task_columns['text']), 'Поправили руками')
+    batch_get = database.batch_get
+
+    def read_then_take(*args, **kwargs):
+        blocks = batch_get(*args, **kwargs)
+        task_index.get(1).take(EXECUTOR)  # Админ взял задачу, пока строки шли из Google
+        return blocks
+
+    monkeypatch.setattr(database, 'batch_get', read_then_take)
+
+    task_sync.sync()
+
+    assert task_index.get(1).status == Config.STATUS_TAKEN
+    assert task_index.get(1).executor == EXECUTOR
+    assert task_index.get(2).text == 'Поправили руками'
@@ -0,0 +1,23 @@
+from datetime import datetime
+
+import bot.database as database
+from bot.batch_writer import writer
+from bot.models.task_index import task_index
+from bot.settings import Config
+
+from conftest import task_row
+
+
+def test_added_comment_is_written_with_the_earlier_ones(tasks):
+    row = task_row(1)
+    row[list(Config.task_columns).index('comments')] = '[01.09.2025 11:00] Проверьте кабель'
+    tasks(row)
+    task = task_index.get(1)
+
+    task._add_comment('Кабель заменили', datetime(2025, 9, 2, 9, 30))
+
+    cell = '[01.09.2025 11:00] Проверьте кабель\n[02.09.2025 09:30] Кабель заменили'
+    assert task.changed['comments'] == cell  # То же, что write_to_table запишет в ячейку
+    task.write_to_table()
+    writer.flush()
+    assert database.task_sheet.get_value((2, Config.task_columns['comments'])) == cell
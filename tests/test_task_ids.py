@@ -0,0 +1,35 @@
+import asyncio
+import threading
+
+import bot.database as database
+import bot.repository as repository
+from bot.models.task import Task
+from bot.models.task_index import task_index
+
+from conftest import task_row
+
+
+def test_concurrent_tasks_get_different_ids_and_rows(tasks):
+    tasks(task_row(1), task_row(2))
+    created = []
+    threads = [threading.Thread(target=lambda: created.append(Task.new(101, 'Проектор', 'Учитель')))
+               for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(task.task_id for task in created) == list(range(3, 23))
+    assert sorted(task_index.row_of(task.task_id) for task in created) == list(range(4, 24))
+
+
+def test_row_taken_by_hand_gives_the_task_the_next_id(tasks):
+    tasks(task_row(1))
+    database.task_sheet.update_row(3, [str(value) for value in task_row(7)])  # Строку заняли руками
+
+    task, result = asyncio.run(repository.create_task(101, 'Проектор', 'Учитель'))
+
+    assert result is not repository.QUEUED
+    assert task.task_id == 8
+    assert database.get_ids() == [1, 7, 8]
+    assert task_index.row_of(8) == 4